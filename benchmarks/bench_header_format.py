@@ -0,0 +1,51 @@
+"""Compare the v1 (fixed) and v2 (varint) header formats: the bytes on the
+wire and the cost of encoding and decoding a packet.
+
+Run from the repository root:
+    $ PYTHONPATH=src python -m benchmarks.bench_header_format
+"""
+import timeit
+
+from csbuilder.cspacket import CSPacket
+from csbuilder.cspacket.header import FORMAT_V1, FORMAT_V2
+
+from tests.schemes import MyProtocols, SubmitRoles
+from tests.submit_scheme import SubmitServerStates
+
+
+N = 100000
+
+
+def measure(function, n: int = N) -> float:
+    "Return the number of microseconds per call."
+    return min(timeit.repeat(function, number=n, repeat=5)) / n * 1e6
+
+
+def main():
+    packets = [
+        # A heartbeat or ACK, only a header.
+        ("ack", CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.ACCEPT)),
+        ("small", CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER,
+            SubmitServerStates.SUCCESS, option=b"id=42", payload=b"x" * 32)),
+        ("large", CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER,
+            SubmitServerStates.SUCCESS, payload=b"x" * 4096)),
+    ]
+
+    print("{:<8}{:>8}{:>8}{:>12}{:>12}{:>12}{:>12}".format(
+        "packet", "v1 B", "v2 B", "v1 enc us", "v2 enc us", "v1 dec us", "v2 dec us"))
+    for name, packet in packets:
+        v1 = packet.to_bytes(version=FORMAT_V1)
+        v2 = packet.to_bytes(version=FORMAT_V2)
+        print("{:<8}{:>8}{:>8}{:>12.2f}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+            name,
+            len(v1),
+            len(v2),
+            measure(lambda: packet.to_bytes(version=FORMAT_V1)),
+            measure(lambda: packet.to_bytes(version=FORMAT_V2)),
+            measure(lambda: CSPacket.from_bytes(v1, version=FORMAT_V1)),
+            measure(lambda: CSPacket.from_bytes(v2, version=FORMAT_V2))
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Measure the extraction of a packet of the first and of the last of many
+registered protocols; with the packet index of Pool both cost the same.
+
+Run from the repository root:
+    $ PYTHONPATH=src python -m benchmarks.bench_lookup
+"""
+import timeit
+
+import csbuilder
+from csbuilder.cspacket import CSPacket
+from csbuilder.standard import Protocols, Roles, States
+
+
+N = 100000
+PROTOCOLS = 64
+
+
+def register(i: int):
+    "Register a protocol with two roles and return a packet of it."
+    protocol = csbuilder.protocols(Protocols("Protocol{}".format(i), {"P": 1000 + i})).P
+    roles = csbuilder.roles(protocol)(Roles("Roles{}".format(i), {"A": 0, "B": 1}))
+    states = csbuilder.states(protocol, roles.A)(States("States{}".format(i), {"IGNORE": 0, "PING": 1}))
+    csbuilder.states(protocol, roles.B)(States("OtherStates{}".format(i), {"IGNORE": 0}))
+
+    return CSPacket(protocol, roles.A, states.PING, payload=b"ping")
+
+
+def measure(data: bytes, n: int = N) -> float:
+    "Return the number of microseconds of from_bytes() per packet."
+    return min(timeit.repeat(lambda: CSPacket.from_bytes(data), number=n, repeat=5)) / n * 1e6
+
+
+def main():
+    packets = [register(i) for i in range(PROTOCOLS)]
+
+    print("{:<16}{:>16}".format("protocol", "us/packet"))
+    print("{:<16}{:>16.2f}".format("first", measure(packets[0].to_bytes())))
+    print("{:<16}{:>16.2f}".format("last ({})".format(PROTOCOLS), measure(packets[-1].to_bytes())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Measure the memory held by in-flight packets and results, compared with
+the layout before __slots__ (every instance had a __dict__).
+
+Run from the repository root:
+    $ PYTHONPATH=src python -m benchmarks.bench_memory
+"""
+import gc
+import tracemalloc
+
+from hks_pylib.done import Done
+
+from csbuilder.cspacket import CSPacket, CSPacketField
+from csbuilder.scheme import SchemeResult
+from csbuilder.session import SessionResult
+
+from tests.schemes import MyProtocols, SubmitRoles
+from tests.submit_scheme import SubmitServerStates
+
+
+N = 10000
+
+
+def measure(factory, n: int = N) -> float:
+    "Return the number of bytes allocated per object created by factory."
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for _ in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Exclude the list holding the objects.
+    return (after - before - objects.__sizeof__()) / n
+
+
+class DictPacket(object):
+    """The layout of CSPacket before __slots__: an instance __dict__ holding
+    the field dict of the packet (CSPacketField -> value) and _is_valid."""
+    def __init__(self, protocol, role, state) -> None:
+        self.__packet = {
+                CSPacketField.PROTOCOL: protocol,
+                CSPacketField.STATE: state,
+                CSPacketField.ROLE: role,
+                CSPacketField.OPTION: b"",
+                CSPacketField.PAYLOAD: b""
+            }
+
+        self._is_valid = True
+
+
+class DictSchemeResult(object):
+    "The attribute layout of SchemeResult before __slots__."
+    def __init__(self, destination, packet, is_continue, result) -> None:
+        self.destination = destination
+        self.packet = packet
+        self.is_continue = is_continue
+        self.result = result
+
+
+class DictSessionResult(object):
+    "The attribute layout of SessionResult before __slots__."
+    def __init__(self, destination, packet) -> None:
+        self.destination = destination
+        self.packet = packet
+
+
+def new_packet():
+    return CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.ACCEPT)
+
+
+def new_scheme_result(packet=new_packet(), done=Done(None)):
+    return SchemeResult("destination", packet, True, done)
+
+
+def new_session_result(packet=new_packet()):
+    return SessionResult("destination", packet)
+
+
+def new_dict_packet():
+    return DictPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.ACCEPT)
+
+
+def new_dict_scheme_result(packet=new_packet(), done=Done(None)):
+    return DictSchemeResult("destination", packet, True, done)
+
+
+def new_dict_session_result(packet=new_packet()):
+    return DictSessionResult("destination", packet)
+
+
+def main():
+    print("{:<16}{:>16}{:>16}".format("object", "before (B/obj)", "after (B/obj)"))
+    for name, before, after in [
+                ("CSPacket", new_dict_packet, new_packet),
+                ("SchemeResult", new_dict_scheme_result, new_scheme_result),
+                ("SessionResult", new_dict_session_result, new_session_result)
+            ]:
+        print("{:<16}{:>16.1f}{:>16.1f}".format(name, measure(before), measure(after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,7 @@ setuptools.setup(
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.7.1",
     install_requires=["hks_pynetwork>=0.0.4", "hks_pylib>=0.0.7", "hkserror>=0.0.2"],
+    extras_require={"numpy": ["numpy>=1.16"]},
     setup_requires=["pytest-runner==4.4"],
     tests_require=["pytest==4.4.1"],
     test_suite="tests",
@@ -1,2 +1,2 @@
 from csbuilder.version import __version__ 
-from csbuilder.pool import roles, protocols, states, scheme, response, active_activation
\ No newline at end of file
+from csbuilder.pool import roles, protocols, states, scheme, response, active_activation, dictionary, option, payload
\ No newline at end of file
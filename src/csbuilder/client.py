@@ -98,6 +98,9 @@ class ClientResponser(Responser):
         if self._socket.isworking() is False:
             raise STCPSocketError("Client has not connected to the Server.")
 
+        if self.requires_negotiation():
+            self.negotiate(self._forwarder.name)
+
         super()._start()
 
     def close(self) -> None:
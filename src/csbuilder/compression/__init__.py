@@ -0,0 +1,2 @@
+from csbuilder.compression.codec import Codecs, CompressionPolicy, compress, decompress, available_codecs
+from csbuilder.compression.dictionary import CompressionDictionary, train_dictionary, compression_ratio
@@ -0,0 +1,194 @@
+import zlib
+from typing import List, Tuple
+
+from hks_pylib.hksenum import HKSEnum
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketExtractingError
+from csbuilder.compression.dictionary import CompressionDictionary
+
+try:
+    import bz2
+except ImportError:  # Python may be built without bz2 or lzma.
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+class Codecs(HKSEnum):
+    "The compression codecs, the value is the identifier sent on the wire."
+    ZLIB = 1
+    BZ2 = 2
+    LZMA = 3
+
+    # Raw deflate with the preset dictionary of the protocol (see
+    # CompressionDictionary), for small and repetitive payloads.
+    ZLIB_DICT = 4
+
+
+def _zlib_compress(data, level, dictionary):
+    return zlib.compress(data, -1 if level is None else level)
+
+
+def _bz2_compress(data, level, dictionary):
+    return bz2.compress(data, 9 if level is None else level)
+
+
+def _lzma_compress(data, level, dictionary):
+    return lzma.compress(data, preset=level)
+
+
+def _zlib_dict_compress(data, level, dictionary: CompressionDictionary):
+    compressor = zlib.compressobj(
+            -1 if level is None else level,
+            zlib.DEFLATED,
+            -zlib.MAX_WBITS,
+            zdict=dictionary.data
+        )
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zlib_dict_decompressor(dictionary: CompressionDictionary):
+    return zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary.data)
+
+
+# The default maximum size of a decompressed payload.
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# The (compressor, decompressor factory, (lowest, highest) level) of codecs.
+# Both functions receive the dictionary, only used by Codecs.ZLIB_DICT.
+_COMPRESSORS = {
+        Codecs.ZLIB: (_zlib_compress, lambda dictionary: zlib.decompressobj(), (-1, 9)),
+        Codecs.ZLIB_DICT: (_zlib_dict_compress, _zlib_dict_decompressor, (-1, 9))
+    }
+
+if bz2 is not None:
+    _COMPRESSORS[Codecs.BZ2] = (
+        _bz2_compress, lambda dictionary: bz2.BZ2Decompressor(), (1, 9))
+
+if lzma is not None:
+    _COMPRESSORS[Codecs.LZMA] = (
+        _lzma_compress, lambda dictionary: lzma.LZMADecompressor(), (0, 9))
+
+# The codecs which cannot be used without a dictionary.
+DICTIONARY_CODECS = (Codecs.ZLIB_DICT,)
+
+
+def available_codecs() -> List[Codecs]:
+    return list(_COMPRESSORS.keys())
+
+
+def level_range(codec: Codecs) -> Tuple[int, int]:
+    if codec not in _COMPRESSORS:
+        raise HFormatError("The codec {} is not available.".format(codec))
+
+    return _COMPRESSORS[codec][2]
+
+
+def compress(
+                codec: Codecs,
+                data,
+                level: int = None,
+                dictionary: CompressionDictionary = None
+            ) -> bytes:
+    if codec not in _COMPRESSORS:
+        raise HFormatError("The codec {} is not available.".format(codec))
+
+    if codec in DICTIONARY_CODECS and dictionary is None:
+        raise HFormatError("The codec {} requires a dictionary.".format(codec))
+
+    return _COMPRESSORS[codec][0](data, level, dictionary)
+
+
+def decompress(
+                codec_id: int,
+                data,
+                max_size: int = MAX_DECOMPRESSED_SIZE,
+                dictionary: CompressionDictionary = None
+            ) -> bytes:
+    """Decompress data, the decompression stops as soon as the output exceeds
+    max_size bytes, so a small message cannot expand without bound."""
+    codec = Codecs.get(codec_id, None)
+    if codec is None or codec not in _COMPRESSORS:
+        raise PacketExtractingError("Unknown compression codec {}.".format(codec_id))
+
+    if codec in DICTIONARY_CODECS and dictionary is None:
+        raise PacketExtractingError("There is no dictionary to decompress "
+        "the payload with {}.".format(codec))
+
+    decompressor = _COMPRESSORS[codec][1](dictionary)
+    try:
+        output = decompressor.decompress(data, max_size + 1)
+    except Exception as e:
+        raise PacketExtractingError("Cannot decompress the payload "
+        "with {} ({}).".format(codec, e))
+
+    if len(output) > max_size:
+        raise PacketExtractingError("The decompressed payload exceeds "
+        "{} bytes.".format(max_size))
+
+    if not decompressor.eof:
+        raise PacketExtractingError("The compressed payload is truncated.")
+
+    return output
+
+
+class CompressionPolicy(object):
+    """Compress the payloads which are equal to or larger than threshold bytes.
+    The dictionary is required by Codecs.ZLIB_DICT, it must be the dictionary
+    registered for the protocol in Pool (see Pool.dictionary())."""
+
+    __slots__ = ("codec", "threshold", "level", "dictionary")
+
+    def __init__(
+                    self,
+                    codec: Codecs = Codecs.ZLIB,
+                    threshold: int = 256,
+                    level: int = None,
+                    dictionary: CompressionDictionary = None
+                ) -> None:
+        if not isinstance(codec, Codecs):
+            raise HTypeError("codec", codec, Codecs)
+
+        if not isinstance(threshold, int):
+            raise HTypeError("threshold", threshold, int)
+
+        if threshold < 0:
+            raise HFormatError("The parameter threshold expected a non-negative integer.")
+
+        if level is not None and not isinstance(level, int):
+            raise HTypeError("level", level, int, None)
+
+        if level is not None:
+            low, high = level_range(codec)
+            if level < low or level > high:
+                raise HFormatError("The level of {} expected to be between "
+                "{} and {}, but got {}.".format(codec, low, high, level))
+
+        if dictionary is not None and not isinstance(dictionary, CompressionDictionary):
+            raise HTypeError("dictionary", dictionary, CompressionDictionary, None)
+
+        if codec in DICTIONARY_CODECS and dictionary is None:
+            raise HFormatError("The codec {} requires a dictionary.".format(codec))
+
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+
+    def accept(self, payload) -> bool:
+        return len(payload) >= self.threshold
+
+    def compress(self, payload) -> bytes:
+        return compress(self.codec, payload, self.level, self.dictionary)
+
+    def __str__(self) -> str:
+        return "{" + "codec = {}, threshold = {}, level = {}, dictionary = {}".format(
+            self.codec, self.threshold, self.level, self.dictionary) + "}"
+
+    def __repr__(self) -> str:
+        return str(self)
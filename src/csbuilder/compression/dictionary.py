@@ -0,0 +1,111 @@
+import zlib
+from typing import Dict, List, Tuple
+
+from hkserror.hkserror import HFormatError, HTypeError
+
+
+# The zlib window, a preset dictionary larger than it is never used.
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+class CompressionDictionary(object):
+    """A zlib preset dictionary of a protocol. The version and the checksum
+    are announced in the hello message, so that both peers can verify that
+    they use the same dictionary before compressing with it."""
+
+    __slots__ = ("data", "version", "checksum")
+
+    def __init__(self, data: bytes, version: int = 0) -> None:
+        if not isinstance(data, bytes):
+            raise HTypeError("data", data, bytes)
+
+        if not data or len(data) > MAX_DICTIONARY_SIZE:
+            raise HFormatError("The dictionary expected 1 to {} bytes, but got "
+            "{} bytes.".format(MAX_DICTIONARY_SIZE, len(data)))
+
+        if not isinstance(version, int):
+            raise HTypeError("version", version, int)
+
+        if version < 0 or version > 0xFFFF:
+            raise HFormatError("The parameter version expected to be between "
+            "0 and 65535, but got {}.".format(version))
+
+        self.data = data
+        self.version = version
+        self.checksum = zlib.adler32(data)
+
+    def identifier(self) -> Tuple[int, int]:
+        return self.version, self.checksum
+
+    def __str__(self) -> str:
+        return "{" + "version = {}, size = {}, checksum = {:#010x}".format(
+            self.version, len(self.data), self.checksum) + "}"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def train_dictionary(samples: List[bytes], size: int = 4096, segment: int = 16) -> bytes:
+    """Build a preset dictionary from sample payloads. The segments found in
+    the most samples are kept, the most common ones at the end of the
+    dictionary, where deflate reaches them with the shortest distances."""
+    if not isinstance(samples, list):
+        raise HTypeError("samples", samples, list)
+
+    if not isinstance(size, int):
+        raise HTypeError("size", size, int)
+
+    if size <= 0 or size > MAX_DICTIONARY_SIZE:
+        raise HFormatError("The parameter size expected to be between "
+        "1 and {}.".format(MAX_DICTIONARY_SIZE))
+
+    if not isinstance(segment, int):
+        raise HTypeError("segment", segment, int)
+
+    if segment <= 0:
+        raise HFormatError("The parameter segment expected an positive integer.")
+
+    # The number of samples containing each segment.
+    counts: Dict[bytes, int] = {}
+    for sample in samples:
+        sample = bytes(sample)
+        seen = set(sample[i: i + segment] for i in range(0, max(len(sample) - segment, 0) + 1))
+        for piece in seen:
+            counts[piece] = counts.get(piece, 0) + 1
+
+    ranked = sorted(
+            (piece for piece, count in counts.items() if count > 1),
+            key=lambda piece: (counts[piece], piece),
+            reverse=True
+        )
+
+    pieces = []
+    total = 0
+    for piece in ranked:
+        if total + len(piece) > size:
+            break
+
+        # Overlapping segments of the same text are kept only once.
+        if any(piece in kept for kept in pieces):
+            continue
+
+        pieces.append(piece)
+        total += len(piece)
+
+    return b"".join(reversed(pieces))
+
+
+def compression_ratio(samples: List[bytes], dictionary: bytes = None, level: int = -1) -> float:
+    "Return the total size of compressed samples divided by their raw size."
+    raw = 0
+    compressed = 0
+    for sample in samples:
+        if dictionary is None:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+
+        raw += len(sample)
+        compressed += len(compressor.compress(sample) + compressor.flush())
+
+    return compressed / raw if raw else 1.0
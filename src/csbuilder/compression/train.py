@@ -0,0 +1,78 @@
+"""Build the preset compression dictionary of a protocol from a capture and
+report the compression ratio achieved on it.
+
+The capture is a stream of CSFramer frames (e.g. written by CSFramer.send
+into a file). Only the payloads of the given protocol are used:
+    $ python -m csbuilder.compression.train capture.bin --protocol 1 \\
+        --size 4096 --output submit.dict
+"""
+import argparse
+from typing import List
+
+from csbuilder.cspacket.header import CSHeader
+from csbuilder.cspacket.framer import CSFramer
+from csbuilder.compression.dictionary import train_dictionary, compression_ratio
+
+from csbuilder.errors.packet import PacketExtractingError
+
+
+def read_payloads(data: bytes, protocol: int = None) -> List[bytes]:
+    """Return the payloads of the packets in a CSFramer stream. The packets
+    are not decoded by Pool, so the protocols do not need to be imported."""
+    view = memoryview(data)
+    cursor = 0
+    payloads = []
+    while cursor < len(view):
+        if len(view) - cursor < CSFramer.LENGTH.size:
+            raise PacketExtractingError("The capture ends with a truncated frame.")
+
+        length, = CSFramer.LENGTH.unpack_from(view, cursor)
+        cursor += CSFramer.LENGTH.size
+
+        frame = view[cursor: cursor + length]
+        cursor += length
+        if len(frame) < length:
+            raise PacketExtractingError("The capture ends with a truncated frame.")
+
+        iprotocol, _, _, option_field = CSHeader.unpack_from(frame)
+        if option_field & CSHeader.FLAGS_MASK:
+            continue  # A compressed packet is useless to train.
+
+        if protocol is None or iprotocol == protocol:
+            payloads.append(bytes(frame[CSHeader.SIZE + option_field:]))
+
+    return payloads
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="a file of CSFramer frames")
+    parser.add_argument("--protocol", type=int, default=None,
+        help="the value of the protocol (all protocols by default)")
+    parser.add_argument("--size", type=int, default=4096,
+        help="the maximum size of the dictionary")
+    parser.add_argument("--output", default=None,
+        help="the file to write the dictionary into")
+    args = parser.parse_args(argv)
+
+    with open(args.capture, "rb") as f:
+        payloads = read_payloads(f.read(), args.protocol)
+
+    if not payloads:
+        parser.error("There are no payloads in the capture.")
+
+    dictionary = train_dictionary(payloads, args.size)
+
+    print("payloads          {}".format(len(payloads)))
+    print("raw bytes         {}".format(sum(len(payload) for payload in payloads)))
+    print("dictionary bytes  {}".format(len(dictionary)))
+    print("ratio (zlib)      {:.3f}".format(compression_ratio(payloads)))
+    print("ratio (zlib+dict) {:.3f}".format(compression_ratio(payloads, dictionary)))
+
+    if args.output is not None:
+        with open(args.output, "wb") as f:
+            f.write(dictionary)
+
+
+if __name__ == "__main__":
+    main()
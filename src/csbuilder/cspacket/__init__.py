@@ -1 +1,6 @@
+from csbuilder.cspacket.header import CSHeader, CSHeaderV2, FORMAT_V1, FORMAT_V2
 from csbuilder.cspacket.cspacket import CSPacket, CSPacketField
+from csbuilder.cspacket.framer import CSFramer, CSDeframer
+from csbuilder.cspacket.batch import CSBatch
+from csbuilder.cspacket.hello import CSHello, CSFormat
+from csbuilder.cspacket.payload import PayloadSchema, PayloadObject
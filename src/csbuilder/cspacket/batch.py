@@ -0,0 +1,98 @@
+from typing import List, Optional
+
+from csbuilder.cspacket.header import CSHeader, FORMAT_V1
+from csbuilder.cspacket.framer import CSFramer
+from csbuilder.cspacket.cspacket import CSPacket, Buffer, BUFFER_TYPES
+from csbuilder.cspacket.control import ControlStates, control_header, is_control_state
+from csbuilder.compression.codec import CompressionPolicy, MAX_DECOMPRESSED_SIZE
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketExtractingError
+
+
+class CSBatch(object):
+    """An envelope carrying many packets in one message. It is a control
+    message whose payload is the packets framed by CSFramer."""
+
+    @staticmethod
+    def pack(
+                packets: List[CSPacket],
+                compression: List[Optional[CompressionPolicy]] = None,
+                version: int = FORMAT_V1
+            ) -> List[Buffer]:
+        """The compression is the policies of packets (None keeps all
+        uncompressed). The batch itself is a control message, which always
+        has a v1 header, the version is the header format of its packets."""
+        if not isinstance(packets, list):
+            raise HTypeError("packets", packets, list)
+
+        if compression is not None and not isinstance(compression, list):
+            raise HTypeError("compression", compression, list, None)
+
+        if compression is None:
+            compression = [None] * len(packets)
+
+        if len(compression) != len(packets):
+            raise HFormatError("The parameter compression expected {} policies, "
+            "but got {}.".format(len(packets), len(compression)))
+
+        buffers = [control_header(ControlStates.BATCH)]
+        for packet, policy in zip(packets, compression):
+            buffers.extend(CSFramer.frame(packet, policy, version))
+
+        return buffers
+
+    @staticmethod
+    def to_bytes(
+                    packets: List[CSPacket],
+                    compression: List[Optional[CompressionPolicy]] = None,
+                    version: int = FORMAT_V1
+                ) -> bytes:
+        return b"".join(CSBatch.pack(packets, compression, version))
+
+    @staticmethod
+    def is_batch(data: Buffer) -> bool:
+        return is_control_state(data, ControlStates.BATCH)
+
+    @staticmethod
+    def unpack(
+                data: Buffer,
+                copy: bool = True,
+                max_decompressed_size: int = MAX_DECOMPRESSED_SIZE,
+                version: int = FORMAT_V1
+            ) -> List[CSPacket]:
+        """Extract the packets of a batch. If copy is False, the option and
+        payload of each packet are views into data (see CSPacket.from_buffer)."""
+        if not isinstance(data, BUFFER_TYPES):
+            raise HTypeError("data", data, *BUFFER_TYPES)
+
+        if not CSBatch.is_batch(data):
+            raise PacketExtractingError("The data is not a batch.")
+
+        view = memoryview(data).cast("B")
+        _, _, _, option_length = CSHeader.unpack_from(view)
+        cursor = CSHeader.SIZE + option_length
+        prefix_size = CSFramer.LENGTH.size
+
+        packets = []
+        while cursor < len(view):
+            if len(view) - cursor < prefix_size:
+                raise PacketExtractingError("The length of a packet in the "
+                "batch is truncated.")
+
+            length, = CSFramer.LENGTH.unpack_from(view, cursor)
+            cursor += prefix_size
+
+            if len(view) - cursor < length:
+                raise PacketExtractingError("A packet in the batch is "
+                "not enough length.")
+
+            packets.append(CSPacket.from_buffer(
+                view[cursor: cursor + length],
+                copy,
+                max_decompressed_size,
+                version
+            ))
+            cursor += length
+
+        return packets
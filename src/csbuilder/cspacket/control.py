@@ -0,0 +1,37 @@
+from hks_pylib.hksenum import HKSEnum
+
+from csbuilder.standard import ProtocolInt
+from csbuilder.cspacket.header import CSHeader
+
+
+# The protocol value reserved by csbuilder for its own control messages,
+# which are handled by the responser instead of a session. Control messages
+# always have a v1 header; the first byte of a v2 header is its flags byte,
+# so a v2 packet can never be mistaken for a control message.
+CONTROL_PROTOCOL = ProtocolInt.HIGH
+
+CONTROL_ROLE = 0
+
+
+class ControlStates(HKSEnum):
+    BATCH = 0
+    HELLO = 1
+    FORMAT = 2
+
+
+def control_header(state: ControlStates, option_length: int = 0) -> bytes:
+    return CSHeader.pack(CONTROL_PROTOCOL, CONTROL_ROLE, state.value, option_length)
+
+
+def is_control_state(data, state: ControlStates) -> bool:
+    if len(data) < CSHeader.SIZE:
+        return False
+
+    protocol, _, istate, _ = CSHeader.unpack_from(data)
+    return protocol == CONTROL_PROTOCOL and istate == state.value
+
+
+def is_control(data) -> bool:
+    "Check if a received message is a control message (without decoding it)."
+    return len(data) >= CSHeader.SIZE and \
+        CSHeader.unpack_from(data)[0] == CONTROL_PROTOCOL
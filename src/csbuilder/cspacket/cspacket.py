@@ -1,9 +1,15 @@
-from hks_pylib.hksenum import HKSEnum, get_enum
+import mmap
+from typing import List, Union
+
+from hks_pylib.hksenum import HKSEnum
 
 from csbuilder.standard import Roles, States, Protocols
-from csbuilder.standard import PROTOCOL_SIZE, INT_SIZE, ROLE_SIZE, STATE_SIZE
+from csbuilder.cspacket.header import CSHeader, CSHeaderV2, FORMAT_V1, FORMAT_V2, FORMATS
+from csbuilder.cspacket.option import CSOption
+from csbuilder.cspacket.payload import PayloadObject
+from csbuilder.compression.codec import CompressionPolicy, decompress, MAX_DECOMPRESSED_SIZE
 
-from hkserror.hkserror import HTypeError
+from hkserror.hkserror import HFormatError, HTypeError
 from csbuilder.errors.packet import PacketError, PacketExtractingError
 
 
@@ -15,14 +21,28 @@ class CSPacketField(HKSEnum):
     PAYLOAD = "payload"
 
 
+# The types which are accepted by CSPacket.from_buffer().
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+# The option and payload of a packet are stored either as bytes, as a
+# read-only memoryview into a receive buffer (see CSPacket.from_buffer()) or
+# as a bytearray being built by update_option() and update_payload().
+Buffer = Union[bytes, bytearray, memoryview]
+
+# The types which are accepted as the option and the payload of a packet.
+FIELD_TYPES = (bytes, bytearray, memoryview)
+
+
 class CSPacket(object):
+    __slots__ = ("_protocol", "_role", "_state", "_option", "_payload", "_is_valid", "_header", "_opt")
+
     def __init__(
                     self,
                     protocol: Protocols = None,
                     role: Roles = None,
                     state: States = None,
-                    option: bytes = b"",
-                    payload: bytes = b""
+                    option: Buffer = b"",
+                    payload: Buffer = b""
                 ) -> None:
         if protocol is not None and not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols, None)
@@ -33,21 +53,21 @@ class CSPacket(object):
         if role is not None and not isinstance(role, Roles):
             raise HTypeError("role", role, Roles, None)
 
-        if not isinstance(option, bytes):
-            raise HTypeError("option", option, bytes)
+        if not isinstance(option, FIELD_TYPES):
+            raise HTypeError("option", option, *FIELD_TYPES)
 
-        if not isinstance(payload, bytes):
-            raise HTypeError("payload", payload, bytes)
+        if not isinstance(payload, FIELD_TYPES):
+            raise HTypeError("payload", payload, *FIELD_TYPES)
 
-        self.__packet: dict[CSPacketField, object] = {
-                CSPacketField.PROTOCOL: None,
-                CSPacketField.STATE: None,
-                CSPacketField.ROLE: None,
-                CSPacketField.OPTION: b"",
-                CSPacketField.PAYLOAD: b""
-            }
+        self._protocol = None
+        self._state = None
+        self._role = None
+        self._option = b""
+        self._payload = b""
 
         self._is_valid = False
+        self._header = None
+        self._opt = None
 
         if protocol is not None:
             self.protocol(protocol)
@@ -65,7 +85,8 @@ class CSPacket(object):
         if not isinstance(index, CSPacketField):
             raise HTypeError("index", index, CSPacketField)
 
-        return self.__packet[index]
+        # The value of each field is the name of its getter.
+        return getattr(self, index.value)()
 
     def __setitem__(self, index: CSPacketField, value: object) -> None:
         if not isinstance(index, CSPacketField):
@@ -75,103 +96,194 @@ class CSPacket(object):
             self.protocol(value)
         elif index == CSPacketField.STATE:
             self.state(value)
+        elif index == CSPacketField.ROLE:
+            self.role(value)
         elif index == CSPacketField.OPTION:
             self.option(value)
         elif index == CSPacketField.PAYLOAD:
             self.payload(value)
-        else:
-            self.__packet.update({index: value})
 
     def __str__(self):
-        return str(self.__packet)
+        return str({field: self[field] for field in CSPacketField})
 
     def __repr__(self) -> str:
         return str(self)
 
-    def to_bytes(self) -> bytes:
+    def to_buffers(
+                    self,
+                    compression: CompressionPolicy = None,
+                    version: int = FORMAT_V1
+                ) -> List[Buffer]:
+        """Return the header, the option and the payload of the packet as
+        a list of buffers. The option and the payload are not copied: a
+        buffer built by update_option() or update_payload() is returned as a
+        read-only view, and the next append starts a new buffer, so the views
+        keep their content. If compression accepts the payload, the payload
+        is compressed. The version is the format of the header, negotiated
+        with the peer."""
         if self._is_valid is False:
             raise PacketError("Invalid packet, it cannot create bytes form.")
 
-        packet = b""
-        
-        packet += self.__packet[CSPacketField.PROTOCOL].value.to_bytes(PROTOCOL_SIZE, "big")
+        if version not in FORMATS:
+            raise HFormatError("Unknown header format {}.".format(version))
 
-        packet += self.__packet[CSPacketField.ROLE].value.to_bytes(ROLE_SIZE, "big")
+        option = self._option
+        if isinstance(option, bytearray):
+            option = memoryview(option).toreadonly()
 
-        packet += self.__packet[CSPacketField.STATE].value.to_bytes(STATE_SIZE, "big")
+        payload = self._payload
+        if isinstance(payload, bytearray):
+            payload = memoryview(payload).toreadonly()
 
-        packet += len(self.__packet[CSPacketField.OPTION]).to_bytes(INT_SIZE, "big")
-        packet += self.__packet[CSPacketField.OPTION]
+        extension = b""
+        if compression is not None and compression.accept(payload):
+            payload = compression.compress(payload)
+            extension = bytes((compression.codec.value,))
 
-        packet += self.__packet[CSPacketField.PAYLOAD]
+        if version == FORMAT_V2:
+            header = CSHeaderV2.pack(
+                    self._protocol.value,
+                    self._role.value,
+                    self._state.value,
+                    len(option) + len(extension),
+                    CSHeaderV2.COMPRESSED if extension else 0
+                )
 
-        return packet
+            return [header + extension if extension else header, option, payload]
 
-    @staticmethod
-    def from_bytes(data: bytes):
-        from csbuilder.pool import Pool
+        option_field = len(option) + len(extension)
+        if extension:
+            option_field |= CSHeader.COMPRESSED
+
+        if len(option) + len(extension) > CSHeader.OPTION_LENGTH_MASK:
+            raise PacketError("The option is too long ({} bytes).".format(len(option)))
 
+        if self._header is not None:
+            header = CSHeader.pack_template(self._header, option_field)
+        else:
+            header = CSHeader.pack(
+                    self._protocol.value,
+                    self._role.value,
+                    self._state.value,
+                    option_field
+                )
+
+        return [header + extension if extension else header, option, payload]
+
+    def to_bytes(self, compression: CompressionPolicy = None, version: int = FORMAT_V1) -> bytes:
+        return b"".join(self.to_buffers(compression, version))
+
+    @staticmethod
+    def from_bytes(data: bytes, version: int = FORMAT_V1):
         if not isinstance(data, bytes):
             raise HTypeError("data", data, bytes)
 
-        cursor = 0
+        return CSPacket.from_buffer(data, copy=True, version=version)
+
+    @staticmethod
+    def from_buffer(
+                        data: Union[bytes, bytearray, memoryview, mmap.mmap],
+                        copy: bool = False,
+                        max_decompressed_size: int = MAX_DECOMPRESSED_SIZE,
+                        version: int = FORMAT_V1
+                    ):
+        """Extract a packet from any bytes-like object. If copy is False, the
+        option and payload of the packet are read-only views into data, so
+        data must not be modified (or closed) while the packet is in use.
+        A compressed payload larger than max_decompressed_size is rejected.
+        The version is the format of the header, negotiated with the peer."""
+        from csbuilder.pool import Pool
+
+        if not isinstance(data, BUFFER_TYPES):
+            raise HTypeError("data", data, *BUFFER_TYPES)
 
-        bprotocol = data[cursor: cursor + PROTOCOL_SIZE]
-        cursor += PROTOCOL_SIZE
+        if not isinstance(copy, bool):
+            raise HTypeError("copy", copy, bool)
 
-        brole = data[cursor: cursor + ROLE_SIZE]
-        cursor += ROLE_SIZE
+        if not isinstance(max_decompressed_size, int):
+            raise HTypeError("max_decompressed_size", max_decompressed_size, int)
 
-        bstate = data[cursor: cursor + STATE_SIZE]
-        cursor += STATE_SIZE
+        if version not in FORMATS:
+            raise HFormatError("Unknown header format {}.".format(version))
 
-        boptional_length = data[cursor: cursor + INT_SIZE]
-        cursor += INT_SIZE
+        view = memoryview(data)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast("B")
 
-        if len(bprotocol) != PROTOCOL_SIZE:
-            raise PacketExtractingError("Invalid protocol, expected {} "
-            "bytes, but got {} bytes.".format(PROTOCOL_SIZE, len(bprotocol)))
+        if not view.readonly:
+            view = view.toreadonly()
 
-        if len(brole) != ROLE_SIZE:
-            raise PacketExtractingError("Invalid role, expected {} "
-            "bytes, but got {} bytes.".format(ROLE_SIZE, len(brole)))
+        if version == FORMAT_V2:
+            iprotocol, irole, istate, option_length, flags, cursor = \
+                CSHeaderV2.unpack_from(view)
 
-        if len(bstate) != STATE_SIZE:
-            raise PacketExtractingError("Invalid state, expected {} "
-            "bytes, but got {} bytes.".format(STATE_SIZE, len(bstate)))
+            if flags & ~CSHeaderV2.KNOWN_FLAGS:
+                raise PacketExtractingError("Unknown flags {:#x}.".format(flags))
 
-        if len(boptional_length) != INT_SIZE:
-            raise PacketExtractingError("Invalid option length, expected {} "
-            "bytes, but got {} bytes.".format(INT_SIZE, len(boptional_length)))
+            compressed = flags & CSHeaderV2.COMPRESSED
+        else:
+            iprotocol, irole, istate, option_field = CSHeader.unpack_from(view)
+            cursor = CSHeader.SIZE
 
-        iprotocol = int.from_bytes(bprotocol, "big")
-        protocol = Pool.int2protocol(iprotocol)
-        if protocol is None:
-            raise PacketExtractingError("Unknown protocol {}.".format(iprotocol))
+            flags = option_field & CSHeader.FLAGS_MASK
+            option_length = option_field & CSHeader.OPTION_LENGTH_MASK
+            if flags & ~CSHeader.KNOWN_FLAGS:
+                raise PacketExtractingError("Unknown flags {:#x}.".format(flags))
 
-        irole = int.from_bytes(brole, "big")
-        all_roles = Pool.get_roles(protocol)
-        role = get_enum(all_roles, irole, None)
-        if role is None:
-            raise PacketExtractingError("Unknown role {} in {}.".format(irole, protocol))
+            compressed = flags & CSHeader.COMPRESSED
 
-        istate = int.from_bytes(bstate, "big")
-        state = Pool.get_states(protocol, role).get(istate, None)
+        triple = Pool.lookup(iprotocol, irole, istate)
+        if triple is None:
+            raise PacketExtractingError(unknown_reason(iprotocol, irole, istate))
 
-        if state is None:
-            raise PacketExtractingError("Unknown state {} in {}-{}.".
-                    format(istate, protocol, role))
+        protocol, role, state = triple
 
-        option_length = int.from_bytes(boptional_length, "big")
-        option = data[cursor: cursor + option_length]
+        option = view[cursor: cursor + option_length]
         cursor += option_length
 
         if len(option) < option_length:
             raise PacketExtractingError("Optional header is not enough length.")
 
-        payload = data[cursor: ]
+        payload = view[cursor: ]
+
+        if compressed:
+            if option_length < 1:
+                raise PacketExtractingError("The compression codec is missing.")
+
+            payload = decompress(
+                option[0],
+                payload,
+                max_decompressed_size,
+                Pool.get_dictionary(protocol)
+            )
+            option = option[1:]
 
-        packet = CSPacket(protocol, role, state, option, payload)
+        if copy:
+            option, payload = bytes(option), bytes(payload)
+
+        return CSPacket._trusted(protocol, role, state, option, payload)
+
+    @staticmethod
+    def _trusted(
+                    protocol: Protocols,
+                    role: Roles,
+                    state: States,
+                    option: Buffer = b"",
+                    payload: Buffer = b"",
+                    header: bytes = None
+                ):
+        """Construct a valid packet without checking its elements. Only use it
+        when the caller has already guaranteed that state belongs to the
+        (protocol, role) in Pool. The header is a template of CSHeader."""
+        packet = CSPacket.__new__(CSPacket)
+        packet._protocol = protocol
+        packet._role = role
+        packet._state = state
+        packet._option = option
+        packet._payload = payload
+        packet._is_valid = True
+        packet._header = header
+        packet._opt = None
 
         return packet
 
@@ -184,8 +296,7 @@ class CSPacket(object):
         if not protocol or not role or not state:
             return
 
-        states = Pool.get_states(protocol, role)
-        if state not in states:
+        if not Pool.is_valid(protocol, role, state):
             raise PacketError("Packet is invalid "
             "because mismatched elements ({}, {}, {})".format(protocol, role, state))
 
@@ -193,69 +304,158 @@ class CSPacket(object):
 
     def protocol(self, protocol: Protocols = None) -> Protocols:
         if protocol == None:
-            return self.__packet[CSPacketField.PROTOCOL]
+            return self._protocol
 
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols, None)
 
         self._is_valid = False
+        self._header = None
+        self._opt = None
 
-        self.__packet[CSPacketField.PROTOCOL] = protocol
+        self._protocol = protocol
 
         self._validate()
 
     def role(self, role: Roles = None) -> Roles:
         if role == None:
-            return self.__packet[CSPacketField.ROLE]
+            return self._role
 
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles, None)
 
         self._is_valid = False
+        self._header = None
 
-        self.__packet[CSPacketField.ROLE] = role
+        self._role = role
 
         self._validate()
 
     def state(self, state: States = None) -> States:
         if state == None:
-            return self.__packet[CSPacketField.STATE]
+            return self._state
 
         if not isinstance(state, States):
             raise HTypeError("state", state, States, None)
 
         self._is_valid = False
+        self._header = None
 
-        self.__packet[CSPacketField.STATE] = state
+        self._state = state
 
         self._validate()
 
-    def option(self, option: bytes = None) -> bytes:
-        if option == None:
-            return self.__packet[CSPacketField.OPTION]
+    @property
+    def opt(self) -> CSOption:
+        """The option as typed TLV fields, e.g. packet.opt.get("sequence").
+        The fields are decoded lazily (see CSOption)."""
+        if self._protocol is None:
+            raise PacketError("The protocol of the packet is not set.")
+
+        if self._opt is None:
+            self._opt = CSOption(self)
+
+        return self._opt
+
+    def option(self, option: Buffer = None, copy: bool = False) -> Buffer:
+        """If copy is True, the getter always returns a bytes object, even
+        when the option is a view into a receive buffer or is being built by
+        update_option(). Otherwise, it is returned as stored."""
+        if option is None:
+            option = self._option
+            return bytes(option) if copy and not isinstance(option, bytes) else option
 
-        if not isinstance(option, bytes):
-            raise HTypeError("option", option, bytes, None)
+        if not isinstance(option, FIELD_TYPES):
+            raise HTypeError("option", option, *FIELD_TYPES, None)
 
-        self.__packet[CSPacketField.OPTION] = option
+        # Never keep a bytearray of the caller, update_option() extends it.
+        self._option = bytes(option) if isinstance(option, bytearray) else option
 
-    def update_option(self, option: bytes) -> None:
-        if not isinstance(option, bytes):
-            raise HTypeError("option", option, bytes)
+    def update_option(self, option: Buffer) -> None:
+        """Append to the option. Successive appends share a growing buffer,
+        which is not copied when the packet is serialized (see to_buffers)."""
+        if not isinstance(option, FIELD_TYPES):
+            raise HTypeError("option", option, *FIELD_TYPES)
 
-        self.__packet[CSPacketField.OPTION] += option
+        self._option = _append(self._option, option)
 
-    def payload(self, payload: bytes = None) -> bytes:
+    def payload(self, payload: Buffer = None, copy: bool = False) -> Buffer:
+        """If copy is True, the getter always returns a bytes object, even
+        when the payload is a view into a receive buffer or is being built by
+        update_payload(). Otherwise, it is returned as stored."""
         if payload is None:
-            return self.__packet[CSPacketField.PAYLOAD]
+            payload = self._payload
+            return bytes(payload) if copy and not isinstance(payload, bytes) else payload
+
+        if not isinstance(payload, FIELD_TYPES):
+            raise HTypeError("payload", payload, *FIELD_TYPES, None)
+
+        # Never keep a bytearray of the caller, update_payload() extends it.
+        self._payload = bytes(payload) if isinstance(payload, bytearray) else payload
+
+    def payload_obj(self, obj: Union[PayloadObject, dict] = None) -> PayloadObject:
+        """Decode the payload by the schema of the state (see Pool.payload),
+        or encode obj (a decoded object or a dict of fields) as the payload."""
+        from csbuilder.pool import Pool
+
+        if self._state is None:
+            raise PacketError("The state of the packet is not set.")
+
+        schema = Pool.get_payload_schema(self._state)
+        if schema is None:
+            raise PacketError("There is no payload schema of {}.".format(self._state))
+
+        if obj is None:
+            return schema.decode(self._payload)
+
+        self.payload(schema.encode(obj))
+
+    def ndarray(self, array=None):
+        """Rebuild the numpy array of the payload without copy, or send array
+        as the payload (see csbuilder.cspacket.ndarray). Requires numpy."""
+        from csbuilder.cspacket.ndarray import encode_ndarray, decode_ndarray
+
+        if array is None:
+            return decode_ndarray(self)
+
+        encode_ndarray(self, array)
+
+    def update_payload(self, payload: Buffer):
+        """Append to the payload. Successive appends share a growing buffer,
+        which is not copied when the packet is serialized (see to_buffers)."""
+        if not isinstance(payload, FIELD_TYPES):
+            raise HTypeError("payload", payload, *FIELD_TYPES)
+
+        self._payload = _append(self._payload, payload)
+
+
+def _append(buffer: Buffer, data: Buffer) -> bytearray:
+    "Append data to the growing buffer of a field, or to a new one."
+    if isinstance(buffer, bytearray):
+        try:
+            buffer += data
+            return buffer
+        except BufferError:
+            # The buffer is exported by to_buffers(), its views must not change.
+            pass
+
+    buffer = bytearray(buffer)
+    buffer += data
+    return buffer
+
+
+def unknown_reason(protocol: int, role: int, state: int) -> str:
+    "Explain why (protocol, role, state) is not in the packet index of Pool."
+    from csbuilder.pool import Pool
 
-        if not isinstance(payload, bytes):
-            raise HTypeError("payload", payload, bytes, None)
+    if Pool.int2protocol(protocol) is None:
+        if Pool.get_import_error(protocol) is not None:
+            return "Unknown protocol {} ({}).".format(protocol, Pool.get_import_error(protocol))
 
-        self.__packet[CSPacketField.PAYLOAD] = payload
+        return "Unknown protocol {}.".format(protocol)
 
-    def update_payload(self, payload: bytes):
-        if not isinstance(payload, bytes):
-            raise HTypeError("payload", payload, bytes)
+    if Pool.int2role(protocol, role) is None:
+        return "Unknown role {} in {}.".format(role, Pool.int2protocol(protocol))
 
-        self.__packet[CSPacketField.PAYLOAD] += payload
+    return "Unknown state {} in {}-{}.".format(
+        state, Pool.int2protocol(protocol), Pool.int2role(protocol, role))
@@ -0,0 +1,205 @@
+import struct
+from typing import Callable, List, Optional
+
+from csbuilder.standard import INT_SIZE
+from csbuilder.cspacket.header import struct_format, FORMAT_V1, FORMATS
+from csbuilder.cspacket.cspacket import CSPacket, Buffer, BUFFER_TYPES
+from csbuilder.compression.codec import CompressionPolicy
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketExtractingError
+
+
+class CSFramer(object):
+    """Length-prefixed framing of CSPacket over a raw byte stream. Each frame
+    is the total length of the packet (INT_SIZE bytes, big-endian) followed
+    by the packet itself."""
+
+    LENGTH = struct.Struct(">" + struct_format(INT_SIZE))
+
+    @staticmethod
+    def frame(
+                packet: CSPacket,
+                compression: CompressionPolicy = None,
+                version: int = FORMAT_V1
+            ) -> List[Buffer]:
+        if not isinstance(packet, CSPacket):
+            raise HTypeError("packet", packet, CSPacket)
+
+        buffers = packet.to_buffers(compression, version)
+        length = sum(len(buffer) for buffer in buffers)
+
+        return [CSFramer.LENGTH.pack(length)] + buffers
+
+    @staticmethod
+    def to_bytes(
+                    packet: CSPacket,
+                    compression: CompressionPolicy = None,
+                    version: int = FORMAT_V1
+                ) -> bytes:
+        return b"".join(CSFramer.frame(packet, compression, version))
+
+    @staticmethod
+    def send(
+                sock,
+                packet: CSPacket,
+                compression: CompressionPolicy = None,
+                version: int = FORMAT_V1
+            ) -> None:
+        "Write a frame to a socket, using a gather-write when it is supported."
+        buffers = CSFramer.frame(packet, compression, version)
+
+        if not hasattr(sock, "sendmsg"):
+            sock.sendall(b"".join(buffers))
+            return
+
+        total = sum(len(buffer) for buffer in buffers)
+        sent = sock.sendmsg(buffers)
+        if sent < total:
+            sock.sendall(b"".join(buffers)[sent:])
+
+
+class CSDeframer(object):
+    """Incremental decoder of a CSFramer stream. Chunks of arbitrary size are
+    given by feed(), or written directly by recv_into() into recv_buffer()
+    and then committed; every call returns all packets completed so far.
+    The version is the header format of the packets in the stream."""
+
+    def __init__(
+                    self,
+                    buffer_size: int = 65536,
+                    max_packet_size: int = 2 ** 31 - 1,
+                    version: int = FORMAT_V1
+                ) -> None:
+        if not isinstance(buffer_size, int):
+            raise HTypeError("buffer_size", buffer_size, int)
+
+        if buffer_size <= 0:
+            raise HFormatError("The parameter buffer_size expected an positive integer.")
+
+        if not isinstance(max_packet_size, int):
+            raise HTypeError("max_packet_size", max_packet_size, int)
+
+        if max_packet_size <= 0:
+            raise HFormatError("The parameter max_packet_size expected an positive integer.")
+
+        if version not in FORMATS:
+            raise HFormatError("Unknown header format {}.".format(version))
+
+        self._buffer_size = buffer_size
+        self._max_packet_size = max_packet_size
+        self._version = version
+
+        self._buffer = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        "The number of buffered bytes which do not form a complete packet yet."
+        return self._end - self._start
+
+    def recv_buffer(self, size: int = None) -> memoryview:
+        """Return a writable view of at least size free bytes (buffer_size by
+        default). The view is only valid until the next commit()."""
+        if size is not None and not isinstance(size, int):
+            raise HTypeError("size", size, int, None)
+
+        if size is None:
+            size = self._buffer_size
+
+        if len(self._buffer) - self._end < size:
+            pending = self._end - self._start
+
+            if len(self._buffer) - pending >= size:
+                # Move the pending bytes to the beginning of the buffer.
+                self._buffer[:pending] = self._buffer[self._start: self._end]
+            else:
+                # Never resize the buffer in place, a view of it may still exist.
+                buffer = bytearray(max(pending + size, 2 * len(self._buffer)))
+                buffer[:pending] = self._buffer[self._start: self._end]
+                self._buffer = buffer
+
+            self._start, self._end = 0, pending
+
+        return memoryview(self._buffer)[self._end:]
+
+    def commit(self, nbytes: int) -> List[CSPacket]:
+        "Mark nbytes written into recv_buffer() as received."
+        if not isinstance(nbytes, int):
+            raise HTypeError("nbytes", nbytes, int)
+
+        if nbytes < 0 or self._end + nbytes > len(self._buffer):
+            raise HFormatError("The parameter nbytes is out of the receive buffer.")
+
+        self._end += nbytes
+        return self._extract()
+
+    def feed(self, data: Buffer) -> List[CSPacket]:
+        if not isinstance(data, BUFFER_TYPES):
+            raise HTypeError("data", data, *BUFFER_TYPES)
+
+        data = memoryview(data).cast("B")
+        self.recv_buffer(len(data))[:len(data)] = data
+        return self.commit(len(data))
+
+    def fill(self, recv_into: Callable[[memoryview], int]) -> Optional[List[CSPacket]]:
+        """Read once with recv_into (e.g. socket.recv_into or file.readinto).
+        Return None at the end of the stream, see close()."""
+        nbytes = recv_into(self.recv_buffer())
+        if not nbytes:
+            self.close()
+            return None
+
+        return self.commit(nbytes)
+
+    def close(self) -> None:
+        """Signal the end of the stream. Raise PacketExtractingError if the
+        buffered bytes are an invalid frame or an incomplete packet."""
+        # An invalid frame deferred behind good packets is raised here.
+        self._extract()
+
+        if self._end > self._start:
+            pending = self._end - self._start
+            self._start = self._end = 0
+            raise PacketExtractingError("The stream ended with an incomplete "
+            "packet ({} bytes).".format(pending))
+
+    def _extract(self) -> List[CSPacket]:
+        packets = []
+        prefix_size = CSFramer.LENGTH.size
+
+        while self._end - self._start >= prefix_size:
+            length, = CSFramer.LENGTH.unpack_from(self._buffer, self._start)
+            if length > self._max_packet_size:
+                if packets:
+                    break
+
+                raise PacketExtractingError("The packet length {} exceeds the "
+                "maximum packet size {}.".format(length, self._max_packet_size))
+
+            frame_end = self._start + prefix_size + length
+            if frame_end > self._end:
+                break
+
+            # Copy the frame out so that the packet's views never change.
+            with memoryview(self._buffer) as view:
+                frame = bytes(view[self._start + prefix_size: frame_end])
+
+            try:
+                packet = CSPacket.from_buffer(frame, version=self._version)
+            except PacketExtractingError:
+                # Return the good packets first, the invalid frame is
+                # reported (and skipped) by the next call.
+                if packets:
+                    break
+
+                self._start = frame_end
+                raise
+
+            self._start = frame_end
+            packets.append(packet)
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        return packets
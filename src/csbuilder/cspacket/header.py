@@ -0,0 +1,163 @@
+import struct
+from typing import Tuple
+
+from csbuilder.standard import PROTOCOL_SIZE, INT_SIZE, ROLE_SIZE, STATE_SIZE
+
+from hkserror.hkserror import HFormatError
+from csbuilder.errors.packet import PacketExtractingError
+
+
+_STRUCT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def struct_format(size: int) -> str:
+    if size not in _STRUCT_FORMATS:
+        raise HFormatError("Cannot encode a field of {} bytes, expected "
+        "one of {}.".format(size, list(_STRUCT_FORMATS.keys())))
+
+    return _STRUCT_FORMATS[size]
+
+
+class CSHeader(object):
+    """The fixed-size header of CSPacket, which is encoded as
+    protocol | role | state | option length (big-endian)."""
+
+    STRUCT = struct.Struct(">" + "".join([
+            struct_format(PROTOCOL_SIZE),
+            struct_format(ROLE_SIZE),
+            struct_format(STATE_SIZE),
+            struct_format(INT_SIZE)
+        ]))
+
+    SIZE = STRUCT.size
+
+    # The highest bits of the option length field are the flags of the packet.
+    FLAG_BITS = 4
+    OPTION_LENGTH_MASK = (1 << (INT_SIZE * 8 - FLAG_BITS)) - 1
+    FLAGS_MASK = ~OPTION_LENGTH_MASK & ((1 << (INT_SIZE * 8)) - 1)
+
+    # The payload is compressed, the option begins with the codec identifier.
+    COMPRESSED = 1 << (INT_SIZE * 8 - 1)
+    KNOWN_FLAGS = COMPRESSED
+
+    # The (protocol, role, state) part of the header, which is the same for
+    # all packets of a state, and the option length part.
+    PREFIX = struct.Struct(STRUCT.format[:-1])
+    OPTION_LENGTH = struct.Struct(">" + STRUCT.format[-1])
+
+    @staticmethod
+    def template(protocol: int, role: int, state: int) -> bytes:
+        "Return the encoded (protocol, role, state) part of the header."
+        return CSHeader.PREFIX.pack(protocol, role, state)
+
+    @staticmethod
+    def pack_template(template: bytes, option_length: int) -> bytes:
+        "Complete a header from its template and the option length."
+        return template + CSHeader.OPTION_LENGTH.pack(option_length)
+
+    @staticmethod
+    def pack(protocol: int, role: int, state: int, option_length: int) -> bytes:
+        return CSHeader.STRUCT.pack(protocol, role, state, option_length)
+
+    @staticmethod
+    def pack_into(
+                    buffer: bytearray,
+                    offset: int,
+                    protocol: int,
+                    role: int,
+                    state: int,
+                    option_length: int
+                ) -> int:
+        "Write the header into buffer at offset, return the offset after the header."
+        CSHeader.STRUCT.pack_into(buffer, offset, protocol, role, state, option_length)
+        return offset + CSHeader.SIZE
+
+    @staticmethod
+    def unpack_from(buffer, offset: int = 0) -> Tuple[int, int, int, int]:
+        "Return (protocol, role, state, option length) read from buffer at offset."
+        if len(buffer) - offset < CSHeader.SIZE:
+            raise PacketExtractingError("Invalid header, expected {} bytes, but "
+            "got {} bytes.".format(CSHeader.SIZE, max(len(buffer) - offset, 0)))
+
+        return CSHeader.STRUCT.unpack_from(buffer, offset)
+
+
+# The formats of the header. The format v1 (CSHeader) is always used until
+# the peers have negotiated another one (see CSHello and CSFormat).
+FORMAT_V1 = 1
+FORMAT_V2 = 2
+FORMATS = (FORMAT_V1, FORMAT_V2)
+
+# The maximum number of bytes of a varint, enough for a 64-bit integer.
+MAX_VARINT_SIZE = 10
+
+
+def encode_varint(value: int) -> bytes:
+    "Encode a non-negative integer as an unsigned LEB128 varint."
+    if value < 0x80:
+        return bytes((value,))
+
+    output = bytearray()
+    while value >= 0x80:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    output.append(value)
+    return bytes(output)
+
+
+def decode_varint(buffer, offset: int = 0) -> Tuple[int, int]:
+    "Return (value, offset after the varint) read from buffer at offset."
+    value = 0
+    shift = 0
+    end = min(len(buffer), offset + MAX_VARINT_SIZE)
+    while offset < end:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+
+        shift += 7
+
+    raise PacketExtractingError("Invalid header, a varint is truncated or too long.")
+
+
+class CSHeaderV2(object):
+    """The compact header of the format v2, which is encoded as
+    flags | protocol | role | state [| option length]. The fields are
+    unsigned varints and the option length is omitted if it is zero."""
+
+    EMPTY_OPTION = 0x01
+
+    # The payload is compressed, the option begins with the codec identifier.
+    COMPRESSED = 0x02
+    KNOWN_FLAGS = EMPTY_OPTION | COMPRESSED
+
+    @staticmethod
+    def pack(protocol: int, role: int, state: int, option_length: int, flags: int = 0) -> bytes:
+        if option_length == 0:
+            return bytes((flags | CSHeaderV2.EMPTY_OPTION,)) + encode_varint(protocol) + \
+                encode_varint(role) + encode_varint(state)
+
+        return bytes((flags,)) + encode_varint(protocol) + encode_varint(role) + \
+            encode_varint(state) + encode_varint(option_length)
+
+    @staticmethod
+    def unpack_from(buffer, offset: int = 0) -> Tuple[int, int, int, int, int, int]:
+        """Return (protocol, role, state, option length, flags, offset after
+        the header) read from buffer at offset."""
+        if len(buffer) - offset < 4:
+            raise PacketExtractingError("Invalid header, expected at least 4 bytes, "
+            "but got {} bytes.".format(max(len(buffer) - offset, 0)))
+
+        flags = buffer[offset]
+        protocol, offset = decode_varint(buffer, offset + 1)
+        role, offset = decode_varint(buffer, offset)
+        state, offset = decode_varint(buffer, offset)
+
+        option_length = 0
+        if not flags & CSHeaderV2.EMPTY_OPTION:
+            option_length, offset = decode_varint(buffer, offset)
+
+        return protocol, role, state, option_length, flags & ~CSHeaderV2.EMPTY_OPTION, offset
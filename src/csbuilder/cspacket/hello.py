@@ -0,0 +1,172 @@
+import struct
+from typing import Dict, List, Tuple
+
+from hks_pylib.hksenum import HKSEnum
+
+from csbuilder.cspacket.header import CSHeader, FORMAT_V1, FORMATS
+from csbuilder.cspacket.cspacket import Buffer, BUFFER_TYPES
+from csbuilder.compression.codec import Codecs, available_codecs
+from csbuilder.cspacket.control import ControlStates, control_header, is_control_state
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketExtractingError
+
+
+class HelloTags(HKSEnum):
+    CODECS = 1
+    DICTIONARIES = 2
+    FORMATS = 3
+
+
+class CSHello(object):
+    """The capabilities of a peer, exchanged as a control message when a
+    connection is set up. The payload is a list of (tag, length, value)
+    entries; entries with an unknown tag are ignored."""
+
+    __slots__ = ("codecs", "dictionaries", "formats")
+
+    ENTRY = struct.Struct(">BH")
+
+    # A (protocol, version, checksum) item of the DICTIONARIES entry.
+    DICTIONARY = struct.Struct(">IHI")
+
+    def __init__(
+                    self,
+                    codecs: List[Codecs] = None,
+                    dictionaries: Dict[int, Tuple[int, int]] = None,
+                    formats: List[int] = None
+                ) -> None:
+        """The dictionaries map the value of a protocol to the (version,
+        checksum) of its dictionary, they are the dictionaries of Pool by
+        default. The formats are the header formats the peer can receive."""
+        from csbuilder.pool import Pool
+
+        if codecs is not None and not isinstance(codecs, list):
+            raise HTypeError("codecs", codecs, list, None)
+
+        if dictionaries is not None and not isinstance(dictionaries, dict):
+            raise HTypeError("dictionaries", dictionaries, dict, None)
+
+        if formats is not None and not isinstance(formats, list):
+            raise HTypeError("formats", formats, list, None)
+
+        if codecs is None:
+            codecs = available_codecs()
+
+        if dictionaries is None:
+            dictionaries = {protocol.value: dictionary.identifier()
+                for protocol, dictionary in Pool.get_dictionaries().items()}
+
+        if formats is None:
+            formats = list(FORMATS)
+
+        self.codecs = codecs
+        self.dictionaries = dictionaries
+        self.formats = formats
+
+    def to_bytes(self) -> bytes:
+        entries = [
+            (HelloTags.CODECS, bytes(codec.value for codec in self.codecs)),
+            (HelloTags.DICTIONARIES, b"".join(
+                CSHello.DICTIONARY.pack(protocol, version, checksum)
+                for protocol, (version, checksum) in self.dictionaries.items())),
+            (HelloTags.FORMATS, bytes(self.formats))
+        ]
+
+        buffers = [control_header(ControlStates.HELLO)]
+        for tag, value in entries:
+            buffers.append(CSHello.ENTRY.pack(tag.value, len(value)))
+            buffers.append(value)
+
+        return b"".join(buffers)
+
+    @staticmethod
+    def is_hello(data: Buffer) -> bool:
+        return is_control_state(data, ControlStates.HELLO)
+
+    @staticmethod
+    def from_bytes(data: Buffer):
+        if not isinstance(data, BUFFER_TYPES):
+            raise HTypeError("data", data, *BUFFER_TYPES)
+
+        if not CSHello.is_hello(data):
+            raise PacketExtractingError("The data is not a hello message.")
+
+        view = memoryview(data).cast("B")
+        _, _, _, option_length = CSHeader.unpack_from(view)
+        cursor = CSHeader.SIZE + option_length
+
+        # A peer which does not announce its formats only receives v1.
+        hello = CSHello(codecs=[], dictionaries={}, formats=[FORMAT_V1])
+        while cursor < len(view):
+            if len(view) - cursor < CSHello.ENTRY.size:
+                raise PacketExtractingError("An entry of the hello message is truncated.")
+
+            tag, length = CSHello.ENTRY.unpack_from(view, cursor)
+            cursor += CSHello.ENTRY.size
+
+            value = view[cursor: cursor + length]
+            cursor += length
+            if len(value) < length:
+                raise PacketExtractingError("An entry of the hello message "
+                "is not enough length.")
+
+            if tag == HelloTags.CODECS.value:
+                for codec_id in value:
+                    codec = Codecs.get(codec_id, None)
+                    if codec is not None and codec in available_codecs():
+                        hello.codecs.append(codec)
+
+            if tag == HelloTags.DICTIONARIES.value:
+                if length % CSHello.DICTIONARY.size:
+                    raise PacketExtractingError("The dictionaries of the hello "
+                    "message are malformed.")
+
+                for protocol, version, checksum in CSHello.DICTIONARY.iter_unpack(value):
+                    hello.dictionaries[protocol] = (version, checksum)
+
+            if tag == HelloTags.FORMATS.value:
+                hello.formats = [version for version in value if version in FORMATS]
+
+        return hello
+
+    def __str__(self) -> str:
+        return "{" + "codecs = {}, dictionaries = {}, formats = {}".format(
+            self.codecs, self.dictionaries, self.formats) + "}"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class CSFormat(object):
+    """The control message switching the header format of the packets sent
+    by a peer. The packets sent before it keep the previous format, so the
+    receiver switches exactly at this message."""
+
+    @staticmethod
+    def to_bytes(version: int) -> bytes:
+        if version not in FORMATS:
+            raise HFormatError("Unknown header format {}.".format(version))
+
+        return control_header(ControlStates.FORMAT) + bytes((version,))
+
+    @staticmethod
+    def is_format(data: Buffer) -> bool:
+        return is_control_state(data, ControlStates.FORMAT)
+
+    @staticmethod
+    def from_bytes(data: Buffer) -> int:
+        if not isinstance(data, BUFFER_TYPES):
+            raise HTypeError("data", data, *BUFFER_TYPES)
+
+        if not CSFormat.is_format(data):
+            raise PacketExtractingError("The data is not a format message.")
+
+        view = memoryview(data).cast("B")
+        _, _, _, option_length = CSHeader.unpack_from(view)
+        cursor = CSHeader.SIZE + option_length
+
+        if len(view) - cursor != 1 or view[cursor] not in FORMATS:
+            raise PacketExtractingError("The format message is malformed.")
+
+        return view[cursor]
@@ -0,0 +1,71 @@
+import struct
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketError, PacketExtractingError
+
+try:
+    import numpy
+except ImportError:  # numpy is an optional extra (pip install csbuilder[numpy]).
+    numpy = None
+
+
+def _require_numpy() -> None:
+    if numpy is None:
+        raise PacketError("The ndarray codec requires numpy "
+        "(pip install csbuilder[numpy]).")
+
+
+def encode_ndarray(packet, array) -> None:
+    """Set an array as the payload of packet. Its dtype (with the byte order)
+    and shape are the standard option fields ndarray_dtype and ndarray_shape,
+    the payload is a view of the array buffer, which is only copied if the
+    array is not C-contiguous. The array must not be modified until the
+    packet is sent."""
+    _require_numpy()
+
+    if not isinstance(array, numpy.ndarray):
+        raise HTypeError("array", array, numpy.ndarray)
+
+    if array.dtype.hasobject or array.dtype.fields is not None:
+        raise HFormatError("The dtype {} cannot be sent, expected a dtype "
+        "of numbers.".format(array.dtype))
+
+    array = numpy.ascontiguousarray(array)
+
+    packet.opt.set("ndarray_dtype", array.dtype.str)
+    packet.opt.set("ndarray_shape", struct.pack(">{}Q".format(array.ndim), *array.shape))
+    packet.payload(memoryview(array.reshape(-1).view(numpy.uint8)))
+
+
+def decode_ndarray(packet):
+    """Rebuild the array of the payload with numpy.frombuffer, so that it
+    shares the memory of the payload (which is a view into the receive
+    buffer if the packet was extracted without copy). The array is
+    read-only when the payload is."""
+    _require_numpy()
+
+    dtype = packet.opt.get("ndarray_dtype")
+    shape = packet.opt.get("ndarray_shape")
+    if dtype is None or shape is None:
+        raise PacketExtractingError("The payload is not an ndarray.")
+
+    if len(shape) % 8:
+        raise PacketExtractingError("The shape of the ndarray is malformed.")
+
+    try:
+        dtype = numpy.dtype(dtype)
+    except TypeError as e:
+        raise PacketExtractingError("Unknown dtype of the ndarray ({}).".format(e))
+
+    shape = struct.unpack(">{}Q".format(len(shape) // 8), shape)
+
+    payload = packet.payload()
+    count = 1
+    for dimension in shape:
+        count *= dimension
+
+    if dtype.hasobject or count * dtype.itemsize != len(payload):
+        raise PacketExtractingError("The payload does not match the ndarray "
+        "{} of {}.".format(shape, dtype))
+
+    return numpy.frombuffer(payload, dtype=dtype).reshape(shape)
@@ -0,0 +1,192 @@
+import struct
+from typing import Dict, Tuple
+
+from csbuilder.cspacket.header import encode_varint, decode_varint
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketError, PacketExtractingError
+
+
+# The struct formats which can be the kind of a field.
+_STRUCT_KINDS = "bBhHiIqQfd"
+
+# The tags lower than it are reserved for the standard fields.
+MIN_PROTOCOL_TAG = 16
+
+
+class OptionField(object):
+    """A typed field of the option, encoded as tag | length | value. The
+    length is a varint, the kind is a struct format of one number, bytes
+    or str."""
+
+    __slots__ = ("key", "tag", "kind", "_struct")
+
+    def __init__(self, key: str, tag: int, kind) -> None:
+        if not isinstance(key, str):
+            raise HTypeError("key", key, str)
+
+        if not isinstance(tag, int):
+            raise HTypeError("tag", tag, int)
+
+        if tag < 1 or tag > 255:
+            raise HFormatError("The parameter tag expected to be between 1 and 255.")
+
+        if kind not in (bytes, str) and (not isinstance(kind, str) or
+                len(kind) != 1 or kind not in _STRUCT_KINDS):
+            raise HFormatError("The kind of a field expected bytes, str or one "
+            "of the struct formats {}, but got {}.".format(list(_STRUCT_KINDS), kind))
+
+        self.key = key
+        self.tag = tag
+        self.kind = kind
+        self._struct = struct.Struct(">" + kind) if isinstance(kind, str) else None
+
+    def encode(self, value) -> bytes:
+        if self._struct is not None:
+            value = self._struct.pack(value)
+        elif self.kind is str:
+            value = value.encode()
+        elif not isinstance(value, (bytes, bytearray, memoryview)):
+            raise HTypeError(self.key, value, bytes, bytearray, memoryview)
+
+        return bytes((self.tag,)) + encode_varint(len(value)) + value
+
+    def decode(self, data):
+        if self._struct is not None:
+            if len(data) != self._struct.size:
+                raise PacketExtractingError("The option field {} expected {} bytes, "
+                "but got {} bytes.".format(self.key, self._struct.size, len(data)))
+
+            return self._struct.unpack(data)[0]
+
+        if self.kind is str:
+            return str(data, "utf-8")
+
+        return bytes(data)
+
+    def __str__(self) -> str:
+        return "{" + "key = {}, tag = {}, kind = {}".format(self.key, self.tag, self.kind) + "}"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+# The fields shared by all protocols.
+STANDARD_FIELDS = [
+    OptionField("correlation_id", 1, "Q"),
+    OptionField("deadline", 2, "d"),  # seconds since the epoch
+    OptionField("sequence", 3, "I"),
+
+    # The session of a multiplexed protocol (see SessionManager.activate_session).
+    OptionField("session_id", 6, "I"),
+
+    # The layout of an ndarray payload (see csbuilder.cspacket.ndarray).
+    OptionField("ndarray_dtype", 4, str),
+    OptionField("ndarray_shape", 5, bytes),
+]
+
+
+class CSOption(object):
+    """The option of a packet read as a list of TLV fields (see Pool.option).
+    Decoding is lazy: get() only scans the option up to the requested field
+    and only decodes its value; the positions scanned so far are kept."""
+
+    __slots__ = ("_packet", "_fields", "_buffer", "_index", "_cursor")
+
+    def __init__(self, packet) -> None:
+        from csbuilder.pool import Pool
+
+        self._packet = packet
+        self._fields: Dict[str, OptionField] = Pool.get_option_fields(packet.protocol())
+        self._buffer = None
+        self._index: Dict[int, Tuple[int, int]] = {}
+        self._cursor = 0
+
+    def _reset(self) -> None:
+        self._buffer = self._packet.option()
+        self._index = {}
+        self._cursor = 0
+
+    def _find(self, tag: int) -> Tuple[int, int]:
+        # A new option (not a growing one) is indexed again.
+        if self._packet.option() is not self._buffer:
+            self._reset()
+
+        if tag in self._index:
+            return self._index[tag]
+
+        while self._cursor < len(self._buffer):
+            itag, _, start, end = _read_entry(self._buffer, self._cursor)
+            self._index.setdefault(itag, (start, end))
+            self._cursor = end
+            if itag == tag:
+                return start, end
+
+        return None
+
+    def _field(self, key: str) -> OptionField:
+        if not isinstance(key, str):
+            raise HTypeError("key", key, str)
+
+        field = self._fields.get(key, None)
+        if field is None:
+            raise PacketError("The option field {} is not defined in "
+            "{}.".format(key, self._packet.protocol()))
+
+        return field
+
+    def get(self, key: str, default=None):
+        field = self._field(key)
+        position = self._find(field.tag)
+        if position is None:
+            return default
+
+        start, end = position
+        with memoryview(self._buffer) as view:
+            return field.decode(view[start: end])
+
+    def set(self, key: str, value) -> None:
+        "Append the field to the option, or rebuild the option to replace it."
+        field = self._field(key)
+        encoded = field.encode(value)
+
+        if self._find(field.tag) is None:
+            self._packet.update_option(encoded)
+            return
+
+        # Keep the other entries (even unknown ones) as they are.
+        buffer = self._buffer
+        entries = []
+        cursor = 0
+        while cursor < len(buffer):
+            itag, entry_start, _, cursor = _read_entry(buffer, cursor)
+            entries.append(encoded if itag == field.tag else bytes(buffer[entry_start: cursor]))
+
+        self._packet.option(b"".join(entries))
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(self._field(key).tag) is not None
+
+    def items(self) -> Dict[str, object]:
+        "Decode all known fields of the option."
+        self._find(-1)  # index the whole option
+        return {field.key: self.get(field.key)
+            for field in self._fields.values() if field.tag in self._index}
+
+    def __str__(self) -> str:
+        return str(self.items())
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def _read_entry(buffer, cursor: int) -> Tuple[int, int, int, int]:
+    "Return (tag, start of entry, start of value, end of entry) of the entry at cursor."
+    tag = buffer[cursor]
+    length, start = decode_varint(buffer, cursor + 1)
+    end = start + length
+    if end > len(buffer):
+        raise PacketExtractingError("The option field {} is not "
+        "enough length.".format(tag))
+
+    return tag, cursor, start, end
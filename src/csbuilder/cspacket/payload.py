@@ -0,0 +1,221 @@
+import struct
+from typing import Dict, List, Tuple
+
+from hkserror.hkserror import HFormatError, HTypeError
+from csbuilder.errors.packet import PacketError, PacketExtractingError
+
+
+# The struct formats which can be the kind of a fixed-width field.
+_STRUCT_KINDS = "bBhHiIqQfd?"
+
+# The prefix of a length-prefixed field and of a repeated field.
+_LENGTH = struct.Struct(">I")
+
+
+class PayloadObject(object):
+    "The base of the objects decoded by a PayloadSchema."
+
+    __slots__ = ()
+
+    def __init__(self, **values) -> None:
+        for name in self.__slots__:
+            setattr(self, name, values.pop(name, None))
+
+        if values:
+            raise HFormatError("Unexpected fields ({}).".format(set(values.keys())))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __str__(self) -> str:
+        return "{}{}".format(type(self).__name__, self.to_dict())
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def _check_kind(kind) -> None:
+    if kind in (bytes, str):
+        return
+
+    if isinstance(kind, str) and len(kind) == 1 and kind in _STRUCT_KINDS:
+        return
+
+    raise HFormatError("The kind of a field expected bytes, str or one of the "
+    "struct formats {}, but got {}.".format(list(_STRUCT_KINDS), kind))
+
+
+class PayloadSchema(object):
+    """The typed layout of a payload, a list of (name, kind) where kind is a
+    struct format of one number (e.g. "I", "d"), bytes or str (prefixed by
+    their length), or a list [kind] of one kind (a repeated field, prefixed
+    by its count). All integers are big-endian.
+
+    The schema is compiled when it is registered (see Pool.payload): the
+    consecutive fixed-width fields share one struct."""
+
+    __slots__ = ("fields", "name", "_steps", "_cls")
+
+    def __init__(self, fields: List[Tuple[str, object]], name: str = "Payload") -> None:
+        if not isinstance(fields, list):
+            raise HTypeError("fields", fields, list)
+
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        names = set()
+        for field in fields:
+            if not isinstance(field, tuple) or len(field) != 2 or not isinstance(field[0], str):
+                raise HFormatError("A field expected a tuple (name, kind), "
+                "but got {}.".format(field))
+
+            field_name, kind = field
+            if field_name in names:
+                raise HFormatError("The field {} is duplicated.".format(field_name))
+
+            names.add(field_name)
+            if isinstance(kind, list):
+                if len(kind) != 1:
+                    raise HFormatError("A repeated field expected a list of one kind.")
+
+                _check_kind(kind[0])
+            else:
+                _check_kind(kind)
+
+        self.fields = fields
+        self.name = name
+        self._steps = None
+        self._cls = None
+
+    def is_compiled(self) -> bool:
+        return self._steps is not None
+
+    def compile(self) -> None:
+        "Build the encoding steps and the class of decoded objects."
+        if self.is_compiled():
+            return
+
+        steps = []
+        formats, names = "", []
+        for name, kind in self.fields:
+            if isinstance(kind, str):
+                formats += kind
+                names.append(name)
+                continue
+
+            if formats:
+                steps.append(("struct", struct.Struct(">" + formats), tuple(names)))
+                formats, names = "", []
+
+            if isinstance(kind, list):
+                item = kind[0]
+                if isinstance(item, str):
+                    steps.append(("repeated_struct", item, name))
+                else:
+                    steps.append(("repeated_buffer", item is str, name))
+            else:
+                steps.append(("buffer", kind is str, name))
+
+        if formats:
+            steps.append(("struct", struct.Struct(">" + formats), tuple(names)))
+
+        self._cls = type(self.name, (PayloadObject,), {
+            "__slots__": tuple(name for name, _ in self.fields)
+        })
+        self._steps = steps
+
+    def cls(self) -> type:
+        self.compile()
+        return self._cls
+
+    def encode(self, obj) -> bytes:
+        "Encode a decoded object or a dict of the fields."
+        self.compile()
+        if isinstance(obj, PayloadObject):
+            obj = obj.to_dict()
+
+        if not isinstance(obj, dict):
+            raise HTypeError("obj", obj, PayloadObject, dict)
+
+        buffers = []
+        try:
+            for step in self._steps:
+                if step[0] == "struct":
+                    buffers.append(step[1].pack(*[obj[name] for name in step[2]]))
+                elif step[0] == "buffer":
+                    value = obj[step[2]].encode() if step[1] else obj[step[2]]
+                    buffers.append(_LENGTH.pack(len(value)))
+                    buffers.append(value)
+                elif step[0] == "repeated_struct":
+                    values = obj[step[2]]
+                    buffers.append(_LENGTH.pack(len(values)))
+                    buffers.append(struct.pack(">{}{}".format(len(values), step[1]), *values))
+                else:
+                    values = obj[step[2]]
+                    buffers.append(_LENGTH.pack(len(values)))
+                    for value in values:
+                        value = value.encode() if step[1] else value
+                        buffers.append(_LENGTH.pack(len(value)))
+                        buffers.append(value)
+        except KeyError as e:
+            raise PacketError("The field {} of {} is missing.".format(e, self.name))
+        except (struct.error, TypeError, AttributeError) as e:
+            raise PacketError("Cannot encode the payload {} ({}).".format(self.name, e))
+
+        return b"".join(buffers)
+
+    def decode(self, data) -> PayloadObject:
+        self.compile()
+        view = memoryview(data)
+        cursor = 0
+        obj = self._cls.__new__(self._cls)
+        try:
+            for step in self._steps:
+                if step[0] == "struct":
+                    for name, value in zip(step[2], step[1].unpack_from(view, cursor)):
+                        setattr(obj, name, value)
+
+                    cursor += step[1].size
+                elif step[0] == "buffer":
+                    value, cursor = _read_buffer(view, cursor)
+                    setattr(obj, step[2], str(value, "utf-8") if step[1] else value)
+                elif step[0] == "repeated_struct":
+                    count, = _LENGTH.unpack_from(view, cursor)
+                    items = struct.Struct(">{}{}".format(count, step[1]))
+                    setattr(obj, step[2], list(items.unpack_from(view, cursor + _LENGTH.size)))
+                    cursor += _LENGTH.size + items.size
+                else:
+                    count, = _LENGTH.unpack_from(view, cursor)
+                    cursor += _LENGTH.size
+                    values = []
+                    for _ in range(count):
+                        value, cursor = _read_buffer(view, cursor)
+                        values.append(str(value, "utf-8") if step[1] else value)
+
+                    setattr(obj, step[2], values)
+        except (struct.error, UnicodeDecodeError) as e:
+            raise PacketExtractingError("Cannot decode the payload {} ({}).".format(self.name, e))
+
+        if cursor != len(view):
+            raise PacketExtractingError("The payload {} has {} unexpected "
+            "bytes.".format(self.name, len(view) - cursor))
+
+        return obj
+
+    def __str__(self) -> str:
+        return "{" + "name = {}, fields = {}".format(self.name, self.fields) + "}"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def _read_buffer(view: memoryview, cursor: int) -> Tuple[bytes, int]:
+    length, = _LENGTH.unpack_from(view, cursor)
+    cursor += _LENGTH.size
+    if len(view) - cursor < length:
+        raise PacketExtractingError("A field of the payload is not enough length.")
+
+    return bytes(view[cursor: cursor + length]), cursor + length
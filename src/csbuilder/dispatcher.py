@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from hkserror import HTypeError
+
+
+# The number of workers of the executor shared by the dispatchers.
+DEFAULT_WORKERS = 8
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def default_executor() -> Executor:
+    "The thread pool shared by the dispatchers of the process."
+    global _default_executor
+
+    if _default_executor is None:
+        with _default_lock:
+            if _default_executor is None:
+                _default_executor = ThreadPoolExecutor(DEFAULT_WORKERS, "Dispatch")
+
+    return _default_executor
+
+
+class SerialDispatcher(object):
+    """Run tasks on an executor in one serial queue per key: the tasks of
+    a key run one at a time in the order they were submitted, the tasks of
+    different keys run in parallel.
+
+    A queue gives its worker back after BURST tasks, so that a busy key
+    does not keep a worker from the other keys.
+
+    A task raising an exception does not stop the tasks queued after it,
+    the exception is passed to on_error (or ignored if it is None)."""
+
+    BURST = 16
+
+    def __init__(self, executor: Executor = None, on_error: Callable[[Exception], None] = None) -> None:
+        if executor is not None and not isinstance(executor, Executor):
+            raise HTypeError("executor", executor, Executor, None)
+
+        if on_error is not None and not callable(on_error):
+            raise HTypeError("on_error", on_error, Callable, None)
+
+        self._executor = executor or default_executor()
+        self._on_error = on_error
+        self._queues: Dict[Hashable, Deque[Tuple[Callable, tuple]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any) -> None:
+        "Run fn(*args) after the tasks submitted before with the same key."
+        with self._lock:
+            queue = self._queues.get(key, None)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+
+            # The queue exists as long as a worker drains it.
+            self._queues[key] = deque([(fn, args)])
+
+        self._executor.submit(self._drain, key)
+
+    def pending(self) -> int:
+        "The number of tasks which are not finished."
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _drain(self, key: Hashable) -> None:
+        queue = self._queues[key]
+        for _ in range(self.BURST):
+            fn, args = queue[0]
+            try:
+                fn(*args)
+            except Exception as e:
+                self._error(e)
+
+            with self._lock:
+                queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                    return
+
+        self._executor.submit(self._drain, key)
+
+    def _error(self, e: Exception) -> None:
+        if self._on_error is None:
+            return
+
+        try:
+            self._on_error(e)
+        except Exception:
+            # The queue must be drained even if the callback fails.
+            pass
@@ -1,2 +1,2 @@
 from csbuilder.pool.pool import Pool
-from csbuilder.pool.func import protocols, states, roles, scheme, response, active_activation
+from csbuilder.pool.func import protocols, states, roles, scheme, response, active_activation, dictionary, option, payload
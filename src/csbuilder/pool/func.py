@@ -2,6 +2,8 @@ from typing import Any, Type
 
 from csbuilder.pool.pool import Pool
 from csbuilder.standard import Protocols, Roles, States
+from csbuilder.cspacket.payload import PayloadSchema
+from csbuilder.compression.dictionary import CompressionDictionary
 
 
 def protocols(group: Protocols):
@@ -20,9 +22,21 @@ def scheme(protocol: Type[Protocols], role: Roles, passive_activation: States =
     return Pool.scheme(protocol, role, passive_activation)
 
 
-def response(state: States):
-    return Pool.response(state)
+def response(state: States, payload: PayloadSchema = None, executor: str = None):
+    return Pool.response(state, payload, executor)
 
 
 def active_activation(method):
     return Pool.active_activation(method)
+
+
+def option(protocol: Protocols, key: str, tag: int, kind):
+    return Pool.option(protocol, key, tag, kind)
+
+
+def payload(state: States, schema: PayloadSchema):
+    return Pool.payload(state, schema)
+
+
+def dictionary(protocol: Protocols, dictionary: CompressionDictionary):
+    return Pool.dictionary(protocol, dictionary)
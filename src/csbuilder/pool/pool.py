@@ -1,15 +1,28 @@
-from typing import Any, Callable, Dict, List, Tuple, Type
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Type
 
 from hks_pylib.hksenum import get_enum
 
 from csbuilder.scheme import Scheme
-from csbuilder.standard import Roles, Protocols, States
+from csbuilder.scheme.offload import check_executor
+from csbuilder.cspacket.header import CSHeader
+from csbuilder.cspacket.control import CONTROL_PROTOCOL
+from csbuilder.cspacket.option import OptionField, STANDARD_FIELDS, MIN_PROTOCOL_TAG
+from csbuilder.cspacket.payload import PayloadSchema
+from csbuilder.standard import Roles, Protocols, States, ROLE_SIZE, STATE_SIZE
+from csbuilder.compression.dictionary import CompressionDictionary
 
 from csbuilder.errors.pool import PoolError
 from csbuilder.errors.pool import PredefinitionError
 from hkserror.hkserror import HFormatError, HTypeError
 
 
+# The format of the manifests exported by Pool.export_manifest().
+MANIFEST_FORMAT = 1
+
+
 def is_preparing():
     pass
 
@@ -17,11 +30,16 @@ def none():
     pass
 
 class SchemaStructure(object):
+    __slots__ = ("_states", "_scheme", "_active_activation", "_passive_activation",
+        "_headers", "_responses")
+
     def __init__(self) -> None:
         self._states: Type[States] = None
         self._scheme: Scheme = None
         self._active_activation = none
         self._passive_activation = None
+        self._headers: Dict[States, bytes] = None
+        self._responses: Dict[States, Callable] = None
 
     def states(self, states: Type[States] = None) -> Type[States]:
         if states is None:
@@ -57,6 +75,31 @@ class SchemaStructure(object):
 
         self._passive_activation = passive_activation
 
+    def headers(self, headers: Dict[States, bytes] = None) -> Dict[States, bytes]:
+        if headers is None:
+            return self._headers
+
+        if not isinstance(headers, dict):
+            raise HTypeError("headers", headers, dict, None)
+
+        self._headers = headers
+
+    def responses(self, responses: Dict[States, Callable] = None) -> Dict[States, Callable]:
+        if responses is None:
+            return self._responses
+
+        if not isinstance(responses, dict):
+            raise HTypeError("responses", responses, dict, None)
+
+        self._responses = responses
+
+    def copy(self) -> "SchemaStructure":
+        structure = SchemaStructure()
+        for name in SchemaStructure.__slots__:
+            setattr(structure, name, getattr(self, name))
+
+        return structure
+
     def __repr__(self) -> str:
         return str(self)
 
@@ -71,6 +114,8 @@ class SchemaStructure(object):
 
 
 class RevertSchemaStructure(object):
+    __slots__ = ("_protocol", "_role")
+
     def __init__(self, protocol: Protocols, role: Roles) -> None:
         self._protocol = protocol
         self._role = role
@@ -88,34 +133,126 @@ class RevertSchemaStructure(object):
         return "{" + "protocol = {}, role = {}".format(self._protocol, self._role) + "}"
 
 
+class PoolRegistry(object):
+    """All definitions of Pool. A published registry is never modified: a
+    registration modifies a copy and publishes it (see Pool.update()), so
+    that readers need no lock.
+
+    The packet index maps packet_key() of every valid (protocol, role,
+    state) to its enum triple. The lazy protocols are the entries of a
+    loaded manifest whose modules are not imported yet (see
+    Pool.load_manifest()), the failed ones are the reasons why the import
+    of a lazy protocol failed; it is not retried."""
+
+    __slots__ = ("protocols", "schemes", "states", "responses", "dictionaries",
+        "options", "payloads", "executors", "int2protocol", "int2role", "packets", "lazy", "failed")
+
+    def __init__(self) -> None:
+        self.protocols: Dict[Protocols, Dict[Roles, SchemaStructure]] = {}
+        self.schemes: Dict[Scheme, RevertSchemaStructure] = {}
+        self.states: Dict[Type[States], RevertSchemaStructure] = {}
+        self.responses: Dict[States, Any] = {}
+        self.dictionaries: Dict[Protocols, CompressionDictionary] = {}
+        self.options: Dict[Protocols, Dict[str, OptionField]] = {}
+        self.payloads: Dict[States, PayloadSchema] = {}
+        self.executors: Dict[States, str] = {}
+
+        self.int2protocol: Dict[int, Protocols] = {}
+        self.int2role: Dict[Tuple[int, int], Roles] = {}
+        self.packets: Dict[int, Tuple[Protocols, Roles, States]] = {}
+        self.lazy: Dict[int, Dict[str, Any]] = {}
+        self.failed: Dict[int, str] = {}
+
+    def copy(self) -> "PoolRegistry":
+        "Copy the registry, deep enough that modifying the copy never changes it."
+        registry = PoolRegistry()
+        for name in PoolRegistry.__slots__:
+            setattr(registry, name, dict(getattr(self, name)))
+
+        registry.protocols = {
+            protocol: {role: structure.copy() for role, structure in roles.items()}
+            for protocol, roles in self.protocols.items()
+        }
+        registry.options = {protocol: dict(fields) for protocol, fields in self.options.items()}
+        return registry
+
+
 class Pool(object):
-    __protocols: Dict[Protocols, Dict[Roles, SchemaStructure]] = {}
-    __schemes: Dict[Scheme, RevertSchemaStructure] = {}
-    __states: Dict[Type[States], RevertSchemaStructure] = {}
-    __responses: Dict[States, Any] = {}
+    # The published registry. Readers load it once and use it without lock,
+    # the writers are serialized by the lock.
+    __registry: PoolRegistry = PoolRegistry()
+    __lock = threading.Lock()
+
+    @staticmethod
+    @contextmanager
+    def update() -> Iterator[PoolRegistry]:
+        """Modify a copy of the registry and publish it at the end of the
+        block, in a single assignment. Nothing is published if the block
+        raises an exception. Do not call Pool.update() inside the block."""
+        with Pool.__lock:
+            registry = Pool.__registry.copy()
+            yield registry
+            Pool.__registry = registry
+
+    @staticmethod
+    def snapshot() -> PoolRegistry:
+        "Return the published registry, which must not be modified."
+        return Pool.__registry
 
     @staticmethod
     def int2protocol(i: int) -> Protocols:
         if not isinstance(i, int):
             raise HTypeError("i", i, int)
 
-        for protocol in Pool.__protocols.keys():
-            if protocol.value == i:
-                return protocol
+        return Pool.__registry.int2protocol.get(i, None)
+
+    @staticmethod
+    def int2role(protocol: int, i: int) -> Roles:
+        if not isinstance(protocol, int):
+            raise HTypeError("protocol", protocol, int)
+
+        if not isinstance(i, int):
+            raise HTypeError("i", i, int)
+
+        return Pool.__registry.int2role.get((protocol, i), None)
+
+    @staticmethod
+    def lookup(protocol: int, role: int, state: int) -> Tuple[Protocols, Roles, States]:
+        """Return the (protocol, role, state) enums of the values, or None
+        if they are not a valid combination. It costs a single dict lookup.
+
+        The modules of a lazy protocol are imported on its first packet."""
+        registry = Pool.__registry
+        triple = registry.packets.get(packet_key(protocol, role, state), None)
+        if triple is None and protocol in registry.lazy and Pool.import_protocol(protocol):
+            triple = Pool.__registry.packets.get(packet_key(protocol, role, state), None)
+
+        return triple
 
-        return None
+    @staticmethod
+    def is_valid(protocol: Protocols, role: Roles, state: States) -> bool:
+        triple = Pool.__registry.packets.get(packet_key(protocol.value, role.value, state.value), None)
+        return triple is not None and triple[2] is state
 
     @staticmethod
     def protocols(group: Type[Protocols]):
         if not issubclass(group, Protocols):
             raise HTypeError("group", group, Type[Protocols])
 
-        for protocol in group:
-            if get_enum(Pool.__protocols, protocol.value, None) != None:
-                raise PoolError("Protocol {} has already existed "
-                "in the packet pool.".format(protocol))
+        with Pool.update() as registry:
+            for protocol in group:
+                if protocol.value == CONTROL_PROTOCOL:
+                    raise PoolError("The value of protocol {} is reserved "
+                    "for control messages.".format(protocol))
 
-            Pool.__protocols.update({protocol: {}})
+                if get_enum(registry.protocols, protocol.value, None) != None:
+                    raise PoolError("Protocol {} has already existed "
+                    "in the packet pool.".format(protocol))
+
+                registry.protocols.update({protocol: {}})
+                registry.int2protocol.update({protocol.value: protocol})
+                registry.lazy.pop(protocol.value, None)
+                registry.options.update({protocol: {field.key: field for field in STANDARD_FIELDS}})
 
         return group
 
@@ -124,7 +261,7 @@ class Pool(object):
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols)
 
-        if protocol not in Pool.__protocols.keys():
+        if protocol not in Pool.__registry.protocols.keys():
             raise PoolError("The protocol {} has not been "
             "defined yet.".format(protocol))
 
@@ -135,12 +272,18 @@ class Pool(object):
             if len(group) != 2:
                 raise HFormatError("The role group must have exactly two elements.")
 
-            for role in group:
-                if role in Pool.__protocols[protocol].keys():
-                    raise PoolError("Role {} has already "
-                    "defined in the protocol {}.".format(role, protocol))
+            with Pool.update() as registry:
+                if protocol not in registry.protocols.keys():
+                    raise PoolError("The protocol {} has not been "
+                    "defined yet.".format(protocol))
+
+                for role in group:
+                    if role in registry.protocols[protocol].keys():
+                        raise PoolError("Role {} has already "
+                        "defined in the protocol {}.".format(role, protocol))
 
-                Pool.__protocols[protocol].update({role: SchemaStructure()})
+                    registry.protocols[protocol].update({role: SchemaStructure()})
+                    registry.int2role.update({(protocol.value, role.value): role})
 
             return group
 
@@ -151,18 +294,19 @@ class Pool(object):
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} has not been "
             "defined yet.".format(protocol))
 
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if role not in Pool.__protocols[protocol].keys():
+        if role not in registry.protocols[protocol].keys():
             raise PoolError("The role {} has not been "
             "defined yet.".format(role))
 
-        if Pool.__protocols[protocol][role].states() is not None:
+        if registry.protocols[protocol][role].states() is not None:
             raise PoolError("The states of {}.{} has been "
             "already defined.".format(protocol.value, role.value))
 
@@ -174,11 +318,23 @@ class Pool(object):
                 raise HFormatError("The state group {} "
                 "must contain the IGNORE element.".format(group.__name__))
 
-            Pool.__protocols[protocol][role].states(group)
-            Pool.__states.update({group: RevertSchemaStructure(protocol, role)})
+            with Pool.update() as registry:
+                structure = registry.protocols[protocol][role]
+                if structure.states() is not None:
+                    raise PoolError("The states of {}.{} has been "
+                    "already defined.".format(protocol.value, role.value))
 
-            for state in group:
-                Pool.__responses.update({state: None})
+                structure.states(group)
+                registry.states.update({group: RevertSchemaStructure(protocol, role)})
+
+                if structure.scheme() is not None:
+                    structure.headers(build_headers(protocol, role, group))
+
+                for state in group:
+                    registry.responses.update({state: None})
+                    registry.packets.update({
+                        packet_key(protocol.value, role.value, state.value): (protocol, role, state)
+                    })
 
             return group
 
@@ -189,102 +345,360 @@ class Pool(object):
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols)
 
-        if protocol not in Pool.__protocols.keys():
-            raise PoolError("The protocol {} has not been "
-            "defined yet.".format(protocol))
-
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if role not in Pool.__protocols[protocol].keys():
-            raise PoolError("The role {} has not been "
-            "defined yet.".format(role))
-
         if passive_activation is not None and not isinstance(passive_activation, States):
             raise HTypeError("passive_activation", passive_activation, States, None)
 
-        if Pool.__protocols[protocol][role].scheme() is not None:
-            raise PoolError("The scheme of {}.{} has been "
-            "already defined.".format(protocol.value, role.value))
+        with Pool.update() as registry:
+            if protocol not in registry.protocols.keys():
+                raise PoolError("The protocol {} has not been "
+                "defined yet.".format(protocol))
+
+            if role not in registry.protocols[protocol].keys():
+                raise PoolError("The role {} has not been "
+                "defined yet.".format(role))
 
-        Pool.__protocols[protocol][role].passive_activation(passive_activation)
-        Pool.__protocols[protocol][role].active_activation(is_preparing)
+            if registry.protocols[protocol][role].scheme() is not None:
+                raise PoolError("The scheme of {}.{} has been "
+                "already defined.".format(protocol.value, role.value))
+
+            registry.protocols[protocol][role].passive_activation(passive_activation)
+            registry.protocols[protocol][role].active_activation(is_preparing)
 
         def _add_scheme(cls: Type[Scheme]):
             if not issubclass(cls, Scheme):
                 raise HTypeError("cls", cls, Type[Scheme])
 
-            validate_activation(cls, protocol, role)
-            validate_responses(cls, protocol, role)
+            with Pool.update() as registry:
+                # The validation reads the published registry, which is the
+                # same as this copy until it is modified below.
+                validate_activation(cls, protocol, role)
+                validate_responses(cls, protocol, role)
+
+                structure = registry.protocols[protocol][role]
+                if structure.scheme() is not None:
+                    raise PoolError("The scheme of {}.{} has been "
+                    "already defined.".format(protocol.value, role.value))
+
+                # The response functions are resolved once here, sessions only
+                # bind them to their scheme.
+                opposite_role = Pool.get_opposite_role(protocol, role)
+                structure.responses({
+                    state: registry.responses[state]
+                    for state in Pool.get_states(protocol, opposite_role)
+                })
+
+                structure.scheme(cls)
+                registry.schemes.update({cls: RevertSchemaStructure(protocol, role)})
+
+                if structure.states() is not None:
+                    structure.headers(build_headers(protocol, role, structure.states()))
 
-            Pool.__protocols[protocol][role].scheme(cls)
-            Pool.__schemes.update({cls: RevertSchemaStructure(protocol, role)})
+                if structure.active_activation() is is_preparing:
+                    structure.active_activation(none)
 
-            if Pool.get_active_activation(protocol, role) is is_preparing:
-                Pool.__protocols[protocol][role].active_activation(none)
             return cls
 
         return _add_scheme
 
     @staticmethod
-    def response(state: States):
+    def response(state: States, payload: PayloadSchema = None, executor: str = None):
+        """The payload is the schema of the state (see Pool.payload). The
+        executor "process" runs the response in the process pool (see
+        csbuilder.scheme.offload)."""
         if not isinstance(state, States):
             raise HTypeError("state", state, States)
 
-        if state not in Pool.__responses.keys():
+        if payload is not None and not isinstance(payload, PayloadSchema):
+            raise HTypeError("payload", payload, PayloadSchema, None)
+
+        check_executor(executor)
+
+        if state not in Pool.__registry.responses.keys():
             raise PoolError("The state {} has not defined yet.".format(state))
 
-        if Pool.__responses[state] is not None:
+        if Pool.__registry.responses[state] is not None:
             raise PoolError("The state {} has already defined.".format(state))
 
         def _add_response(method):
             if not callable(method):
                 raise HTypeError("method", method, Callable)
 
-            Pool.__responses[state] = method
+            with Pool.update() as registry:
+                if registry.responses[state] is not None:
+                    raise PoolError("The state {} has already defined.".format(state))
+
+                registry.responses[state] = method
+                if executor is not None:
+                    registry.executors[state] = executor
+
             return method
 
+        if payload is not None:
+            Pool.payload(state, payload)
+
         return _add_response
 
+    @staticmethod
+    def payload(state: States, schema: PayloadSchema) -> PayloadSchema:
+        "Attach a payload schema to the state, it is compiled here."
+        if not isinstance(state, States):
+            raise HTypeError("state", state, States)
+
+        if not isinstance(schema, PayloadSchema):
+            raise HTypeError("schema", schema, PayloadSchema)
+
+        schema.compile()
+        with Pool.update() as registry:
+            if state not in registry.responses.keys():
+                raise PoolError("The state {} has not defined yet.".format(state))
+
+            if state in registry.payloads.keys():
+                raise PoolError("The payload of {} has already defined.".format(state))
+
+            registry.payloads.update({state: schema})
+
+        return schema
+
+    @staticmethod
+    def get_executor(state: States) -> str:
+        "Return the executor of the response of the state, or None."
+        if not isinstance(state, States):
+            raise HTypeError("state", state, States)
+
+        return Pool.__registry.executors.get(state, None)
+
+    @staticmethod
+    def get_payload_schema(state: States) -> PayloadSchema:
+        "Return the payload schema of the state, or None."
+        if not isinstance(state, States):
+            raise HTypeError("state", state, States)
+
+        return Pool.__registry.payloads.get(state, None)
+
     @staticmethod
     def active_activation(method):
         if not callable(method):
             raise HTypeError("method", method, Callable)
 
-        protocol = None
-        role = None
-        count = 0
-        for p in Pool.__protocols.keys():
-            for r in Pool.__protocols[p].keys():
-                if Pool.__protocols[p][r].active_activation() == is_preparing:
-                    count += 1
-                    protocol = p
-                    role = r
-
-        if count == 0:
-            raise PredefinitionError("Something wrongs. "
-            "There are no preparing activation.")
-
-        if count > 1:
-            raise PredefinitionError("Something wrongs. "
-            "There are many preparing activations.")
-
-        Pool.__protocols[protocol][role].active_activation(method)
+        with Pool.update() as registry:
+            preparing = [
+                structure
+                for roles in registry.protocols.values()
+                for structure in roles.values()
+                if structure.active_activation() == is_preparing
+            ]
+
+            if len(preparing) == 0:
+                raise PredefinitionError("Something wrongs. "
+                "There are no preparing activation.")
+
+            if len(preparing) > 1:
+                raise PredefinitionError("Something wrongs. "
+                "There are many preparing activations.")
+
+            preparing[0].active_activation(method)
+
         return method
 
+    @staticmethod
+    def dictionary(protocol: Protocols, dictionary: CompressionDictionary) -> CompressionDictionary:
+        "Register the preset compression dictionary of a protocol."
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if not isinstance(dictionary, CompressionDictionary):
+            raise HTypeError("dictionary", dictionary, CompressionDictionary)
+
+        with Pool.update() as registry:
+            if protocol not in registry.protocols.keys():
+                raise PoolError("The protocol {} has not been "
+                "defined yet.".format(protocol))
+
+            if protocol in registry.dictionaries.keys():
+                raise PoolError("The dictionary of {} has been "
+                "already defined.".format(protocol))
+
+            registry.dictionaries.update({protocol: dictionary})
+
+        return dictionary
+
+    @staticmethod
+    def option(protocol: Protocols, key: str, tag: int, kind) -> OptionField:
+        """Register a typed field of the option of a protocol (see CSOption).
+        The tags lower than MIN_PROTOCOL_TAG are the standard fields."""
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if not isinstance(tag, int):
+            raise HTypeError("tag", tag, int)
+
+        if tag < MIN_PROTOCOL_TAG:
+            raise HFormatError("The tags lower than {} are reserved for "
+            "the standard fields.".format(MIN_PROTOCOL_TAG))
+
+        field = OptionField(key, tag, kind)
+        with Pool.update() as registry:
+            if protocol not in registry.protocols.keys():
+                raise PoolError("The protocol {} has not been "
+                "defined yet.".format(protocol))
+
+            for other in registry.options[protocol].values():
+                if other.key == key or other.tag == tag:
+                    raise PoolError("The option field {} of {} has already "
+                    "existed ({}).".format(field, protocol, other))
+
+            registry.options[protocol].update({key: field})
+
+        return field
+
+    @staticmethod
+    def get_option_fields(protocol: Protocols) -> Dict[str, OptionField]:
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
+            raise PoolError("The protocol {} doesn't exist "
+            "in Pool.".format(protocol))
+
+        return registry.options[protocol]
+
+    @staticmethod
+    def export_manifest() -> Dict[str, Any]:
+        """Return the manifest of the registered protocols, a JSON-compatible
+        dict of their values, names and the modules defining them. The
+        modules must be importable by name (not __main__)."""
+        registry = Pool.__registry
+        protocols = []
+        for protocol, roles in registry.protocols.items():
+            modules = [type(protocol).__module__]
+            role_entries = []
+            for role, structure in roles.items():
+                modules.append(type(role).__module__)
+                states = structure.states()
+                if states is not None:
+                    modules.append(states.__module__)
+
+                if structure.scheme() is not None:
+                    modules.append(structure.scheme().__module__)
+
+                role_entries.append({
+                    "name": role.name,
+                    "value": role.value,
+                    "states": [[state.name, state.value] for state in states or []]
+                })
+
+            modules = list(dict.fromkeys(modules))
+            if "__main__" in modules:
+                raise PoolError("The protocol {} is defined in __main__, "
+                "which cannot be imported by name.".format(protocol))
+
+            protocols.append({
+                "name": protocol.name,
+                "value": protocol.value,
+                "modules": modules,
+                "roles": role_entries
+            })
+
+        return {"format": MANIFEST_FORMAT, "protocols": protocols}
+
+    @staticmethod
+    def load_manifest(manifest: Dict[str, Any]) -> None:
+        """Make the protocols of a manifest (see Pool.export_manifest()) lazy:
+        their modules are imported when their first packet is looked up,
+        or by Pool.import_protocol(). The registered protocols are skipped,
+        the failed imports are retried."""
+        if not isinstance(manifest, dict):
+            raise HTypeError("manifest", manifest, dict)
+
+        if manifest.get("format", None) != MANIFEST_FORMAT:
+            raise HFormatError("The manifest format expected {}, but got "
+            "{}.".format(MANIFEST_FORMAT, manifest.get("format", None)))
+
+        with Pool.update() as registry:
+            for entry in manifest.get("protocols", []):
+                if not isinstance(entry, dict) or not isinstance(entry.get("value", None), int) \
+                        or not isinstance(entry.get("modules", None), list):
+                    raise HFormatError("A protocol of the manifest expected a dict "
+                    "with a value and modules, but got {}.".format(entry))
+
+                if entry["value"] not in registry.int2protocol:
+                    registry.lazy.update({entry["value"]: entry})
+                    registry.failed.pop(entry["value"], None)
+
+    @staticmethod
+    def import_protocol(value: int) -> bool:
+        """Import the modules of a lazy protocol. Return False if the value
+        is not a lazy protocol, raise PoolError if the modules cannot be
+        imported or do not define the protocol as the manifest does. A
+        failed import is not retried, its reason is recorded (see
+        Pool.get_import_error())."""
+        if not isinstance(value, int):
+            raise HTypeError("value", value, int)
+
+        entry = Pool.__registry.lazy.get(value, None)
+        if entry is None:
+            return False
+
+        try:
+            Pool.__import_modules(value, entry)
+        except PoolError as e:
+            with Pool.update() as registry:
+                registry.lazy.pop(value, None)
+                registry.failed.update({value: e.args[0]})
+            raise
+
+        return True
+
+    @staticmethod
+    def __import_modules(value: int, entry: Dict[str, Any]) -> None:
+        try:
+            for module in entry["modules"]:
+                importlib.import_module(module)
+        except ImportError as e:
+            raise PoolError("Cannot import the protocol {} of the manifest "
+            "({}).".format(value, e))
+
+        with Pool.update() as registry:
+            registry.lazy.pop(value, None)
+
+        protocol = Pool.int2protocol(value)
+        if protocol is None or protocol.name != entry.get("name", protocol.name):
+            raise PoolError("The manifest is outdated, the modules {} do not define "
+            "the protocol {}.".format(entry["modules"], value))
+
+        for role_entry in entry.get("roles", []):
+            role = Pool.int2role(value, role_entry["value"])
+            states = Pool.get_states(protocol, role) if role is not None else None
+            if states is None or [[state.name, state.value] for state in states] != role_entry["states"]:
+                raise PoolError("The manifest is outdated, the states of the role {} "
+                "of {} have changed.".format(role_entry["name"], protocol))
+
+    @staticmethod
+    def get_import_error(value: int) -> str:
+        "Return why the import of the lazy protocol failed, or None."
+        if not isinstance(value, int):
+            raise HTypeError("value", value, int)
+
+        return Pool.__registry.failed.get(value, None)
+
     @staticmethod
     def get_protocols() -> List[Protocols]:
-        return list(Pool.__protocols.keys())
+        return list(Pool.__registry.protocols.keys())
 
     @staticmethod
     def get_roles(protocol: Protocols) -> List[Roles]:
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} has not defined yet.".format(protocol))
 
-        return list(Pool.__protocols[protocol].keys())
+        return list(registry.protocols[protocol].keys())
 
     @staticmethod
     def get_opposite_role(
@@ -314,15 +728,16 @@ class Pool(object):
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} doesn't exist "
             "in Pool.".format(protocol))
 
-        if role not in Pool.__protocols[protocol].keys():
+        if role not in registry.protocols[protocol].keys():
             raise PoolError("The role {} doesn't exist in "
             "Pool.{}.".format(role, protocol.name))
 
-        return Pool.__protocols[protocol][role].states()
+        return registry.protocols[protocol][role].states()
 
     @staticmethod
     def get_scheme(protocol: Protocols, role: Roles) -> Scheme:
@@ -332,26 +747,81 @@ class Pool(object):
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} doesn't exist "
             "in Pool.".format(protocol))
 
-        if role not in Pool.__protocols[protocol].keys():
+        if role not in registry.protocols[protocol].keys():
             raise PoolError("The role {} doesn't exist in "
             "Pool.{}.".format(role, protocol.name))
 
-        return Pool.__protocols[protocol][role].scheme()
+        return registry.protocols[protocol][role].scheme()
+
+    @staticmethod
+    def get_responses(protocol: Protocols, role: Roles) -> Dict[States, Callable]:
+        """Return the response functions of the scheme of (protocol, role),
+        by the states of the opposite role, resolved when it was registered."""
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if not isinstance(role, Roles):
+            raise HTypeError("role", role, Roles)
+
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
+            raise PoolError("The protocol {} doesn't exist "
+            "in Pool.".format(protocol))
+
+        if role not in registry.protocols[protocol].keys():
+            raise PoolError("The role {} doesn't exist in "
+            "Pool.{}.".format(role, protocol.name))
+
+        return registry.protocols[protocol][role].responses()
+
+    @staticmethod
+    def get_headers(protocol: Protocols, role: Roles) -> Dict[States, bytes]:
+        "Return the header templates of all states, precomputed for the scheme."
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if not isinstance(role, Roles):
+            raise HTypeError("role", role, Roles)
+
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
+            raise PoolError("The protocol {} doesn't exist "
+            "in Pool.".format(protocol))
+
+        if role not in registry.protocols[protocol].keys():
+            raise PoolError("The role {} doesn't exist in "
+            "Pool.{}.".format(role, protocol.name))
+
+        return registry.protocols[protocol][role].headers()
+
+    @staticmethod
+    def get_dictionary(protocol: Protocols) -> CompressionDictionary:
+        "Return the compression dictionary of the protocol, or None."
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        return Pool.__registry.dictionaries.get(protocol, None)
+
+    @staticmethod
+    def get_dictionaries() -> Dict[Protocols, CompressionDictionary]:
+        return dict(Pool.__registry.dictionaries)
 
     @staticmethod
     def get_response(state: States):
         if not isinstance(state, States):
             raise HTypeError("state", state, States)
 
-        if state not in Pool.__responses.keys():
+        responses = Pool.__registry.responses
+        if state not in responses.keys():
             raise PoolError("The state {} doesn't exist in "
             "Pool.".format(state))
 
-        return Pool.__responses[state]
+        return responses[state]
 
     @staticmethod
     def get_active_activation(protocol: Protocols, role: Roles):
@@ -361,15 +831,16 @@ class Pool(object):
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} doesn't exist "
             "in Pool.".format(protocol))
 
-        if role not in Pool.__protocols[protocol].keys():
+        if role not in registry.protocols[protocol].keys():
             raise PoolError("The role {} doesn't exist in "
             "Pool.{}.".format(role, protocol.name))
 
-        return Pool.__protocols[protocol][role].active_activation()
+        return registry.protocols[protocol][role].active_activation()
 
     @staticmethod
     def get_passive_activation(protocol: Protocols, role: Roles):
@@ -379,26 +850,27 @@ class Pool(object):
         if not isinstance(role, Roles):
             raise HTypeError("role", role, Roles)
 
-        if protocol not in Pool.__protocols.keys():
+        registry = Pool.__registry
+        if protocol not in registry.protocols.keys():
             raise PoolError("The protocol {} doesn't exist "
             "in Pool.".format(protocol))
 
-        if role not in Pool.__protocols[protocol].keys():
+        if role not in registry.protocols[protocol].keys():
             raise PoolError("The role {} doesn't exist in "
             "Pool.{}.".format(role, protocol.name))
 
-        return Pool.__protocols[protocol][role].passive_activation()
+        return registry.protocols[protocol][role].passive_activation()
 
     @staticmethod
     def revert_scheme(scheme: Type[Scheme]) -> Tuple[Protocols, Roles]:
         if not issubclass(scheme, Scheme):
             raise HTypeError("scheme", scheme, Type[Scheme])
 
-        if scheme not in Pool.__schemes.keys():
+        revert = Pool.__registry.schemes.get(scheme, None)
+        if revert is None:
             raise PoolError("The scheme {} has not "
             "defined yet in Pool.".format(scheme.__name__))
 
-        revert = Pool.__schemes[scheme]
         return revert.protocol(), revert.role()
 
     @staticmethod
@@ -406,11 +878,11 @@ class Pool(object):
         if not issubclass(states, States):
             raise HTypeError("states", states, Type[States])
 
-        if states not in Pool.__states.keys():
+        revert = Pool.__registry.states.get(states, None)
+        if revert is None:
             raise PoolError("The states {} has not "
             "defined yet in Pool.".format(states.__name__))
-        
-        revert = Pool.__states[states]
+
         return revert.protocol(), revert.role()
 
     @staticmethod
@@ -452,3 +924,16 @@ def validate_responses(cls: Type[Scheme], protocol: Protocols, role: Roles):
         if response not in cls.__dict__.values():
             raise PredefinitionError("Scheme and response are mismatched ({}/{}). "
             "Requiring the response belonging to the scheme.".format(cls, response))
+
+
+def packet_key(protocol: int, role: int, state: int) -> int:
+    "Pack the values of (protocol, role, state) into one integer."
+    return (((protocol << (ROLE_SIZE * 8)) | role) << (STATE_SIZE * 8)) | state
+
+
+def build_headers(protocol: Protocols, role: Roles, states: Type[States]) -> Dict[States, bytes]:
+    headers = {}
+    for state in states:
+        headers[state] = CSHeader.template(protocol.value, role.value, state.value)
+
+    return headers
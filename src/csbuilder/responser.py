@@ -1,5 +1,6 @@
 import threading
-from typing import Optional, Tuple
+from typing import Dict, Hashable, List, Optional, Tuple
+from concurrent.futures import Executor
 
 from hks_pylib.done import Done
 from hks_pylib.logger.standard import StdLevels, StdUsers
@@ -9,15 +10,39 @@ from hks_pynetwork.internal import LocalNode
 
 from csbuilder.standard import Protocols, Roles
 from csbuilder.session import SessionManager
-from csbuilder.cspacket import CSPacket, CSPacketField
+from csbuilder.cspacket import CSPacket, CSPacketField, CSBatch, CSHello, CSFormat
+from csbuilder.cspacket.header import FORMAT_V1
+from csbuilder.compression import CompressionPolicy
+from csbuilder.compression.codec import MAX_DECOMPRESSED_SIZE
+from csbuilder.cspacket.control import is_control
+from csbuilder.dispatcher import SerialDispatcher
 
 from hkserror import HTypeError
 from hks_pynetwork.errors.internal import ChannelClosedError
 
+from csbuilder.errors import ManagementScopeError
 from csbuilder.errors.packet import PacketExtractingError
 
 
 class Responser(object):
+    # If True, received packets keep their option and payload as read-only
+    # views into the received message instead of copying them.
+    ZERO_COPY = False
+
+    # The maximum size of a received payload after decompression.
+    MAX_DECOMPRESSED_SIZE = MAX_DECOMPRESSED_SIZE
+
+    # The header format of the packets sent to a peer, once the peer has
+    # announced that it can receive it (FORMAT_V2 is the compact header).
+    HEADER_FORMAT = FORMAT_V1
+
+    # If True, the received packets are solved by workers instead of the
+    # receiving thread: in order within a session (see dispatch_key()), in
+    # parallel across sessions. The executor is DISPATCH_EXECUTOR, or the
+    # thread pool shared by the responsers if it is None.
+    DISPATCH = False
+    DISPATCH_EXECUTOR: Executor = None
+
     def __init__(
                     self,
                     name: Optional[str] = None,
@@ -55,6 +80,23 @@ class Responser(object):
             display=display
         )
 
+        self._compression: Dict[Protocols, CompressionPolicy] = {}
+
+        # The capabilities of peers, received by hello messages.
+        self._peers: Dict[str, CSHello] = {}
+        self._hello_sent = set()
+
+        # The header formats of the packets sent to and received from peers,
+        # changed by format messages (see CSFormat). The lock keeps a switch
+        # from interleaving with the packets being sent.
+        self._send_formats: Dict[str, int] = {}
+        self._recv_formats: Dict[str, int] = {}
+        self._send_lock = threading.Lock()
+
+        self._dispatcher = None
+        if self.DISPATCH:
+            self._dispatcher = SerialDispatcher(self.DISPATCH_EXECUTOR, self._on_dispatch_error)
+
     def session_manager(self, session_manager: SessionManager = None) -> SessionManager:
         if session_manager is None:
             return self._session_manager
@@ -64,6 +106,78 @@ class Responser(object):
 
         self._session_manager = session_manager
 
+    def set_compression(self, protocol: Protocols, policy: CompressionPolicy = None) -> None:
+        """Compress the payloads of the protocol sent by this responser. It
+        overrides the COMPRESSION policy of the schemes, None removes it."""
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if policy is not None and not isinstance(policy, CompressionPolicy):
+            raise HTypeError("policy", policy, CompressionPolicy, None)
+
+        if policy is None:
+            self._compression.pop(protocol, None)
+        else:
+            self._compression[protocol] = policy
+
+    def get_compression(self, protocol: Protocols, role: Roles) -> CompressionPolicy:
+        if protocol in self._compression:
+            return self._compression[protocol]
+
+        try:
+            return self._session_manager.get_scheme(protocol, role).COMPRESSION
+        except ManagementScopeError:
+            return None
+
+    def requires_negotiation(self) -> bool:
+        if self._compression or self.HEADER_FORMAT != FORMAT_V1:
+            return True
+
+        for protocol in self._session_manager.get_protocols():
+            for role in self._session_manager.get_roles(protocol):
+                if self.get_compression(protocol, role) is not None:
+                    return True
+
+        return False
+
+    def negotiate(self, destination: str) -> None:
+        "Send the capabilities of this responser to the destination."
+        if not isinstance(destination, str):
+            raise HTypeError("destination", destination, str)
+
+        self._hello_sent.add(destination)
+        self.send_buffers(destination, [CSHello().to_bytes()])
+
+    def _switch_format(self, destination: str) -> None:
+        "Send the following packets with HEADER_FORMAT if the peer accepts it."
+        peer = self._peers.get(destination, None)
+        if peer is None or self.HEADER_FORMAT not in peer.formats:
+            return
+
+        with self._send_lock:
+            if self._send_formats.get(destination, FORMAT_V1) == self.HEADER_FORMAT:
+                return
+
+            self.send_buffers(destination, [CSFormat.to_bytes(self.HEADER_FORMAT)])
+            self._send_formats[destination] = self.HEADER_FORMAT
+
+    def _negotiated_compression(self, destination: str, packet: CSPacket) -> CompressionPolicy:
+        peer = self._peers.get(destination, None)
+        if peer is None:
+            return None
+
+        protocol = packet.protocol()
+        policy = self.get_compression(protocol, packet.role())
+        if policy is None or policy.codec not in peer.codecs:
+            return None
+
+        # The peer decompresses with its own dictionary, it must be the same.
+        if policy.dictionary is not None and \
+                peer.dictionaries.get(protocol.value, None) != policy.dictionary.identifier():
+            return None
+
+        return policy
+
     def get_scheme(self, protocol: Protocols, role: Roles = None):
         if not isinstance(protocol, Protocols):
             raise HTypeError("protocol", protocol, Protocols)
@@ -116,11 +230,44 @@ class Responser(object):
             raise HTypeError("response_packet", response_packet, CSPacket, None)
 
         if destination and response_packet:
-            self._node.send(destination, response_packet.to_bytes())
+            compression = self._negotiated_compression(destination, response_packet)
+            with self._send_lock:
+                version = self._send_formats.get(destination, FORMAT_V1)
+                self.send_buffers(destination, response_packet.to_buffers(compression, version))
+            return True
+
+        return False
+
+    def send_batch(self, destination: str, packets: List[CSPacket]) -> bool:
+        "Send many packets in one message (see CSBatch)."
+        if destination is not None and not isinstance(destination, str):
+            raise HTypeError("destination", destination, str, None)
+
+        if not isinstance(packets, list):
+            raise HTypeError("packets", packets, list)
+
+        if destination and packets:
+            compression = [self._negotiated_compression(destination, packet)
+                for packet in packets]
+            with self._send_lock:
+                version = self._send_formats.get(destination, FORMAT_V1)
+                self.send_buffers(destination, CSBatch.pack(packets, compression, version))
             return True
 
         return False
 
+    def send_buffers(self, destination: str, buffers: List[bytes]) -> None:
+        """Send the buffers of a packet as one message. The local node only
+        accepts a bytes object, so buffers are joined here with a single
+        copy. Override this method for a transport supporting gather-write."""
+        if not isinstance(destination, str):
+            raise HTypeError("destination", destination, str)
+
+        if not isinstance(buffers, list):
+            raise HTypeError("buffers", buffers, list)
+
+        self._node.send(destination, b"".join(buffers))
+
     def validate_packet(self, source: str, packet: CSPacket) -> bool:
         if not isinstance(source, str):
             raise HTypeError("source", source, str)
@@ -130,7 +277,8 @@ class Responser(object):
 
         protocol = packet[CSPacketField.PROTOCOL]
 
-        if protocol not in self._session_manager.get_protocols():
+        if protocol not in self._session_manager.get_protocols() \
+                and not self._session_manager.is_lazy(protocol):
             self._print(StdUsers.DEV, StdLevels.WARNING, "Unknown protocol "
             "({})".format(protocol.name))
             return False
@@ -153,6 +301,59 @@ class Responser(object):
 
         return self.send_response(des, response_packet)
 
+    def activate_session(self, protocol: Protocols, role: Roles = None, *args, **kwargs):
+        """Activate a new multiplexed session of the protocol and return it
+        (see SessionManager.activate_session), e.g. to wait for its result."""
+        if not isinstance(protocol, Protocols):
+            raise HTypeError("protocol", protocol, Protocols)
+
+        if role is not None and not isinstance(role, Roles):
+            raise HTypeError("role", role, Roles, None)
+
+        session, des, response_packet = self._session_manager.activate_session(
+                protocol,
+                role,
+                *args,
+                **kwargs
+            )
+
+        self.send_response(des, response_packet)
+        return session
+
+    def dispatch_key(self, source: str, packet: CSPacket) -> Hashable:
+        """The packets with the same key are solved in order. A key is a
+        session: (protocol, role) and the session id of multiplexed ones."""
+        return packet.protocol(), packet.role(), self._session_manager.get_session_id(packet)
+
+    def _dispatch(self, source: str, packet: CSPacket) -> None:
+        if self._dispatcher is None:
+            self._solve_packet(source, packet)
+            return
+
+        try:
+            key = self.dispatch_key(source, packet)
+        except Exception:
+            # A packet whose key cannot be read goes to the unmultiplexed
+            # session, which reports the packet if it cannot solve it.
+            key = packet.protocol(), packet.role(), 0
+
+        self._dispatcher.submit(key, self._solve_packet, source, packet)
+
+    def _on_dispatch_error(self, e: Exception) -> None:
+        self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+        "when dispatching data ({})".format(e))
+
+    def _solve_packet(self, source: str, packet: CSPacket) -> None:
+        try:
+            if self.validate_packet(source, packet) is False:
+                return
+
+            des, resp = self.get_response(source, packet)
+            self.send_response(des, resp)
+        except Exception as e:
+            self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+            "when solving data ({})".format(e))
+
     def _start(self) -> None:
         self._print(StdUsers.USER, StdLevels.INFO, "Responser started.")
         self._print(StdUsers.DEV, StdLevels.INFO, "Responser started")
@@ -169,33 +370,133 @@ class Responser(object):
                 "receving connection ({}).".format(repr(e)))
                 break
 
+            if is_control(data):
+                try:
+                    self._solve_control(source, data)
+                except Exception as e:
+                    self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+                    "when solving control message ({})".format(e))
+                continue
+
             try:
-                packet = CSPacket.from_bytes(data)
+                packet = CSPacket.from_buffer(
+                    data,
+                    copy=not self.ZERO_COPY,
+                    max_decompressed_size=self.MAX_DECOMPRESSED_SIZE,
+                    version=self._recv_formats.get(source, FORMAT_V1)
+                )
             except PacketExtractingError as e:
                 self._print(StdUsers.DEV, StdLevels.WARNING, "Error when data "
                 "extracting ({})".format(e))
                 continue
             except KeyError:
                 self._print(StdUsers.DEV, StdLevels.WARNING, "Unknown packet protocols.")
+                continue
             except Exception as e:
                 self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
                 "when data extracting ({})".format(e))
                 continue
 
+            try:
+                self._dispatch(source, packet)
+            except Exception as e:
+                self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+                "when dispatching data ({})".format(e))
+
+        self.close()
+        self._print(StdUsers.USER, StdLevels.INFO, "Responser stops")
+        self._print(StdUsers.DEV, StdLevels.INFO, "Responser stops")
+
+    def _solve_hello(self, source: str, data: bytes) -> None:
+        try:
+            self._peers[source] = CSHello.from_bytes(data)
+        except PacketExtractingError as e:
+            self._print(StdUsers.DEV, StdLevels.WARNING, "Error when hello "
+            "extracting ({})".format(e))
+            return
+
+        self._print(StdUsers.DEV, StdLevels.DEBUG, "Negotiated with {} "
+        "({})".format(source, self._peers[source]))
+
+        if source not in self._hello_sent:
+            try:
+                self.negotiate(source)
+            except Exception as e:
+                self._print(StdUsers.DEV, StdLevels.ERROR, "Error when replying "
+                "hello to {} ({})".format(source, e))
+                return
+
+        if self.HEADER_FORMAT != FORMAT_V1:
+            try:
+                self._switch_format(source)
+            except Exception as e:
+                self._print(StdUsers.DEV, StdLevels.ERROR, "Error when switching "
+                "the header format of {} ({})".format(source, e))
+
+    def _solve_control(self, source: str, data: bytes) -> None:
+        if CSHello.is_hello(data):
+            self._solve_hello(source, data)
+            return
+
+        if CSFormat.is_format(data):
+            try:
+                self._recv_formats[source] = CSFormat.from_bytes(data)
+            except PacketExtractingError as e:
+                self._print(StdUsers.DEV, StdLevels.WARNING, "Error when format "
+                "extracting ({})".format(e))
+            return
+
+        if not CSBatch.is_batch(data):
+            self._print(StdUsers.DEV, StdLevels.WARNING, "Unknown control message.")
+            return
+
+        try:
+            packets = CSBatch.unpack(
+                data,
+                copy=not self.ZERO_COPY,
+                max_decompressed_size=self.MAX_DECOMPRESSED_SIZE,
+                version=self._recv_formats.get(source, FORMAT_V1)
+            )
+        except PacketExtractingError as e:
+            self._print(StdUsers.DEV, StdLevels.WARNING, "Error when batch "
+            "extracting ({})".format(e))
+            return
+
+        # The workers send their responses one by one.
+        if self._dispatcher is not None:
+            for packet in packets:
+                try:
+                    self._dispatch(source, packet)
+                except Exception as e:
+                    self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+                    "when dispatching data ({})".format(e))
+            return
+
+        # The responses to a batch are sent back as one batch per destination.
+        responses: Dict[str, List[CSPacket]] = {}
+        for packet in packets:
             try:
                 if self.validate_packet(source, packet) is False:
                     continue
 
                 des, resp = self.get_response(source, packet)
-                self.send_response(des, resp)
             except Exception as e:
                 self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
                 "when solving data ({})".format(e))
                 continue
 
-        self.close()
-        self._print(StdUsers.USER, StdLevels.INFO, "Responser stops")
-        self._print(StdUsers.DEV, StdLevels.INFO, "Responser stops")
+            if des and resp:
+                responses.setdefault(des, []).append(resp)
+
+        for des, resps in responses.items():
+            try:
+                if len(resps) == 1:
+                    self.send_response(des, resps[0])
+                else:
+                    self.send_batch(des, resps)
+            except Exception as e:
+                self._print(StdUsers.DEV, StdLevels.ERROR, "Unknown error occurs "
+                "when sending data ({})".format(e))
 
     def start(self, thread = False) -> None:
         if thread:
@@ -0,0 +1,116 @@
+"""Run response methods in a process pool (see Pool.response(executor=...)
+and Scheme.EXECUTOR), so that CPU-bound responses use all cores.
+
+What crosses the process boundary:
+    + The response runs on a copy of the scheme, built in the worker from
+      the class of the scheme (its module is imported there, so it must be
+      importable by name) and the attributes in OFFLOADED_ATTRIBUTES.
+    + When the response returns, the same attributes are copied back onto
+      the scheme of the session; any other change made by the response is
+      lost. The session keeps its lock meanwhile, so no other response of
+      the session runs on the scheme.
+    + The packets cross as their bytes, uncompressed. The source, the other
+      arguments, the attributes and the result (a Done) must be picklable.
+"""
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from hks_pylib.done import Done
+
+from csbuilder.cspacket.cspacket import CSPacket
+from csbuilder.scheme.scheme import Scheme
+from csbuilder.scheme.result import SchemeResult
+
+from hkserror import HFormatError, HTypeError
+
+
+PROCESS = "process"
+
+# The values of the executor of a response, None runs it in the thread
+# solving the packet.
+EXECUTORS = (None, PROCESS)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_executor() -> Executor:
+    "The process pool shared by the offloaded responses, one worker per core."
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor()
+
+    return _executor
+
+
+def check_executor(executor: Optional[str]) -> None:
+    if executor not in EXECUTORS:
+        raise HFormatError("The parameter executor expected one of "
+        "{}, but got {}.".format(list(EXECUTORS), executor))
+
+
+class OffloadedResponse(object):
+    "A response method of a scheme, called in the process pool."
+
+    __slots__ = ("_scheme", "_function")
+
+    def __init__(self, scheme: Scheme, function: Callable) -> None:
+        if not isinstance(scheme, Scheme):
+            raise HTypeError("scheme", scheme, Scheme)
+
+        if not isinstance(type(scheme).OFFLOADED_ATTRIBUTES, tuple):
+            raise HTypeError("OFFLOADED_ATTRIBUTES", type(scheme).OFFLOADED_ATTRIBUTES, tuple)
+
+        self._scheme = scheme
+        self._function = function
+
+    def __call__(self, source: str, packet: CSPacket, *args, **kwargs) -> SchemeResult:
+        scheme = self._scheme
+        attributes = {name: getattr(scheme, name)
+            for name in type(scheme).OFFLOADED_ATTRIBUTES}
+
+        future = process_executor().submit(
+            _run,
+            type(scheme),
+            self._function.__name__,
+            attributes,
+            source,
+            packet.to_bytes(),
+            args,
+            kwargs
+        )
+        attributes, (destination, data, is_continue, result) = future.result()
+
+        for name, value in attributes.items():
+            setattr(scheme, name, value)
+
+        packet = CSPacket.from_bytes(data) if data is not None else None
+        return SchemeResult(destination, packet, is_continue, result)
+
+
+def _run(
+            cls: type,
+            name: str,
+            attributes: Dict[str, Any],
+            source: str,
+            data: bytes,
+            args: tuple,
+            kwargs: dict
+        ) -> Tuple[Dict[str, Any], Tuple[str, bytes, bool, Done]]:
+    "Call the response method in a worker process."
+    scheme = cls.__new__(cls)
+    Scheme.__init__(scheme)
+    for attribute, value in attributes.items():
+        setattr(scheme, attribute, value)
+
+    result: SchemeResult = getattr(cls, name)(scheme, source, CSPacket.from_bytes(data), *args, **kwargs)
+    if not isinstance(result, SchemeResult):
+        raise HTypeError("result", result, SchemeResult)
+
+    attributes = {attribute: getattr(scheme, attribute) for attribute in attributes}
+    data = result.packet.to_bytes() if result.packet is not None else None
+    return attributes, (result.destination, data, result.is_continue, result.result)
@@ -5,6 +5,8 @@ from csbuilder.cspacket.cspacket import CSPacket
 
 
 class SchemeResult(object):
+    __slots__ = ("destination", "packet", "is_continue", "result")
+
     def __init__(
                 self,
                 destination: str,
@@ -4,18 +4,33 @@ from hks_pylib.done import Done
 
 from csbuilder.standard import States
 from csbuilder.scheme.result import SchemeResult
-from csbuilder.cspacket.cspacket import CSPacket
+from csbuilder.cspacket.cspacket import CSPacket, FIELD_TYPES
 
 from hkserror.hkserror import HFormatError, HTypeError
 from csbuilder.errors import ManagementScopeError
 
 
 class Scheme(object):
+    # The CompressionPolicy of the payloads sent by this scheme.
+    COMPRESSION = None
+
+    # "process" runs all responses of the scheme in the process pool, and
+    # the attributes copied to and from the worker with the scheme (see
+    # csbuilder.scheme.offload).
+    EXECUTOR = None
+    OFFLOADED_ATTRIBUTES = ()
+
+    # If True, many sessions of the scheme can run at once, told apart by
+    # the session_id field of the option (see SessionManager.activate_session).
+    # The option of the packets of other schemes stays opaque.
+    MULTIPLEXED = False
+
     def __init__(self) -> None:
         from csbuilder.pool import Pool
 
         self._protocol, self._role = Pool.revert_scheme(type(self))
         self._states = Pool.get_states(self._protocol, self._role)
+        self._headers = Pool.get_headers(self._protocol, self._role)
 
         self._is_running = False
 
@@ -38,17 +53,26 @@ class Scheme(object):
         if not isinstance(state, States):
             raise HTypeError("state", state, States)
         
-        if state not in self._states:
+        header = self._headers.get(state, None)
+        if header is None:
             raise ManagementScopeError("The state {} doesn't belong "
             "to {}".format(state, self._states))
 
-        return CSPacket(
-                protocol=self._protocol,
-                role=self._role,
-                state=state,
-                option=option,
-                payload=payload
-            )
+        if not isinstance(option, FIELD_TYPES):
+            raise HTypeError("option", option, *FIELD_TYPES)
+
+        if not isinstance(payload, FIELD_TYPES):
+            raise HTypeError("payload", payload, *FIELD_TYPES)
+
+        # Like the setters of CSPacket, never keep a bytearray of the caller.
+        if isinstance(option, bytearray):
+            option = bytes(option)
+
+        if isinstance(payload, bytearray):
+            payload = bytes(payload)
+
+        # The state has just been checked to belong to the scheme.
+        return CSPacket._trusted(self._protocol, self._role, state, option, payload, header)
 
     def ignore(self, source: str, reason: str = "Invalid packet") -> SchemeResult:
         if not isinstance(reason, str):
@@ -56,6 +56,12 @@ class ServerResponser(Responser):
                 name="Thread forwarder of {}".format(self._name)
             ).start()
 
+    def _start(self) -> None:
+        if self.requires_negotiation():
+            self.negotiate(self._forwarder.name)
+
+        super()._start()
+
     def close(self) -> None:
         self._socket.close()
         self._forwarder.close()
@@ -1,22 +1,35 @@
-from typing import Any, Callable, Dict, List, Tuple
+import itertools
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Tuple, Type
+from concurrent.futures import FIRST_COMPLETED, ALL_COMPLETED, Future, wait
+
+from hks_pylib.done import Done
 
 from hks_pylib.logger import LoggerGenerator
 from hks_pylib.logger import InvisibleLoggerGenerator
 from hks_pylib.logger.standard import StdLevels, StdUsers
 
+from csbuilder.pool import Pool
 from csbuilder.cspacket import CSPacket
-from csbuilder.pool.pool import Pool
 from csbuilder.scheme.scheme import Scheme
 from csbuilder.session.result import SessionResult
-from csbuilder.standard import Protocols, Roles
+from csbuilder.standard import Protocols, Roles, States
 
 from csbuilder.session.session import Session, HookArgument
 
 from hkserror.hkserror import HFormatError, HTypeError
 from csbuilder.errors import ManagementScopeError
+from csbuilder.errors.packet import PacketExtractingError
+from csbuilder.errors.scheme import SchemeError
+from csbuilder.errors.session import InProcessError
 
 
 class SessionManager(object):
+    # The maximum number of multiplexed sessions running at once, the
+    # sessions started by a peer over it are ignored.
+    MAX_SESSIONS = 1024
+
     def __init__(
                 self,
                 name: str = None,
@@ -35,6 +48,23 @@ class SessionManager(object):
 
         self.__sessions: Dict[Protocols, Dict[Roles, Session]] = {}
 
+        # The frozen map from the state of a received packet to the session
+        # and its response method (see compile()), None until it is built.
+        self.__dispatch: Mapping[States, Tuple[Session, Callable]] = None
+
+        # The running multiplexed sessions by (protocol, role, session id),
+        # clones of the session of (protocol, role), removed when canceled.
+        # The lowest bit of an id is the role starting the session (see
+        # __initiator_bit()), so the ids allocated by both peers never meet.
+        self.__multiplexed: Dict[Tuple[Protocols, Roles, int], Session] = {}
+        self.__multiplexed_lock = threading.Lock()
+        self.__session_ids = itertools.count(1)
+
+        # The sessions of lazy protocols by protocol value, as (role value,
+        # factory, timeout), created by the first packet of their protocol.
+        self.__lazy: Dict[int, List[Tuple[int, Callable, float]]] = {}
+        self.__lazy_lock = threading.Lock()
+
         self._name = name
 
         self._logger_generator = logger_generator
@@ -171,11 +201,55 @@ class SessionManager(object):
             self.__sessions[protocol] = {}
 
         self.__sessions[protocol][role] = session
+        self.__dispatch = None
 
         self._print(StdUsers.DEV, StdLevels.DEBUG, "You added a "
         "{} session".format(session_name))
         return session
 
+    def create_lazy_session(
+                    self,
+                    protocol: int,
+                    role: int,
+                    factory: Callable[[Type[Scheme]], Scheme] = None,
+                    timeout: float = 10
+                ) -> None:
+        """Create the session of a lazy protocol (see Pool.load_manifest())
+        when its first packet is responded, after its modules are imported.
+        The protocol and the role are values, their enums do not exist yet.
+        The scheme is factory(the scheme class), or the scheme class called
+        without arguments."""
+        if not isinstance(protocol, int):
+            raise HTypeError("protocol", protocol, int)
+
+        if not isinstance(role, int):
+            raise HTypeError("role", role, int)
+
+        if factory is not None and not callable(factory):
+            raise HTypeError("factory", factory, Callable, None)
+
+        with self.__lazy_lock:
+            self.__lazy.setdefault(protocol, []).append((role, factory, timeout))
+
+    def is_lazy(self, protocol: Protocols) -> bool:
+        "Return True if a session of the protocol is created by its first packet."
+        return protocol.value in self.__lazy
+
+    def __create_lazy_sessions(self, protocol: Protocols) -> None:
+        with self.__lazy_lock:
+            for role_value, factory, timeout in self.__lazy.pop(protocol.value, []):
+                role = Pool.int2role(protocol.value, role_value)
+                if role is None:
+                    raise ManagementScopeError("The role {} of the lazy protocol {} "
+                    "doesn't exist.".format(role_value, protocol))
+
+                cls = Pool.get_scheme(protocol, role)
+                if cls is None:
+                    raise ManagementScopeError("The scheme of {}.{} is not "
+                    "defined by the modules of the protocol.".format(protocol.name, role.name))
+
+                self.create_session(factory(cls) if factory else cls(), timeout)
+
     def add_timeout_hook(self, hook_fn, *args, **kwargs) -> None:
         if hook_fn is None or not callable(hook_fn):
             raise HTypeError("hook_fn", hook_fn, Callable)
@@ -230,6 +304,88 @@ class SessionManager(object):
         session = self.get_session(protocol, role)
         return session.activate(*args, **kwargs)
 
+    def activate_session(self,
+                protocol: Protocols,
+                role: Roles = None,
+                *args,
+                **kwargs
+            ) -> Tuple[Session, str, CSPacket]:
+        """Activate a new multiplexed session of (protocol, role), a clone of
+        its session with a new session id, so that many sessions of the
+        protocol can run at once. The packets of the session carry its id.
+        Wait for its result with the returned session. The scheme must be
+        MULTIPLEXED."""
+        template = self.get_session(protocol, role)
+        if not type(template.scheme()).MULTIPLEXED:
+            raise SchemeError("The scheme {} is not "
+            "multiplexed.".format(type(template.scheme()).__name__))
+
+        session_id = next(self.__session_ids) << 1 | self.__initiator_bit(template.protocol(), template.role())
+        session = self.__add_multiplexed(template, session_id)
+        if session is None:
+            raise InProcessError("There are already {} multiplexed sessions "
+            "in {}.".format(self.MAX_SESSIONS, self._name))
+
+        try:
+            destination, packet = session.activate(*args, **kwargs)
+        except Exception:
+            self.__release((template.protocol(), template.role(), session.session_id()))
+            raise
+
+        return session, destination, packet
+
+    def get_session_id(self, packet: CSPacket) -> int:
+        """Return the session id of a packet of a MULTIPLEXED scheme, or 0 if
+        the scheme is not multiplexed or the option cannot be read."""
+        if not isinstance(packet, CSPacket):
+            raise HTypeError("packet", packet, CSPacket)
+
+        dispatch = self.__dispatch
+        if dispatch is None:
+            dispatch = self.compile()
+
+        entry = dispatch.get(packet.state(), None)
+        if entry is None:
+            return 0
+
+        return self.__session_id(entry[0], packet)
+
+    def __session_id(self, session: Session, packet: CSPacket) -> int:
+        if not type(session.scheme()).MULTIPLEXED or not packet.option():
+            return 0
+
+        try:
+            return packet.opt.get("session_id", 0)
+        except PacketExtractingError:
+            # The packet is solved by the session of (protocol, role).
+            return 0
+
+    def get_multiplexed_session(self, protocol: Protocols, role: Roles, session_id: int) -> Session:
+        "Return the running multiplexed session, or None."
+        return self.__multiplexed.get((protocol, role, session_id), None)
+
+    @staticmethod
+    def __initiator_bit(protocol: Protocols, role: Roles) -> int:
+        "The lowest bit of the ids of the sessions started by the role."
+        return int(role.value > Pool.get_opposite_role(protocol, role).value)
+
+    def __add_multiplexed(self, template: Session, session_id: int) -> Session:
+        key = (template.protocol(), template.role(), session_id)
+        with self.__multiplexed_lock:
+            if len(self.__multiplexed) >= self.MAX_SESSIONS or key in self.__multiplexed:
+                return None
+
+            session = template.clone()
+            session.session_id(session_id)
+            session.add_cancle_hook(self.__release, key)
+            self.__multiplexed[key] = session
+
+        return session
+
+    def __release(self, key: Tuple[Protocols, Roles, int], protocol: Protocols = None) -> None:
+        with self.__multiplexed_lock:
+            self.__multiplexed.pop(key, None)
+
     def respond(self,
             source: str,
             packet: CSPacket,
@@ -242,14 +398,70 @@ class SessionManager(object):
         if not isinstance(packet, CSPacket):
             raise HTypeError("packet", packet, CSPacket)
 
-        protocol = packet.protocol()
-        role = packet.role()
+        dispatch = self.__dispatch
+        if dispatch is None:
+            dispatch = self.compile()
+
+        entry = dispatch.get(packet.state(), None)
+        if entry is None and self.is_lazy(packet.protocol()):
+            self.__create_lazy_sessions(packet.protocol())
+            entry = (self.__dispatch or self.compile()).get(packet.state(), None)
 
-        opposite_role = Pool.get_opposite_role(protocol, role)
+        if entry is None:
+            raise ManagementScopeError("The packet {} doesn't belong to the "
+            "management of {}".format(packet, self._name))
 
-        session = self.get_session(protocol, opposite_role)
+        session, response_fn = entry
+        session_id = self.__session_id(session, packet)
+        if session_id:
+            return self.__respond_multiplexed(session, session_id, source, packet, *args, **kwargs)
+
+        return session._respond(response_fn, source, packet, *args, **kwargs)
+
+    def __respond_multiplexed(self,
+            template: Session,
+            session_id: int,
+            source: str,
+            packet: CSPacket,
+            *args,
+            **kwargs
+        ) -> SessionResult:
+        "Respond a packet of a multiplexed session, which a peer may start."
+        key = (template.protocol(), template.role(), session_id)
+        session = self.__multiplexed.get(key, None)
+
+        # The peer starts a session with the id of its role.
+        if session is None and packet.state() == template._passive_activation \
+                and session_id & 1 == self.__initiator_bit(packet.protocol(), packet.role()):
+            session = self.__add_multiplexed(template, session_id)
+
+        if session is None:
+            ignore_packet = template.scheme().generate_packet(template.scheme()._states.IGNORE)
+            ignore_packet.opt.set("session_id", session_id)
+            return SessionResult(source, ignore_packet)
+
+        try:
+            return session._respond(session._response_methods[packet.state()],
+                source, packet, *args, **kwargs)
+        finally:
+            # A session which did not begin is never canceled.
+            if not session._is_running:
+                self.__release(key)
+
+    def compile(self) -> Mapping[States, Tuple[Session, Callable]]:
+        """Flatten the sessions into a frozen map from the state of a received
+        packet to (session, response method), so that respond() costs one
+        lookup. It is built on the first respond() and rebuilt after the
+        sessions change. A state identifies its (protocol, role, state) in
+        Pool, so it is the same key as the header of the packet."""
+        dispatch = {}
+        for protocol in self.__sessions.keys():
+            for session in self.__sessions[protocol].values():
+                for state, response_fn in session._response_methods.items():
+                    dispatch[state] = (session, response_fn)
 
-        return session.respond(source, packet, *args, **kwargs)
+        self.__dispatch = MappingProxyType(dispatch)
+        return self.__dispatch
 
     def wait_result(self, protocol: Protocols, role: Roles = None, timeout: float = None):
         if timeout is not None and not isinstance(timeout, (int, float)):
@@ -259,6 +471,53 @@ class SessionManager(object):
 
         return session.wait_result(timeout)
 
+    def wait_any(
+                self,
+                sessions: List[Tuple[Protocols, Roles]] = None,
+                timeout: float = None
+            ) -> Dict[Tuple[Protocols, Roles], Done]:
+        """Wait until one of the sessions (all sessions by default) has a
+        result. Return the results by (protocol, role); there may be more
+        than one, and none if the timeout expires."""
+        return self.__wait(sessions, timeout, FIRST_COMPLETED)
+
+    def wait_all(
+                self,
+                sessions: List[Tuple[Protocols, Roles]] = None,
+                timeout: float = None
+            ) -> Dict[Tuple[Protocols, Roles], Done]:
+        """Wait until all sessions (all sessions by default) have a result.
+        Return the results by (protocol, role), without the sessions which
+        have no result when the timeout expires."""
+        return self.__wait(sessions, timeout, ALL_COMPLETED)
+
+    def __wait(
+                self,
+                sessions: List[Tuple[Protocols, Roles]],
+                timeout: float,
+                return_when: str
+            ) -> Dict[Tuple[Protocols, Roles], Done]:
+        if sessions is not None and not isinstance(sessions, list):
+            raise HTypeError("sessions", sessions, list, None)
+
+        if timeout is not None and not isinstance(timeout, (int, float)):
+            raise HTypeError("timeout", timeout, int, float, None)
+
+        if sessions is None:
+            sessions = [(protocol, role)
+                for protocol in self.get_protocols() for role in self.get_roles(protocol)]
+
+        futures: Dict[Future, Tuple[Protocols, Roles]] = {}
+        for protocol, role in sessions:
+            session = self.get_session(protocol, role)
+            futures[session.result_future()] = (session.protocol(), session.role())
+
+        wait(futures.keys(), timeout, return_when)
+
+        # The futures which cannot be canceled have a result, even if it
+        # came after the wait.
+        return {key: future.result() for future, key in futures.items() if not future.cancel()}
+
     def clone(self):
         new_session_manager = SessionManager(
                 name="{} (clone {})".format(self._name, self.__index_of_clone),
@@ -269,6 +528,8 @@ class SessionManager(object):
         new_session_manager._activate_hook = self._activate_hook.copy()
         new_session_manager._timeout_hook = self._timeout_hook.copy()
         new_session_manager._cancle_hook = self._cancle_hook.copy()
+        new_session_manager.__lazy = {protocol: list(sessions)
+            for protocol, sessions in self.__lazy.items()}
 
         for protocol in self.__sessions.keys():
             new_session_manager.__sessions[protocol] = {}
@@ -287,6 +548,10 @@ class SessionManager(object):
         self._timeout_hook.update(another._timeout_hook)
         self._cancle_hook.update(another._cancle_hook)
 
+        with self.__lazy_lock:
+            for protocol, sessions in another.__lazy.items():
+                self.__lazy.setdefault(protocol, []).extend(sessions)
+
         for protocol in another.get_protocols():
             if protocol not in self.get_protocols():
                 self.__sessions[protocol] = {}
@@ -294,3 +559,5 @@ class SessionManager(object):
             for role in another.get_roles(protocol):
                 self.__sessions[protocol][role] =\
                     another.__sessions[protocol][role].clone()
+
+        self.__dispatch = None
@@ -4,6 +4,8 @@ from csbuilder.cspacket import CSPacket
 
 
 class SessionResult(object):
+    __slots__ = ("destination", "packet")
+
     def __init__(self, destination: str, packet: CSPacket) -> None:
         if destination is not None and not isinstance(destination, str):
             raise HTypeError("des", destination, str, None)
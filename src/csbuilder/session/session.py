@@ -1,7 +1,8 @@
-import time
 import copy
+import asyncio
 import threading
-from typing import Any, Callable, Dict, Tuple
+from typing import Any, Callable, Dict, List, Tuple
+from concurrent.futures import Future, TimeoutError
 
 from hks_pylib.done import Done
 from hks_pylib.hksenum import HKSEnum
@@ -9,14 +10,14 @@ from hks_pylib.logger import LoggerGenerator
 from hks_pylib.logger import InvisibleLoggerGenerator
 from hks_pylib.logger.standard import StdLevels, StdUsers
 
-from csbuilder.util import func2method
-
 from csbuilder.pool import Pool
 from csbuilder.scheme import Scheme
 from csbuilder.scheme import SchemeResult
+from csbuilder.scheme.offload import OffloadedResponse, check_executor
 
 from csbuilder.cspacket import CSPacket
 from csbuilder.session.result import SessionResult
+from csbuilder.session.timer import TimerScheduler
 from csbuilder.standard import Protocols, States
 
 
@@ -41,8 +42,6 @@ def run_hook(protocol: Protocols, hook_dict: Dict[Any, Dict[HookArgument, Any]])
 
 
 class Session(object):
-    TIME_PERIODIC = 0.1
-
     def __init__(
                     self,
                     scheme: Scheme,
@@ -76,43 +75,47 @@ class Session(object):
             raise PredefinitionError("At least one activation must be defined "
             "in the scheme before creating a session.")
 
+        # The functions are validated as methods of the scheme class when
+        # the scheme is registered, so they are only bound here.
         if self._active_activation:
-            self._active_activation = func2method(self._active_activation, self._scheme)
-
-            if self._active_activation is None:
-                raise PredefinitionError("The active_activation must be a method "
-                "of {}".format(type(scheme).__name__))
+            self._active_activation = self._active_activation.__get__(self._scheme)
 
         self._ignore_packet = scheme.generate_packet(scheme._states.IGNORE)
 
+        check_executor(type(scheme).EXECUTOR)
         self._response_methods: Dict[States, Any] = {}
-
-        opposite_role = Pool.get_opposite_role(self._protocol, self._role)
-        for state in Pool.get_states(self._protocol, opposite_role):
-            resp_func = Pool.get_response(state)
-            resp_method = func2method(resp_func, self._scheme)
-
-            if resp_method is None:
-                raise PredefinitionError("The predefined response must be a method of "
-                "{}".format(type(scheme).__name__))
-
-            self._response_methods.update({state: resp_method})
+        for state, resp_func in Pool.get_responses(self._protocol, self._role).items():
+            if (Pool.get_executor(state) or type(scheme).EXECUTOR) is None:
+                self._response_methods[state] = resp_func.__get__(self._scheme)
+            else:
+                self._response_methods[state] = OffloadedResponse(self._scheme, resp_func)
 
         self._timeout_hook: Dict[Any, Dict[HookArgument, object]] = {}
         self._begin_hook: Dict[Any, Dict[HookArgument, object]] = {}
         self._cancel_hook: Dict[Any, Dict[HookArgument, object]] = {}
 
+        # The waiters of the next result (see result_future()).
         self._result = None
         self._result_lock = threading.Lock()
+        self._result_waiters: List[Future] = []
 
         self._name = name
 
         self._timeout = timeout
-        self._timeout_lock = threading.Lock()
+        self._timer = None
+        self._cancel_lock = threading.Lock()
         self._cancel_the_timeout = False
 
         self._is_running = False
 
+        # Serializes the responses, the activation and the timeout of the
+        # session, which may run on different threads.
+        self._respond_lock = threading.RLock()
+
+        # Not 0 if the session is one of the multiplexed sessions of its
+        # protocol, the packets sent by it then carry the session id.
+        self._session_id = 0
+
         self._logger_generator = logger_generator
         self._display = display
         self._print = logger_generator.generate(
@@ -129,9 +132,32 @@ class Session(object):
         if not isinstance(value, Done):
             raise HTypeError("value", value, Done)
 
-        self._result_lock.acquire()
-        self._result = value
-        self._result_lock.release()
+        with self._result_lock:
+            self._result = value
+            if value != None:
+                self._deliver_result()
+
+    def _deliver_result(self) -> None:
+        "Give the result to the first waiter, the lock must be held."
+        while self._result_waiters:
+            future = self._result_waiters.pop(0)
+            if future.set_running_or_notify_cancel():
+                future.set_result(self._result)
+                self._result = Done(None, where="wait_result")
+                return
+
+    def result_future(self) -> Future:
+        """Return a future of the next result of the session (a Done whose
+        value is not None). The result is given to one waiter only; cancel
+        the future to stop waiting."""
+        future = Future()
+        with self._result_lock:
+            self._result_waiters = [waiter for waiter in self._result_waiters if not waiter.cancelled()]
+            self._result_waiters.append(future)
+            if self._result != None:
+                self._deliver_result()
+
+        return future
 
     def wait_result(self, timeout: float = None):
         if timeout is not None and not isinstance(timeout, (int, float)):
@@ -140,17 +166,40 @@ class Session(object):
         if timeout is not None and timeout <= 0:
             raise HFormatError("The parameter timeout expected an positive number.")
 
-        while timeout is None or timeout > 0:
-            if self._result != None:
-                result = self._result
-                self._set_result(Done(None, where="wait_result"))
-                return result
+        future = self.result_future()
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # The result may come between the timeout and the cancellation.
+            return None if future.cancel() else future.result()
+
+    async def wait_result_async(self, timeout: float = None):
+        "The same as wait_result(), for asyncio callers."
+        if timeout is not None and not isinstance(timeout, (int, float)):
+            raise HTypeError("timeout", timeout, float, int, None)
+
+        if timeout is not None and timeout <= 0:
+            raise HFormatError("The parameter timeout expected an positive number.")
+
+        future = self.result_future()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            return None if future.cancel() else future.result()
 
-            time.sleep(self.TIME_PERIODIC)
-            if timeout is not None:
-                timeout -= self.TIME_PERIODIC
+    def session_id(self, session_id: int = None) -> int:
+        if session_id is None:
+            return self._session_id
 
-        return None
+        if not isinstance(session_id, int):
+            raise HTypeError("session_id", session_id, int, None)
+
+        if session_id <= 0 or session_id > 0xFFFFFFFF:
+            raise HFormatError("The parameter session_id expected to be "
+            "between 1 and 4294967295.")
+
+        self._session_id = session_id
+        self._ignore_packet.opt.set("session_id", session_id)
 
     def protocol(self):
         return self._protocol
@@ -175,9 +224,16 @@ class Session(object):
                         display=self._display
                     )
 
-        new_session._timeout_hook = self._timeout_hook.copy()
-        new_session._begin_hook = self._begin_hook.copy()
-        new_session._cancel_hook = self._cancel_hook.copy()
+        # The hooks bound to this session or its scheme were added again to
+        # the new session by its constructor, they are not copied.
+        for hooks, new_hooks in (
+                    (self._timeout_hook, new_session._timeout_hook),
+                    (self._begin_hook, new_session._begin_hook),
+                    (self._cancel_hook, new_session._cancel_hook)
+                ):
+            for hook_fn, arguments in hooks.items():
+                if getattr(hook_fn, "__self__", None) not in (self, self._scheme):
+                    new_hooks.setdefault(hook_fn, arguments)
 
         return new_session
 
@@ -215,17 +271,21 @@ class Session(object):
             })
 
     def activate(self, *args, **kwargs) -> Tuple[str, CSPacket]:
-        if self._is_running:
-            raise InProcessError("The session is running, cannot call again.")
+        with self._respond_lock:
+            if self._is_running:
+                raise InProcessError("The session is running, cannot call again.")
 
-        des, packet = self._active_activation(*args, **kwargs)
-        if packet is not None:
-            self._print(StdUsers.DEV, StdLevels.DEBUG, "Calling activate() session")
-            self.begin()
-        else:
-            raise CSError("The packet is None, it can not begin the session.")
+            des, packet = self._active_activation(*args, **kwargs)
+            if packet is not None:
+                self._print(StdUsers.DEV, StdLevels.DEBUG, "Calling activate() session")
+                self.begin()
+            else:
+                raise CSError("The packet is None, it can not begin the session.")
+
+            if self._session_id:
+                packet.opt.set("session_id", self._session_id)
 
-        return des, packet
+            return des, packet
 
     def respond(self,
             source: str,
@@ -244,31 +304,46 @@ class Session(object):
             raise PredefinitionError("Please assign a method "
             "to respond this state ({})").format(state)
 
-        if state == self._passive_activation:
-            if not self._is_running:
-                self.begin()
+        return self._respond(self._response_methods[state], source, packet, *args, **kwargs)
 
-        if self._is_running:
-            self._set_time_counter(self._timeout)  # reset the counter
-        else:
-            return SessionResult(source, self._ignore_packet)
+    def _respond(self,
+            response_fn: Callable,
+            source: str,
+            packet: CSPacket,
+            *args,
+            **kwargs
+        ) -> SessionResult:
+        """Respond a packet by response_fn, which is the response method of
+        its state (already looked up by the caller)."""
+        with self._respond_lock:
+            state = packet.state()
+            if state == self._passive_activation:
+                if not self._is_running:
+                    self.begin()
 
-        self._print(StdUsers.DEV, StdLevels.DEBUG, "Solving [{}]".format(state.name))
-        response_fn = self._response_methods[state]
-        scheme_result: SchemeResult = response_fn(source, packet, *args, **kwargs)
+            if self._is_running:
+                self._timer.reset(self._timeout)
+            else:
+                return SessionResult(source, self._ignore_packet)
 
-        if scheme_result.is_continue and scheme_result.result != None:
-            raise SchemeError("The result can be set to not-None "
-            "only when is_continue is False")
+            self._print(StdUsers.DEV, StdLevels.DEBUG, "Solving [{}]".format(state.name))
+            scheme_result: SchemeResult = response_fn(source, packet, *args, **kwargs)
 
-        self._set_result(scheme_result.result)
+            if scheme_result.is_continue and scheme_result.result != None:
+                raise SchemeError("The result can be set to not-None "
+                "only when is_continue is False")
 
-        if not scheme_result.is_continue:
-            self.cancel()
-            if scheme_result.result == None:
-                self._set_result(Done(False, reason = "Automatic result (canceled)"))
+            self._set_result(scheme_result.result)
 
-        return SessionResult(scheme_result.destination, scheme_result.packet)
+            if not scheme_result.is_continue:
+                self.cancel()
+                if scheme_result.result == None:
+                    self._set_result(Done(False, reason = "Automatic result (canceled)"))
+
+            if self._session_id and scheme_result.packet is not None:
+                scheme_result.packet.opt.set("session_id", self._session_id)
+
+            return SessionResult(scheme_result.destination, scheme_result.packet)
 
     def begin(self) -> None:
         if self._is_running:
@@ -280,45 +355,31 @@ class Session(object):
         self._cancel_the_timeout = False
         run_hook(self._protocol, self._begin_hook)
 
-        counter_thread = threading.Thread(
-                target=self._time_counter,
-                name="Timecounter [{}]".format(self._name)
-            )
-        counter_thread.start()
+        # The timeout is watched by the scheduler shared by all sessions.
+        self._timer = TimerScheduler.default().schedule(self._timeout, self._on_timeout)
 
     def cancel(self) -> None:
-        if self._cancel_the_timeout is True:
-            return
+        with self._cancel_lock:
+            if self._cancel_the_timeout is True:
+                return
+
+            self._cancel_the_timeout = True
+
+        if self._timer is not None:
+            self._timer.cancel()
 
-        self._set_time_counter(None)   # cancel the counter
         self._print(StdUsers.DEV, StdLevels.DEBUG, "Session is canceled")
 
         self._is_running = False
         run_hook(self._protocol, self._cancel_hook)
 
-    def _time_counter(self) -> None:
-        self._current_time_counter = self._timeout
+    def _on_timeout(self) -> None:
+        "Called by a worker of the timer scheduler when the timer expires."
+        with self._respond_lock:
+            if self._cancel_the_timeout:
+                return
 
-        while self._current_time_counter > 0 and not self._cancel_the_timeout:
-            time.sleep(self.TIME_PERIODIC)
-            self._set_time_counter(self._current_time_counter - self.TIME_PERIODIC)
-        
-        if self._current_time_counter <= 0 and not self._cancel_the_timeout:
             self._print(StdUsers.DEV, StdLevels.DEBUG, "Exceed timeout")
-
             run_hook(self._protocol, self._timeout_hook)
 
-        self.cancel()
-
-    def _set_time_counter(self, value: float = None) -> None:
-        if value is not None and not isinstance(value, (float, int)):
-            raise HTypeError("value", value, float, int, None)
-
-        self._timeout_lock.acquire()
-
-        if value == None:
-            self._cancel_the_timeout = True
-        else:
-            self._current_time_counter = value
-
-        self._timeout_lock.release()
+            self.cancel()
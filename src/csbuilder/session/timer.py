@@ -0,0 +1,146 @@
+import heapq
+import itertools
+import threading
+from time import monotonic
+from typing import Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from hkserror import HFormatError, HTypeError
+
+
+class Timer(object):
+    """A timeout of TimerScheduler. Resetting it only changes its deadline,
+    the scheduler moves it in the heap when the old deadline comes."""
+
+    __slots__ = ("_scheduler", "_callback", "_deadline", "_queued", "_done")
+
+    def __init__(self, scheduler: "TimerScheduler", callback: Callable, deadline: float) -> None:
+        self._scheduler = scheduler
+        self._callback = callback
+        self._deadline = deadline
+
+        # The earliest deadline of this timer in the heap of the scheduler.
+        self._queued = deadline
+
+        # The timer was fired or canceled.
+        self._done = False
+
+    def deadline(self) -> float:
+        "The monotonic time of the timeout."
+        return self._deadline
+
+    def reset(self, delay: float) -> bool:
+        """Move the deadline to delay seconds from now. Return False if the
+        timer has already been fired or canceled."""
+        return self._scheduler._reset(self, delay)
+
+    def cancel(self) -> None:
+        self._scheduler._cancel(self)
+
+    def is_active(self) -> bool:
+        return not self._done
+
+
+class TimerScheduler(object):
+    """A heap of monotonic deadlines watched by one thread. The callbacks of
+    expired timers are run by a small pool of workers, so that a slow
+    callback does not delay the other timeouts.
+
+    Resetting a timer to a later deadline is O(1): the heap entry is left
+    in place and moved to the new deadline when it is popped."""
+
+    MAX_WORKERS = 4
+
+    __default = None
+    __default_lock = threading.Lock()
+
+    def __init__(self, max_workers: int = MAX_WORKERS) -> None:
+        if not isinstance(max_workers, int):
+            raise HTypeError("max_workers", max_workers, int)
+
+        if max_workers <= 0:
+            raise HFormatError("The parameter max_workers expected an positive integer.")
+
+        self._max_workers = max_workers
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+        # Both are started by the first timer.
+        self._thread = None
+        self._executor = None
+
+    @staticmethod
+    def default() -> "TimerScheduler":
+        "The scheduler shared by the sessions of the process."
+        if TimerScheduler.__default is None:
+            with TimerScheduler.__default_lock:
+                if TimerScheduler.__default is None:
+                    TimerScheduler.__default = TimerScheduler()
+
+        return TimerScheduler.__default
+
+    def schedule(self, delay: float, callback: Callable) -> Timer:
+        "Call callback() in delay seconds, unless the timer is canceled."
+        if not isinstance(delay, (int, float)):
+            raise HTypeError("delay", delay, float, int)
+
+        if not callable(callback):
+            raise HTypeError("callback", callback, Callable)
+
+        with self._condition:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(self._max_workers, "Timeout")
+                self._thread = threading.Thread(target=self._run, name="TimerScheduler", daemon=True)
+                self._thread.start()
+
+            timer = Timer(self, callback, monotonic() + delay)
+            self._push(timer, timer._deadline)
+            return timer
+
+    def _push(self, timer: Timer, deadline: float) -> None:
+        timer._queued = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), timer))
+
+        # Wake the thread only if its next wakeup is too late.
+        if self._heap[0][2] is timer:
+            self._condition.notify()
+
+    def _reset(self, timer: Timer, delay: float) -> bool:
+        with self._condition:
+            if timer._done:
+                return False
+
+            timer._deadline = monotonic() + delay
+            if timer._deadline < timer._queued:
+                self._push(timer, timer._deadline)
+
+            return True
+
+    def _cancel(self, timer: Timer) -> None:
+        with self._condition:
+            timer._done = True
+
+    def _run(self) -> None:
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                deadline, _, timer = self._heap[0]
+                now = monotonic()
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                if timer._done or deadline != timer._queued:
+                    continue  # a canceled timer or an outdated entry
+
+                if timer._deadline > now:
+                    self._push(timer, timer._deadline)
+                    continue
+
+                timer._done = True
+                self._executor.submit(timer._callback)
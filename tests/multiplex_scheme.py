@@ -0,0 +1,94 @@
+import csbuilder
+
+from hks_pylib.done import Done
+
+from csbuilder.scheme import Scheme
+from csbuilder.scheme import SchemeResult
+
+from csbuilder.standard import Protocols, Roles, States
+from csbuilder.cspacket import CSPacket
+
+
+@csbuilder.protocols
+class MultiplexProtocols(Protocols):
+    PING = 5
+
+
+@csbuilder.roles(MultiplexProtocols.PING)
+class PingRoles(Roles):
+    SERVER = 0
+    CLIENT = 1
+
+
+@csbuilder.states(MultiplexProtocols.PING, PingRoles.CLIENT)
+class PingClientStates(States):
+    IGNORE = 0
+    PING = 1
+    PONG = 2
+
+
+@csbuilder.states(MultiplexProtocols.PING, PingRoles.SERVER)
+class PingServerStates(States):
+    IGNORE = 0
+    PING = 1
+    PONG = 2
+
+
+class PingScheme(Scheme):
+    "Either side pings, the other side pongs the payload back."
+    MULTIPLEXED = True
+
+    def __init__(self, destination: str = None) -> None:
+        super().__init__()
+        self._destination = destination
+
+    def _ping(self, payload: bytes = b""):
+        return self._destination, self.generate_packet(self._states.PING, payload=payload)
+
+    def _resp_ping(self, source: str, packet: CSPacket):
+        packet = self.generate_packet(self._states.PONG, payload=packet.payload())
+        return SchemeResult(source, packet, False, Done(True, payload=packet.payload()))
+
+    def _resp_pong(self, source: str, packet: CSPacket):
+        return SchemeResult(None, None, False, Done(True, payload=packet.payload()))
+
+    def _resp_ignore(self, source: str, packet: CSPacket):
+        return SchemeResult(None, None, False, Done(False, reason="ignore"))
+
+
+@csbuilder.scheme(MultiplexProtocols.PING, PingRoles.SERVER, PingClientStates.PING)
+class PingServerScheme(PingScheme):
+    @csbuilder.active_activation
+    def activation(self, payload: bytes = b""):
+        return self._ping(payload)
+
+    @csbuilder.response(PingClientStates.IGNORE)
+    def resp_ignore(self, source: str, packet: CSPacket):
+        return self._resp_ignore(source, packet)
+
+    @csbuilder.response(PingClientStates.PING)
+    def resp_ping(self, source: str, packet: CSPacket):
+        return self._resp_ping(source, packet)
+
+    @csbuilder.response(PingClientStates.PONG)
+    def resp_pong(self, source: str, packet: CSPacket):
+        return self._resp_pong(source, packet)
+
+
+@csbuilder.scheme(MultiplexProtocols.PING, PingRoles.CLIENT, PingServerStates.PING)
+class PingClientScheme(PingScheme):
+    @csbuilder.active_activation
+    def activation(self, payload: bytes = b""):
+        return self._ping(payload)
+
+    @csbuilder.response(PingServerStates.IGNORE)
+    def resp_ignore(self, source: str, packet: CSPacket):
+        return self._resp_ignore(source, packet)
+
+    @csbuilder.response(PingServerStates.PING)
+    def resp_ping(self, source: str, packet: CSPacket):
+        return self._resp_ping(source, packet)
+
+    @csbuilder.response(PingServerStates.PONG)
+    def resp_pong(self, source: str, packet: CSPacket):
+        return self._resp_pong(source, packet)
@@ -0,0 +1,60 @@
+import os
+import hashlib
+
+import csbuilder
+
+from hks_pylib.done import Done
+
+from csbuilder.scheme import Scheme
+from csbuilder.scheme import SchemeResult
+
+from csbuilder.standard import Protocols, Roles, States
+from csbuilder.cspacket import CSPacket
+
+
+@csbuilder.protocols
+class OffloadProtocols(Protocols):
+    HASH = 3
+
+
+@csbuilder.roles(OffloadProtocols.HASH)
+class HashRoles(Roles):
+    SERVER = 0
+    CLIENT = 1
+
+
+@csbuilder.states(OffloadProtocols.HASH, HashRoles.CLIENT)
+class HashClientStates(States):
+    IGNORE = 0
+    DIGEST = 1
+
+
+@csbuilder.states(OffloadProtocols.HASH, HashRoles.SERVER)
+class HashServerStates(States):
+    IGNORE = 0
+    DIGEST = 1
+
+
+@csbuilder.scheme(OffloadProtocols.HASH, HashRoles.SERVER, HashClientStates.DIGEST)
+class HashServerScheme(Scheme):
+    OFFLOADED_ATTRIBUTES = ("_count", "_worker")
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._count = 0
+        self._worker = None
+        self._unshared = None
+
+    @csbuilder.response(HashClientStates.IGNORE)
+    def resp_ignore(self, source: str, packet: CSPacket):
+        return SchemeResult(None, None, False, Done(False, reason="ignore"))
+
+    @csbuilder.response(HashClientStates.DIGEST, executor="process")
+    def resp_digest(self, source: str, packet: CSPacket):
+        self._count += 1
+        self._worker = os.getpid()
+        self._unshared = "lost"
+
+        digest = hashlib.sha256(packet.payload()).digest()
+        packet = self.generate_packet(self._states.DIGEST, payload=digest)
+        return SchemeResult(source, packet, False, Done(True, count=self._count))
@@ -0,0 +1,52 @@
+import csbuilder
+
+from hks_pylib.done import Done
+
+from csbuilder.scheme import Scheme
+from csbuilder.scheme import SchemeResult
+
+from csbuilder.standard import Protocols, Roles, States
+from csbuilder.cspacket import CSPacket, PayloadSchema
+
+
+@csbuilder.protocols
+class RecordProtocols(Protocols):
+    RECORD = 4
+
+
+@csbuilder.roles(RecordProtocols.RECORD)
+class RecordRoles(Roles):
+    SERVER = 0
+    CLIENT = 1
+
+
+@csbuilder.states(RecordProtocols.RECORD, RecordRoles.CLIENT)
+class RecordClientStates(States):
+    IGNORE = 0
+    SEND = 1
+
+
+@csbuilder.states(RecordProtocols.RECORD, RecordRoles.SERVER)
+class RecordServerStates(States):
+    IGNORE = 0
+    SUCCESS = 1
+
+
+@csbuilder.scheme(RecordProtocols.RECORD, RecordRoles.SERVER, RecordClientStates.SEND)
+class RecordServerScheme(Scheme):
+    @csbuilder.response(RecordClientStates.IGNORE)
+    def resp_ignore(self, source: str, packet: CSPacket):
+        return SchemeResult(None, None, False, Done(False, reason="ignore"))
+
+    @csbuilder.response(RecordClientStates.SEND, payload=PayloadSchema([
+            ("id", "I"),
+            ("score", "d"),
+            ("name", str),
+            ("data", bytes),
+            ("tags", [str]),
+            ("values", ["h"])
+        ], name="RecordSend"))
+    def resp_send(self, source: str, packet: CSPacket):
+        record = packet.payload_obj()
+        packet = self.generate_packet(self._states.SUCCESS)
+        return SchemeResult(source, packet, False, Done(True, record=record.to_dict()))
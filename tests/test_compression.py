@@ -0,0 +1,115 @@
+import pytest
+
+import csbuilder
+
+from hkserror import HFormatError
+from csbuilder.errors.packet import PacketExtractingError
+from csbuilder.cspacket import CSPacket, CSHello
+from csbuilder.cspacket import CSFramer
+from csbuilder.compression import Codecs, CompressionPolicy, available_codecs
+from csbuilder.compression import CompressionDictionary, train_dictionary, compression_ratio
+from csbuilder.compression.train import read_payloads
+
+from tests.schemes import MyProtocols, SubmitRoles, ControlRoles
+from tests.submit_scheme import SubmitServerStates
+from tests.control_scheme import ControlDriverStatusGroup
+
+
+def test_compression():
+    payload = b"text-like payload " * 100
+    packet = CSPacket(
+            MyProtocols.SUBMIT,
+            SubmitRoles.SERVER,
+            SubmitServerStates.SUCCESS,
+            option=b"option",
+            payload=payload
+        )
+
+    for codec in available_codecs():
+        if codec == Codecs.ZLIB_DICT:
+            continue
+
+        data = packet.to_bytes(CompressionPolicy(codec, threshold=100))
+        assert len(data) < len(packet.to_bytes())
+
+        extracted = CSPacket.from_bytes(data)
+        assert extracted.option() == b"option"
+        assert extracted.payload() == payload
+
+    # The payloads below the threshold are not compressed.
+    policy = CompressionPolicy(Codecs.ZLIB, threshold=len(payload) + 1)
+    assert packet.to_bytes(policy) == packet.to_bytes()
+
+
+def test_hello():
+    hello = CSHello.from_bytes(CSHello([Codecs.ZLIB]).to_bytes())
+    assert hello.codecs == [Codecs.ZLIB]
+
+    # Unknown entries are ignored.
+    data = CSHello([Codecs.LZMA]).to_bytes() + CSHello.ENTRY.pack(200, 3) + b"xyz"
+    assert CSHello.from_bytes(data).codecs == [Codecs.LZMA]
+
+
+def test_decompression_limit():
+    packet = CSPacket(
+            MyProtocols.SUBMIT,
+            SubmitRoles.SERVER,
+            SubmitServerStates.SUCCESS,
+            payload=bytes(1024 * 1024)
+        )
+
+    for codec in available_codecs():
+        if codec == Codecs.ZLIB_DICT:
+            continue
+
+        data = packet.to_bytes(CompressionPolicy(codec))
+        assert CSPacket.from_buffer(data).payload() == bytes(1024 * 1024)
+
+        with pytest.raises(PacketExtractingError):
+            CSPacket.from_buffer(data, max_decompressed_size=1024)
+
+
+def test_policy_level():
+    CompressionPolicy(Codecs.ZLIB, level=-1)
+
+    with pytest.raises(HFormatError):
+        CompressionPolicy(Codecs.ZLIB, level=10)
+
+    if Codecs.BZ2 in available_codecs():
+        with pytest.raises(HFormatError):
+            CompressionPolicy(Codecs.BZ2, level=0)
+
+
+def test_dictionary():
+    samples = [
+        '{{"device": "sensor-{}", "status": "ok", "temperature": {}}}'.format(i, 20 + i % 7).encode()
+        for i in range(200)
+    ]
+
+    dictionary = CompressionDictionary(train_dictionary(samples, size=1024), version=1)
+    assert compression_ratio(samples, dictionary.data) < compression_ratio(samples)
+    assert csbuilder.dictionary(MyProtocols.CONTROL, dictionary) is dictionary
+
+    with pytest.raises(HFormatError):
+        CompressionPolicy(Codecs.ZLIB_DICT)
+
+    packet = CSPacket(
+            MyProtocols.CONTROL,
+            ControlRoles.DRIVER,
+            ControlDriverStatusGroup.REQUEST,
+            payload=samples[0]
+        )
+
+    policy = CompressionPolicy(Codecs.ZLIB_DICT, threshold=0, dictionary=dictionary)
+    data = packet.to_bytes(policy)
+    assert len(data) < len(packet.to_bytes())
+    assert CSPacket.from_bytes(data).payload() == samples[0]
+
+    # The hello message announces the dictionaries of Pool.
+    hello = CSHello.from_bytes(CSHello().to_bytes())
+    assert hello.dictionaries[MyProtocols.CONTROL.value] == (1, dictionary.checksum)
+
+    # The training tool reads the payloads of a capture.
+    capture = b"".join(CSFramer.to_bytes(packet) for _ in range(3))
+    assert read_payloads(capture, MyProtocols.CONTROL.value) == [samples[0]] * 3
+    assert read_payloads(capture, MyProtocols.SUBMIT.value) == []
@@ -7,9 +7,16 @@ from tests import schemes
 
 from tests.schemes import MyProtocols, SubmitRoles
 from tests.submit_scheme import SubmitServerScheme, SubmitClientScheme
+from tests.submit_scheme import SubmitClientStates, SubmitServerStates
+
+from hks_pynetwork.internal import LocalNode
 
 from csbuilder.server import Listener
 from csbuilder.client import ClientResponser
+from csbuilder.responser import Responser
+from csbuilder.cspacket import CSPacket, CSBatch, CSHello, CSFormat
+from csbuilder.cspacket.header import FORMAT_V2
+from csbuilder.compression import Codecs, CompressionPolicy, available_codecs
 
 from hks_pylib.logger import Display
 from hks_pylib.logger import StandardLoggerGenerator
@@ -82,4 +89,80 @@ def test_client_server():
     t2 = threading.Thread(target=run_client, name="CLIENT")
     t2.start()
     t1.join()
-    t2.join()
\ No newline at end of file
+    t2.join()
+
+def test_batch():
+    responser = Responser(name="Batch Responser")
+    responser.session_manager().create_session(scheme=SubmitServerScheme())
+    peer = LocalNode(name="Batch Peer")
+    responser.start(True)
+
+    batch = CSBatch.to_bytes([
+            CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.REQUEST),
+            CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND)
+        ])
+    peer.send("Node of Batch Responser", batch)
+
+    # Both responses come back in one batch.
+    _, data, _ = peer.recv()
+    responses = CSBatch.unpack(data)
+    assert [packet.state() for packet in responses] == [
+            SubmitServerStates.ACCEPT,
+            SubmitServerStates.SUCCESS
+        ]
+
+    responser.close()
+    peer.close()
+
+
+def test_negotiation():
+    responser = Responser(name="Compression Responser")
+    responser.session_manager().create_session(scheme=SubmitServerScheme())
+    responser.set_compression(MyProtocols.SUBMIT, CompressionPolicy(Codecs.ZLIB, threshold=0))
+    peer = LocalNode(name="Compression Peer")
+    responser.start(True)
+
+    # Without negotiation, nothing is compressed.
+    responser.send_response(peer.name, SubmitServerScheme().generate_packet(
+            SubmitServerStates.FAILURE, payload=b"failure" * 10))
+    _, data, _ = peer.recv()
+    assert CSPacket.from_bytes(data).payload() == b"failure" * 10
+    assert len(data) > 70
+
+    # The responser answers the hello, then compresses.
+    peer.send("Node of Compression Responser", CSHello([Codecs.ZLIB]).to_bytes())
+    _, data, _ = peer.recv()
+    assert CSHello.from_bytes(data).codecs == available_codecs()
+
+    responser.send_response(peer.name, SubmitServerScheme().generate_packet(
+            SubmitServerStates.FAILURE, payload=b"failure" * 10))
+    _, data, _ = peer.recv()
+    assert CSPacket.from_bytes(data).payload() == b"failure" * 10
+    assert len(data) < 70
+
+    responser.close()
+    peer.close()
+
+
+def test_header_format():
+    responser = Responser(name="Format Responser")
+    responser.session_manager().create_session(scheme=SubmitServerScheme())
+    responser.HEADER_FORMAT = FORMAT_V2
+    peer = LocalNode(name="Format Peer")
+    responser.start(True)
+
+    # The responser answers the hello, then switches to the v2 header.
+    peer.send("Node of Format Responser", CSHello().to_bytes())
+    _, data, _ = peer.recv()
+    assert CSHello.is_hello(data)
+    _, data, _ = peer.recv()
+    assert CSFormat.from_bytes(data) == FORMAT_V2
+
+    responser.send_response(peer.name, SubmitServerScheme().generate_packet(
+            SubmitServerStates.ACCEPT))
+    _, data, _ = peer.recv()
+    assert len(data) == 4
+    assert CSPacket.from_bytes(data, version=FORMAT_V2).state() == SubmitServerStates.ACCEPT
+
+    responser.close()
+    peer.close()
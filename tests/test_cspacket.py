@@ -1,9 +1,26 @@
+import io
+import os
+import sys
+import json
+import threading
+import subprocess
+
+import csbuilder
+
 from tests.schemes import ControlRoles, MyProtocols, SubmitRoles
 from tests.control_scheme import ControlDriverStatusGroup
-from tests.submit_scheme import SubmitServerStates
+from tests.submit_scheme import SubmitClientStates, SubmitServerStates
+from tests.submit_scheme import SubmitServerScheme
+from tests.payload_scheme import RecordProtocols, RecordRoles, RecordClientStates
 
-from csbuilder.cspacket import CSPacket
+from csbuilder.cspacket import CSPacket, CSHeader, CSHeaderV2, CSFramer, CSDeframer
+from csbuilder.cspacket.header import FORMAT_V2, encode_varint, decode_varint
 from csbuilder.cspacket.cspacket import CSPacketField
+from csbuilder.pool import Pool
+from csbuilder.session import SessionManager
+from csbuilder.standard import Protocols, Roles, States
+from csbuilder.errors.pool import PoolError
+from csbuilder.errors.packet import PacketExtractingError
 
 
 
@@ -24,5 +41,431 @@ def test_cspacketextractor_extract():
     assert packet_dict[CSPacketField.STATE] in ControlDriverStatusGroup
     assert packet_dict[CSPacketField.STATE] == ControlDriverStatusGroup.REQUEST
 
+def test_cspacket_fields():
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.IGNORE)
+    assert not hasattr(packet, "__dict__")
+
+    packet[CSPacketField.STATE] = SubmitServerStates.ACCEPT
+    packet[CSPacketField.PAYLOAD] = b"payload"
+    assert packet[CSPacketField.STATE] == packet.state() == SubmitServerStates.ACCEPT
+    assert packet[CSPacketField.ROLE] == SubmitRoles.SERVER
+    assert packet[CSPacketField.PAYLOAD] == b"payload"
+
+
+def test_cspacket_from_buffer():
+    packet = CSPacket(
+            MyProtocols.SUBMIT,
+            SubmitRoles.SERVER,
+            SubmitServerStates.SUCCESS,
+            option=b"opt",
+            payload=b"payload"
+        )
+    data = bytearray(packet.to_bytes())
+
+    for buffer in (data, memoryview(data), bytes(data)):
+        extracted = CSPacket.from_buffer(buffer)
+        assert extracted.state() == SubmitServerStates.SUCCESS
+        assert isinstance(extracted.payload(), memoryview)
+        assert extracted.payload().readonly
+        assert extracted.option() == b"opt" and extracted.payload() == b"payload"
+        assert extracted.payload(copy=True) == b"payload"
+        assert isinstance(extracted.payload(copy=True), bytes)
+
+    # The view shares memory with the receive buffer.
+    extracted = CSPacket.from_buffer(data)
+    data[-1] = ord("!")
+    assert extracted.payload() == b"payloa!"
+
+    copied = CSPacket.from_buffer(data, copy=True)
+    assert isinstance(copied.payload(), bytes)
+
+
+def test_cspacket_trusted():
+    expected = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.ACCEPT)
+
+    generated = SubmitServerScheme().generate_packet(SubmitServerStates.ACCEPT)
+    assert generated.to_bytes() == expected.to_bytes()
+
+    # The precomputed header is dropped when the packet is changed.
+    generated.state(SubmitServerStates.DENY)
+    generated.option(b"option")
+    expected = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.DENY, b"option")
+    assert generated.to_bytes() == expected.to_bytes()
+
+    extracted = CSPacket.from_bytes(expected.to_bytes())
+    assert extracted.to_bytes() == expected.to_bytes()
+    assert extracted.role() == SubmitRoles.SERVER
+
+
+def test_cspacket_to_buffers():
+    payload = b"x" * 1024
+    packet = CSPacket(
+            MyProtocols.SUBMIT,
+            SubmitRoles.CLIENT,
+            SubmitClientStates.SEND,
+            option=b"opt",
+            payload=payload
+        )
+    header, option, body = packet.to_buffers()
+    assert len(header) == CSHeader.SIZE
+    assert option == b"opt"
+    assert body is payload
+    assert b"".join(packet.to_buffers()) == packet.to_bytes()
+
+
+def test_cspacket_update_payload():
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND)
+    for i in range(100):
+        packet.update_option(b"o")
+        packet.update_payload(str(i).encode())
+
+    expected_payload = "".join(str(i) for i in range(100)).encode()
+    header, option, payload = packet.to_buffers()
+    assert payload == expected_payload and option == b"o" * 100
+
+    # The buffers are read-only views of the packet, not copies.
+    assert isinstance(payload, memoryview) and payload.readonly
+    assert payload.obj is packet.payload()
+    assert packet.payload(copy=True) == expected_payload
+
+    # An append after serializing does not change the views.
+    packet.update_payload(b"!")
+    assert payload == expected_payload
+    assert packet.payload() == expected_payload + b"!"
+    assert CSPacket.from_bytes(packet.to_bytes()).payload() == expected_payload + b"!"
+
+
+def test_csheader():
+    assert CSHeader.SIZE == 11
+
+    buffer = bytearray(3 + CSHeader.SIZE)
+    end = CSHeader.pack_into(buffer, 3, MyProtocols.CONTROL.value, 1, 2, 300)
+    assert end == 3 + CSHeader.SIZE
+    assert CSHeader.unpack_from(buffer, 3) == (MyProtocols.CONTROL.value, 1, 2, 300)
+    assert bytes(buffer[3:]) == CSHeader.pack(MyProtocols.CONTROL.value, 1, 2, 300)
+
+    try:
+        CSHeader.unpack_from(buffer, 4)
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "A truncated header must not be extracted."
+
+
+def test_cspacket_framer():
+    packets = [
+        CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND, payload=b"a" * 100),
+        CSPacket(MyProtocols.CONTROL, ControlRoles.DRIVER, ControlDriverStatusGroup.REQUEST),
+        CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.SUCCESS, option=b"o"),
+    ]
+    stream = b"".join(CSFramer.to_bytes(packet) for packet in packets)
+
+    # Many packets in one chunk.
+    deframer = CSDeframer()
+    assert [p.to_bytes() for p in deframer.feed(stream)] == [p.to_bytes() for p in packets]
+    assert len(deframer) == 0
+
+    # Packets split across many chunks, received by recv_into.
+    reader = io.BytesIO(stream)
+    deframer = CSDeframer(buffer_size=7)
+    received = []
+    while True:
+        result = deframer.fill(reader.readinto)
+        if result is None:
+            break
+        received.extend(result)
+
+    assert [p.to_bytes() for p in received] == [p.to_bytes() for p in packets]
+
+    # An invalid frame after a good packet is reported at the end of the stream.
+    bad = CSFramer.LENGTH.pack(CSHeader.SIZE) + CSHeader.pack(0xFFFF, 0, 0, 0)
+    deframer = CSDeframer()
+    assert len(deframer.feed(stream[:len(CSFramer.to_bytes(packets[0]))] + bad)) == 1
+    try:
+        deframer.close()
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "The invalid frame must be reported."
+
+    # And so is an incomplete packet.
+    reader = io.BytesIO(stream[:-1])
+    deframer = CSDeframer()
+    try:
+        while deframer.fill(reader.readinto) is not None:
+            pass
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "The incomplete packet must be reported."
+
+def test_cspacket_bytearray():
+    data = bytearray(b"payload")
+    packet = CSPacket(
+            MyProtocols.SUBMIT,
+            SubmitRoles.CLIENT,
+            SubmitClientStates.SEND,
+            option=bytearray(b"opt"),
+            payload=data
+        )
+
+    # The packet never shares a bytearray with the caller.
+    data += b"!"
+    assert packet[CSPacketField.PAYLOAD] == b"payload"
+    assert packet[CSPacketField.OPTION] == b"opt"
+
+    # Reading the payload while building it does not freeze it.
+    for i in range(10):
+        packet.update_payload(b"x")
+        assert packet.payload() == b"payload" + b"x" * (i + 1)
+        assert isinstance(packet.payload(copy=True), bytes)
+
+    assert CSPacket.from_bytes(packet.to_bytes()).payload() == b"payload" + b"x" * 10
+
+
+def test_cspacket_v2():
+    for value in [0, 1, 127, 128, 300, 2 ** 32 - 1]:
+        assert decode_varint(encode_varint(value)) == (value, len(encode_varint(value)))
+
+    try:
+        decode_varint(b"\x80\x80")
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "A truncated varint must not be decoded."
+
+    # The header of an empty option is 4 bytes instead of 11.
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.ACCEPT)
+    data = packet.to_bytes(version=FORMAT_V2)
+    assert len(data) == 4
+    assert CSHeaderV2.unpack_from(data) == (MyProtocols.SUBMIT.value, SubmitRoles.SERVER.value,
+        SubmitServerStates.ACCEPT.value, 0, 0, 4)
+
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.SUCCESS,
+        option=b"o" * 200, payload=b"payload")
+    data = packet.to_bytes(version=FORMAT_V2)
+    extracted = CSPacket.from_bytes(data, version=FORMAT_V2)
+    assert extracted.to_bytes() == packet.to_bytes()
+
+    deframer = CSDeframer(version=FORMAT_V2)
+    packets = deframer.feed(CSFramer.to_bytes(packet, version=FORMAT_V2) * 2)
+    assert [p.to_bytes() for p in packets] == [packet.to_bytes()] * 2
+
+
+def test_cspacket_opt():
+    csbuilder.option(MyProtocols.SUBMIT, "filename", 16, str)
+
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND)
+    packet.opt.set("sequence", 1)
+    packet.opt.set("filename", "a.txt")
+    packet.opt.set("sequence", 2)
+    assert packet.opt.items() == {"sequence": 2, "filename": "a.txt"}
+
+    extracted = CSPacket.from_bytes(packet.to_bytes())
+    assert extracted.opt.get("filename") == "a.txt"
+    assert extracted.opt.get("deadline") is None
+    assert "sequence" in extracted.opt
+
+    # Only the entries before the requested field are scanned.
+    extracted = CSPacket.from_bytes(packet.to_bytes())
+    assert extracted.opt.get("sequence") == 2
+    assert extracted.opt._cursor < len(extracted.option())
+
+
+def test_cspacket_payload_obj():
+    values = dict(id=7, score=0.5, name="file", data=b"\x00\x01", tags=["a", "bc"], values=[-1, 2])
+
+    packet = CSPacket(RecordProtocols.RECORD, RecordRoles.CLIENT, RecordClientStates.SEND)
+    packet.payload_obj(values)
+
+    obj = CSPacket.from_bytes(packet.to_bytes()).payload_obj()
+    assert type(obj).__name__ == "RecordSend" and not hasattr(obj, "__dict__")
+    assert obj.to_dict() == values
+
+    obj.name = "other"
+    packet.payload_obj(obj)
+    assert packet.payload_obj().name == "other"
+
+    packet.payload(packet.payload() + b"?")
+    try:
+        packet.payload_obj()
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "A payload with unexpected bytes must not be decoded."
+
+
+def test_pool_lookup():
+    assert Pool.lookup(MyProtocols.SUBMIT.value, SubmitRoles.CLIENT.value,
+        SubmitClientStates.SEND.value) == (MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND)
+
+    # SUCCESS is a state of the server, not of the client.
+    assert Pool.lookup(MyProtocols.SUBMIT.value, SubmitRoles.CLIENT.value,
+        SubmitServerStates.SUCCESS.value) is None
+    assert Pool.int2protocol(MyProtocols.CONTROL.value) is MyProtocols.CONTROL
+    assert Pool.int2role(MyProtocols.SUBMIT.value, 1) is SubmitRoles.CLIENT
+
+    data = CSHeader.pack(MyProtocols.SUBMIT.value, SubmitRoles.CLIENT.value, 9, 0)
+    try:
+        CSPacket.from_bytes(data)
+    except PacketExtractingError as e:
+        assert "Unknown state 9" in e.args[0]
+    else:
+        assert False, "An unknown state must not be extracted."
+
+
+def test_pool_snapshot():
+    snapshot = Pool.snapshot()
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.SEND, payload=b"x")
+    data = packet.to_bytes()
+
+    # A failed registration publishes nothing.
+    try:
+        csbuilder.protocols(Protocols("DuplicatedProtocols", {"NEW": 201, "OLD": MyProtocols.SUBMIT.value}))
+    except PoolError:
+        pass
+    else:
+        assert False, "A duplicated protocol must not be registered."
+
+    assert Pool.snapshot() is snapshot
+    assert Pool.int2protocol(201) is None
+
+    # Decoding goes on while protocols are registered by another thread.
+    errors = []
+    stop = threading.Event()
+
+    def decode():
+        while not stop.is_set():
+            try:
+                assert CSPacket.from_bytes(data).payload() == b"x"
+            except Exception as e:
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target=decode)
+    reader.start()
+    for i in range(20):
+        protocol = csbuilder.protocols(Protocols("RuntimeProtocols{}".format(i), {"P": 300 + i})).P
+        roles = csbuilder.roles(protocol)(Roles("RuntimeRoles{}".format(i), {"A": 0, "B": 1}))
+        csbuilder.states(protocol, roles.A)(States("RuntimeStates{}".format(i), {"IGNORE": 0}))
+
+    stop.set()
+    reader.join()
+    assert not errors
+    assert snapshot.int2protocol.get(300) is None
+    assert Pool.int2protocol(319).name == "P"
+
+    # The checks are repeated when the registry is updated, a decorator
+    # created before another registration cannot overwrite it.
+    protocol = csbuilder.protocols(Protocols("RacingProtocols", {"P": 402})).P
+    roles = csbuilder.roles(protocol)(Roles("RacingRoles", {"A": 0, "B": 1}))
+    first, second = csbuilder.states(protocol, roles.A), csbuilder.states(protocol, roles.A)
+    states = first(States("RacingStates", {"IGNORE": 0}))
+    try:
+        second(States("OtherRacingStates", {"IGNORE": 0}))
+    except PoolError:
+        pass
+    else:
+        assert False, "The states of a role must not be defined twice."
+
+    assert Pool.get_states(protocol, roles.A) is states
+
+
+LAZY_MODULE = """
+import csbuilder
+from hks_pylib.done import Done
+from csbuilder.scheme import Scheme, SchemeResult
+from csbuilder.standard import Protocols, Roles, States
+
+
+@csbuilder.protocols
+class LazyProtocols(Protocols):
+    LAZY = 401
+
+
+@csbuilder.roles(LazyProtocols.LAZY)
+class LazyRoles(Roles):
+    A = 0
+    B = 1
+
+
+@csbuilder.states(LazyProtocols.LAZY, LazyRoles.A)
+class LazyStates(States):
+    IGNORE = 0
+    PING = 1
+
+
+@csbuilder.states(LazyProtocols.LAZY, LazyRoles.B)
+class OtherLazyStates(States):
+    IGNORE = 0
+    PONG = 1
+
+
+@csbuilder.scheme(LazyProtocols.LAZY, LazyRoles.B, LazyStates.PING)
+class LazyScheme(Scheme):
+    @csbuilder.response(LazyStates.IGNORE)
+    def resp_ignore(self, source, packet):
+        return SchemeResult(None, None, False, Done(False))
+
+    @csbuilder.response(LazyStates.PING)
+    def resp_ping(self, source, packet):
+        packet = self.generate_packet(self._states.PONG, payload=packet.payload())
+        return SchemeResult(source, packet, False, Done(True))
+"""
+
+
+def test_pool_manifest(tmp_path):
+    (tmp_path / "lazy_protocols.py").write_text(LAZY_MODULE)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path)] + sys.path))
+    manifest = json.loads(subprocess.check_output([sys.executable, "-c",
+        "import json, lazy_protocols\n"
+        "from csbuilder.pool import Pool\n"
+        "print(json.dumps(Pool.export_manifest()))"], env=env))
+
+    assert manifest["protocols"][0]["modules"] == ["lazy_protocols"]
+
+    sys.path.insert(0, str(tmp_path))
+    try:
+        Pool.load_manifest(manifest)
+        assert "lazy_protocols" not in sys.modules
+        assert Pool.int2protocol(401) is None
+
+        session_manager = SessionManager(name="Lazy")
+        session_manager.create_lazy_session(401, 1)
+
+        # The module is imported by the first packet of the protocol.
+        packet = CSPacket.from_bytes(CSHeader.pack(401, 0, 1, 0) + b"ping")
+        assert "lazy_protocols" in sys.modules
+        assert packet.protocol() is sys.modules["lazy_protocols"].LazyProtocols.LAZY
+        assert packet.state() is sys.modules["lazy_protocols"].LazyStates.PING
+        assert Pool.import_protocol(401) is False
+
+        # Then the session of the protocol is created by the packet.
+        result = session_manager.respond("Somewhere", packet)
+        assert result.packet.state() is sys.modules["lazy_protocols"].OtherLazyStates.PONG
+        assert result.packet.payload() == b"ping"
+        assert not session_manager.is_lazy(packet.protocol())
+    finally:
+        sys.path.remove(str(tmp_path))
+
+    # A failed import is recorded and not retried.
+    Pool.load_manifest({"format": manifest["format"], "protocols": [
+        {"name": "MISSING", "value": 403, "modules": ["missing_protocols"], "roles": []}]})
+    try:
+        CSPacket.from_bytes(CSHeader.pack(403, 0, 1, 0))
+    except PoolError:
+        pass
+    else:
+        assert False, "A protocol which cannot be imported must not be decoded."
+
+    assert "missing_protocols" in Pool.get_import_error(403)
+    try:
+        CSPacket.from_bytes(CSHeader.pack(403, 0, 1, 0))
+    except PacketExtractingError:
+        pass
+    else:
+        assert False, "A failed import must not be retried."
+
+
 if __name__ == "__main__":
-    test_cspacketextractor_extract()
\ No newline at end of file
+    test_cspacketextractor_extract()
@@ -0,0 +1,109 @@
+import os
+import time
+import hashlib
+import threading
+
+from csbuilder.responser import Responser
+from csbuilder.dispatcher import SerialDispatcher
+
+from tests.schemes import MyProtocols, SubmitRoles
+from tests.submit_scheme import SubmitClientStates, SubmitServerStates
+from tests.submit_scheme import SubmitServerScheme
+from csbuilder.cspacket import CSPacket
+from csbuilder.session.session import Session
+from csbuilder.scheme.offload import OffloadedResponse
+
+from tests.offload_scheme import OffloadProtocols, HashRoles, HashClientStates
+from tests.offload_scheme import HashServerScheme
+
+
+def wait_until(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+
+        time.sleep(0.01)
+
+    return True
+
+
+def test_serial_dispatcher():
+    dispatcher = SerialDispatcher()
+    blocked = threading.Event()
+    done = []
+
+    dispatcher.submit("slow", blocked.wait, 5)
+    for i in range(40):
+        dispatcher.submit("slow", done.append, ("slow", i))
+        dispatcher.submit("fast", done.append, ("fast", i))
+
+    # The fast queue is not stalled by the slow one.
+    assert wait_until(lambda: len(done) == 40)
+    assert done == [("fast", i) for i in range(40)]
+
+    blocked.set()
+    assert wait_until(lambda: dispatcher.pending() == 0)
+    assert done[40:] == [("slow", i) for i in range(40)]
+
+
+def test_serial_dispatcher_error():
+    errors = []
+    dispatcher = SerialDispatcher(on_error=errors.append)
+    done = []
+
+    dispatcher.submit("key", int, "not a number")
+    dispatcher.submit("key", done.append, 1)
+
+    # The failed task is reported and the next one still runs.
+    assert wait_until(lambda: dispatcher.pending() == 0)
+    assert done == [1]
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+
+class RecordingResponser(Responser):
+    DISPATCH = True
+
+    def __init__(self) -> None:
+        super().__init__(name="Dispatching Responser")
+        self.sent = []
+
+    def send_buffers(self, destination, buffers) -> None:
+        self.sent.append((destination, CSPacket.from_bytes(b"".join(buffers))))
+
+
+def test_responser_dispatch():
+    responser = RecordingResponser()
+    responser.session_manager().create_session(scheme=SubmitServerScheme())
+
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.REQUEST)
+    assert responser.dispatch_key("Somewhere", packet) == \
+        (MyProtocols.SUBMIT, SubmitRoles.CLIENT, 0)
+
+    responser._dispatch("Somewhere", packet)
+    assert wait_until(lambda: len(responser.sent) == 1)
+    destination, response = responser.sent[0]
+    assert destination == "Somewhere"
+    assert response.state() == SubmitServerStates.ACCEPT
+
+    # A packet whose option is not a TLV sequence is dispatched too.
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.CLIENT, SubmitClientStates.IGNORE, option=b"hello-opaque")
+    responser._dispatch("Somewhere", packet)
+    assert wait_until(lambda: responser._dispatcher.pending() == 0)
+    responser.close()
+
+
+def test_process_offload():
+    scheme = HashServerScheme()
+    session = Session(scheme=scheme, name="Offload")
+    assert isinstance(session._response_methods[HashClientStates.DIGEST], OffloadedResponse)
+
+    packet = CSPacket(OffloadProtocols.HASH, HashRoles.CLIENT, HashClientStates.DIGEST, payload=b"data")
+    result = session.respond("Somewhere", packet)
+    assert result.packet.payload() == hashlib.sha256(b"data").digest()
+    assert session.wait_result(1).count == 1
+
+    # Only the offloaded attributes come back from the worker.
+    assert scheme._count == 1
+    assert scheme._worker != os.getpid()
+    assert scheme._unshared is None
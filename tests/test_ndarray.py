@@ -0,0 +1,38 @@
+import pytest
+
+from hkserror import HFormatError
+
+from csbuilder.cspacket import CSPacket
+
+from tests.schemes import MyProtocols, SubmitRoles
+from tests.submit_scheme import SubmitServerStates
+
+
+numpy = pytest.importorskip("numpy")
+
+
+def test_ndarray():
+    packet = CSPacket(MyProtocols.SUBMIT, SubmitRoles.SERVER, SubmitServerStates.SUCCESS)
+
+    for array in [
+                numpy.arange(12, dtype="<f8").reshape(3, 4),
+                numpy.arange(6, dtype=">i2"),
+                numpy.arange(24, dtype="u1").reshape(2, 3, 4)[:, 1],  # not contiguous
+                numpy.zeros((0, 5), dtype="f4")
+            ]:
+        packet.ndarray(array)
+        extracted = CSPacket.from_bytes(packet.to_bytes()).ndarray()
+        assert extracted.dtype == array.dtype and extracted.shape == array.shape
+        assert numpy.array_equal(extracted, array)
+
+    # The received array is a view into the receive buffer.
+    packet.ndarray(numpy.arange(4, dtype="<i4"))
+    buffer = bytearray(packet.to_bytes())
+    array = CSPacket.from_buffer(buffer).ndarray()
+    assert not array.flags.writeable
+
+    buffer[-4:] = (100).to_bytes(4, "little")
+    assert array[-1] == 100
+
+    with pytest.raises(HFormatError):
+        packet.ndarray(numpy.array([object()]))
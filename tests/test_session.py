@@ -1,5 +1,8 @@
 import time
+import asyncio
+import threading
 
+from hks_pylib.done import Done
 from hks_pylib.logger.logger import Display
 from hks_pylib.logger.standard import StdUsers
 from hks_pylib.logger import StandardLoggerGenerator
@@ -8,10 +11,16 @@ from csbuilder.cspacket import CSPacketField
 from csbuilder.cspacket import CSPacket
 from csbuilder.session import SessionManager
 from csbuilder.session.session import Session
+from csbuilder.session.timer import TimerScheduler
+from csbuilder.pool import Pool
 
 from tests.schemes import MyProtocols, SubmitRoles
 from tests.submit_scheme import SubmitClientStates, SubmitServerStates
 from tests.submit_scheme import SubmitServerScheme, SubmitClientScheme
+from tests.multiplex_scheme import MultiplexProtocols, PingRoles, PingClientStates, PingServerStates
+from tests.multiplex_scheme import PingServerScheme, PingClientScheme
+
+from csbuilder.errors.scheme import SchemeError
 
 
 logger_generator = StandardLoggerGenerator("tests/test_session.log")
@@ -156,5 +165,211 @@ def test_session_manager():
     assert server_scheme._step is None
 
 
+def test_session_manager_compile():
+    session_manager, scheme = set_server_session_manager()
+
+    dispatch = session_manager.compile()
+    session, response_fn = dispatch[SubmitClientStates.REQUEST]
+    assert session is session_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.SERVER)
+    assert response_fn == scheme.resp_request
+
+    # The table is frozen, and rebuilt when the sessions change.
+    try:
+        dispatch[SubmitClientStates.REQUEST] = None
+    except TypeError:
+        pass
+    else:
+        assert False, "The dispatch table must be read-only."
+
+    session_manager.create_session(scheme=SubmitClientScheme("Somewhere"))
+    assert SubmitServerStates.ACCEPT in session_manager.compile()
+
+
+def test_scheme_responses():
+    # The response functions are resolved once by @csbuilder.scheme.
+    responses = Pool.get_responses(MyProtocols.SUBMIT, SubmitRoles.SERVER)
+    assert responses[SubmitClientStates.REQUEST] is SubmitServerScheme.resp_request
+
+    scheme = SubmitServerScheme()
+    session = Session(scheme=scheme, name="Responses")
+    assert session._response_methods[SubmitClientStates.REQUEST] == scheme.resp_request
+    assert session._response_methods[SubmitClientStates.REQUEST].__self__ is scheme
+
+
+def test_timer_scheduler():
+    scheduler = TimerScheduler(max_workers=1)
+    fired = []
+    done = threading.Event()
+
+    late = scheduler.schedule(0.2, lambda: fired.append("late") or done.set())
+    canceled = scheduler.schedule(0.05, lambda: fired.append("canceled"))
+    scheduler.schedule(0.05, lambda: fired.append("early"))
+    canceled.cancel()
+
+    # A reset moves the deadline in both directions.
+    extended = scheduler.schedule(0.05, lambda: fired.append("extended"))
+    assert extended.reset(0.5)
+    late.reset(0.1)
+
+    assert done.wait(2)
+    assert fired == ["early", "late"]
+    assert not late.is_active() and not late.reset(1)
+    extended.cancel()
+
+
+def test_session_timeout():
+    sessions = []
+    timeouts = []
+    threads = threading.active_count()
+    for _ in range(50):
+        session_manager, _ = set_server_session_manager()
+        session = session_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.SERVER)
+        session._timeout = 0.1
+        session.add_timeout_hook(lambda protocol: timeouts.append(protocol))
+        session.begin()
+        sessions.append(session)
+
+    # The sessions share one scheduler instead of a thread per session.
+    assert threading.active_count() <= threads + 1 + TimerScheduler.MAX_WORKERS
+
+    deadline = time.monotonic() + 3
+    while len(timeouts) < len(sessions) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert timeouts == [MyProtocols.SUBMIT] * len(sessions)
+    assert all(not session._is_running for session in sessions)
+
+
+def test_wait_result():
+    session_manager, _ = set_server_session_manager()
+    session = session_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.SERVER)
+
+    assert session.wait_result(0.05) is None
+
+    # The waiter wakes up as soon as the result is set.
+    threading.Timer(0.05, session._set_result, args=(Done(True),)).start()
+    start = time.monotonic()
+    assert session.wait_result(2) == True
+    assert time.monotonic() - start < 0.5
+
+    # A result is given to one waiter only.
+    session._set_result(Done(False))
+    assert session.wait_result(1) == False
+    assert session.wait_result(0.05) is None
+
+    async def wait_async():
+        asyncio.get_running_loop().call_later(0.05, session._set_result, Done(True))
+        return await session.wait_result_async(2)
+
+    assert asyncio.run(wait_async()) == True
+    assert asyncio.run(session.wait_result_async(0.05)) is None
+
+
+def test_session_manager_wait():
+    session_manager, _ = set_client_session_manager()
+    session_manager.extend(set_server_session_manager()[0])
+    client = session_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.CLIENT)
+    server = session_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.SERVER)
+
+    assert session_manager.wait_any(timeout=0.05) == {}
+
+    threading.Timer(0.05, server._set_result, args=(Done(True),)).start()
+    results = session_manager.wait_any(timeout=2)
+    assert list(results.keys()) == [(MyProtocols.SUBMIT, SubmitRoles.SERVER)]
+
+    client._set_result(Done(False))
+    results = session_manager.wait_all(timeout=0.1)
+    assert results == {(MyProtocols.SUBMIT, SubmitRoles.CLIENT): False}
+
+    threading.Timer(0.05, server._set_result, args=(Done(True),)).start()
+    client._set_result(Done(False))
+    assert len(session_manager.wait_all(timeout=2)) == 2
+
+
+def set_ping_session_managers():
+    "Two peers, each of them can start a ping as a client or as a server."
+    managers = []
+    for name in ("A", "B"):
+        session_manager = SessionManager(name="Ping {}".format(name), logger_generator=logger_generator)
+        session_manager.create_session(scheme=PingClientScheme("Somewhere"), timeout=3)
+        session_manager.create_session(scheme=PingServerScheme("Somewhere"), timeout=3)
+        managers.append(session_manager)
+
+    return managers
+
+
+def test_multiplexed_sessions():
+    client_manager, server_manager = set_ping_session_managers()
+
+    # Three exchanges of the same protocol run at once, in any order.
+    started = [client_manager.activate_session(MultiplexProtocols.PING, PingRoles.CLIENT, str(i).encode())
+        for i in range(3)]
+    sessions = [session for session, _, _ in started]
+    session_ids = [session.session_id() for session in sessions]
+    assert len(set(session_ids)) == 3
+
+    for _, _, packet in reversed(started):
+        pong = server_manager.respond("Somewhere", packet).packet
+        assert pong.opt.get("session_id") in session_ids
+        assert client_manager.respond("Somewhere", pong).packet is None
+
+    for i, session in enumerate(sessions):
+        assert session.wait_result(1).payload == str(i).encode()
+        assert client_manager.get_multiplexed_session(
+            MultiplexProtocols.PING, PingRoles.CLIENT, session.session_id()) is None
+
+    # The single session of the protocol is still usable.
+    _, ping = client_manager.activate(MultiplexProtocols.PING, PingRoles.CLIENT)
+    assert "session_id" not in ping.opt
+    assert server_manager.respond("Somewhere", ping).packet.state() == PingServerStates.PONG
+
+
+def test_multiplexed_sessions_both_sides():
+    manager_a, manager_b = set_ping_session_managers()
+
+    # Both peers start their first session at once, with opposite roles.
+    session_a, _, ping_a = manager_a.activate_session(MultiplexProtocols.PING, PingRoles.SERVER, b"a")
+    session_b, _, ping_b = manager_b.activate_session(MultiplexProtocols.PING, PingRoles.CLIENT, b"b")
+
+    pong_a = manager_b.respond("Somewhere", ping_a).packet
+    pong_b = manager_a.respond("Somewhere", ping_b).packet
+    assert pong_a.state() == PingClientStates.PONG and pong_b.state() == PingServerStates.PONG
+
+    assert manager_a.respond("Somewhere", pong_a).packet is None
+    assert manager_b.respond("Somewhere", pong_b).packet is None
+    assert session_a.wait_result(1).payload == b"a"
+    assert session_b.wait_result(1).payload == b"b"
+
+
+def test_opaque_option():
+    client_manager, _ = set_client_session_manager()
+    server_manager, _ = set_server_session_manager()
+
+    # The option of a scheme which is not multiplexed is application data,
+    # even if it looks like a session id field.
+    try:
+        client_manager.activate_session(MyProtocols.SUBMIT, SubmitRoles.CLIENT)
+    except SchemeError:
+        pass
+    else:
+        assert False, "A scheme which is not multiplexed must not be multiplexed."
+
+    for option in (b"hello-opaque", b"\x06\x04\x00\x00\x00\x07"):
+        _, request_packet = client_manager.activate(MyProtocols.SUBMIT, SubmitRoles.CLIENT)
+        request_packet.option(option)
+        result = server_manager.respond("Somewhere", request_packet)
+        assert result.packet.state() == SubmitServerStates.ACCEPT
+        assert result.packet.option() == b""
+
+        server_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.SERVER).cancel()
+        client_manager.get_session(MyProtocols.SUBMIT, SubmitRoles.CLIENT).cancel()
+
+    # An unreadable session id of a multiplexed scheme goes to its session.
+    client_manager, server_manager = set_ping_session_managers()
+    _, ping = client_manager.activate(MultiplexProtocols.PING, PingRoles.CLIENT)
+    ping.option(b"\x06\x09")
+    assert server_manager.respond("Somewhere", ping).packet.state() == PingServerStates.PONG
+
+
 if __name__ == "__main__":
     test_session()